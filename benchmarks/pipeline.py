@@ -0,0 +1,149 @@
+"""
+Times each stage of a reconciliation run on synthetic Amazon settlement files and
+DATEV receipts, and writes a JSON report so runs of different versions can be compared.
+
+    python -m benchmarks.pipeline --rows 20000 --out bench.json
+    python -m benchmarks.pipeline --rows 20000 --stream --jobs 4
+"""
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+from modules import parsing
+from modules.payments import PaymentDB
+from .synthetic import generate, languages
+
+
+stages = ["load_receipts", "load_payments", "process", "save_results"]
+
+
+def git_revision() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=Path(__file__).resolve().parent)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_once(config:dict, quiet:bool=True) -> dict:
+    """
+    Runs one reconciliation and returns the wall time of each stage in seconds.
+    process is reported without the time spent in save_results.
+    """
+    timings = dict.fromkeys(stages, 0.0)
+    # every run starts cold
+    parsing.cache_clear()
+    output = io.StringIO() if quiet else sys.stdout
+    with contextlib.redirect_stdout(output):
+        source_files = sorted(Path(config["payment_source"]).glob("**/*.csv"))
+        start = time.perf_counter()
+        payment_db = PaymentDB(source_files, dict(config))
+        timings["load_receipts"] = time.perf_counter() - start
+
+        save_results = payment_db.save_results
+        def timed_save_results(*args, **kwargs):
+            begin = time.perf_counter()
+            try:
+                return save_results(*args, **kwargs)
+            finally:
+                timings["save_results"] += time.perf_counter() - begin
+        payment_db.save_results = timed_save_results
+
+        start = time.perf_counter()
+        payment_db.load_payments()
+        timings["load_payments"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        payment_db.process()
+        timings["process"] = time.perf_counter() - start - timings["save_results"]
+    return timings
+
+
+def benchmark(config:dict, repeat:int) -> dict:
+    """Best time of each stage over repeat runs"""
+    best = None
+    for _ in range(repeat):
+        timings = run_once(config)
+        if best is None:
+            best = timings
+        else:
+            best = {stage: min(best[stage], timings[stage]) for stage in stages}
+    return best
+
+
+def main():
+    parser = ArgumentParser(description="Per-stage timings of a reconciliation run on synthetic data")
+    parser.add_argument("--rows", type=int, default=10000, help="Settlement rows per marketplace")
+    parser.add_argument("--langs", default=",".join(languages), help="Marketplaces, comma separated")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the synthetic data")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the best time is reported")
+    parser.add_argument("--data", default=None, help="Directory for the synthetic data (default: temporary)")
+    parser.add_argument("--stream", action="store_true", default=False, help="Benchmark the --stream mode")
+    parser.add_argument("--jobs", type=int, default=None, help="Benchmark with worker processes")
+    parser.add_argument("--concurrency", type=int, default=None, help="Benchmark concurrent file loading")
+    parser.add_argument("--output-format", default=None, help="Benchmark writing this result format")
+    parser.add_argument("--compress", default=None, help="Benchmark compressed result files")
+    parser.add_argument("--fuzzy", action="store_true", default=False, help="Benchmark with fuzzy matching")
+    parser.add_argument("--out", default=None, help="JSON report file (default: print only)")
+    args = parser.parse_args()
+
+    langs = [lang.strip().upper() for lang in args.langs.split(",") if lang.strip()]
+    with contextlib.ExitStack() as stack:
+        data_dir = args.data
+        if data_dir is None:
+            data_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        start = time.perf_counter()
+        config = generate(Path(data_dir), args.rows, seed=args.seed, langs=langs)
+        generated = time.perf_counter() - start
+        config["stream"] = args.stream
+        config["jobs"] = args.jobs
+        config["fuzzy"] = args.fuzzy
+        config["concurrency"] = args.concurrency
+        config["output_format"] = args.output_format
+        config["compress"] = args.compress
+        timings = benchmark(config, args.repeat)
+        with open(config["receipt_source"], encoding="utf-8") as f:
+            receipts = sum(1 for _ in f) - 1
+
+    rows = args.rows * len(langs)
+    total = sum(timings.values())
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settlement_rows": rows,
+        "receipts": receipts,
+        "marketplaces": langs,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "stream": args.stream,
+        "jobs": args.jobs,
+        "fuzzy": args.fuzzy,
+        "concurrency": args.concurrency,
+        "output_format": args.output_format,
+        "compress": args.compress,
+        "generate_seconds": generated,
+        "stages": timings,
+        "total_seconds": total,
+        "rows_per_second": rows / total if total else None,
+    }
+    print("{:<16}{:>10}".format("STAGE", "SECONDS"))
+    for stage in stages:
+        print("{:<16}{:>10.3f}".format(stage, timings[stage]))
+    print("{:<16}{:>10.3f}".format("total", total))
+    print("{:.0f} settlement rows per second".format(report["rows_per_second"] or 0))
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print("Report written to {}".format(args.out))
+
+
+if __name__ == "__main__":
+    main()
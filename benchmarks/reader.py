@@ -0,0 +1,123 @@
+"""
+Time and memory of reading the columns load_payments needs from one settlement file:
+csv.DictReader with all payment_schema columns, utility.iter_csv picking the columns
+and a memory-mapped reader that only decodes the picked columns.
+
+    python -m benchmarks.reader --rows 200000
+"""
+import csv
+import gc
+import mmap
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from operator import itemgetter
+from pathlib import Path
+
+from modules.payments import PaymentDB
+from modules.utility import iter_csv, sniff_delimiter
+from .synthetic import SyntheticData, write_settlement_file
+
+
+def load_dicts(path:'Path', columns:list) -> list:
+    """All columns, the way readcsv used to load settlement files"""
+    with path.open(encoding="utf-8") as f:
+        rows = list(csv.DictReader(f, fieldnames=PaymentDB.payment_schema))
+    return rows[PaymentDB.skip_lines:]
+
+
+def load_iter_csv(path:'Path', columns:list) -> list:
+    return list(iter_csv(path, fieldset=PaymentDB.payment_schema, skip_row=PaymentDB.skip_lines, columns=columns))
+
+
+def load_mapped(path:'Path', columns:list) -> list:
+    """
+    Finds the fields of fully quoted rows in the mapped file ('","' separated, no
+    escaped quotes) and decodes the picked ones only, other rows go through csv.reader
+    """
+    schema = PaymentDB.payment_schema
+    indices = [schema.index(name) for name in columns]
+    pick = itemgetter(*indices)
+    width = len(schema)
+    with path.open("rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with buffer:
+        pos = 0
+        for _ in range(PaymentDB.skip_lines):
+            pos = buffer.find(b"\n", pos) + 1
+        delim = sniff_delimiter(buffer[pos:buffer.find(b"\n", pos)].decode("utf-8"))
+        separator = '"{}"'.format(delim).encode("utf-8")
+        rows = []
+        size = len(buffer)
+        while pos < size:
+            end = buffer.find(b"\n", min(pos + (1 << 20), size - 1))
+            end = size if end < 0 else end + 1
+            lines = buffer[pos:end].split(b"\n")
+            if lines and not lines[-1]:
+                lines.pop()
+            i = 0
+            while i < len(lines):
+                line = lines[i].rstrip(b"\r")
+                fields = line[1:-1].split(separator)
+                i += 1
+                if len(fields) == width and line.count(b'"') == 2 * width:
+                    rows.append(dict(zip(columns, b"\x1f".join(pick(fields)).decode("utf-8").split("\x1f"))))
+                    continue
+                # quoted separators, escaped quotes, line breaks in fields, short rows
+                text = [lines[i - 1].decode("utf-8")]
+                while text[-1].count('"') % 2 and i < len(lines):
+                    text[-1] = text[-1] + "\n" + lines[i].decode("utf-8")
+                    i += 1
+                for row in csv.reader(text, delimiter=delim):
+                    if row:
+                        rows.append({name: row[j] if j < len(row) else None for name, j in zip(columns, indices)})
+            pos = end
+    return rows
+
+
+loaders = (("DictReader", load_dicts), ("iter_csv", load_iter_csv), ("mmap", load_mapped))
+
+
+def measure(loader, path:'Path', columns:list, repeat:int) -> dict:
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        rows = loader(path, columns)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        del rows
+    gc.collect()
+    tracemalloc.start()
+    rows = loader(path, columns)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"rows": len(rows), "seconds": best, "bytes_per_row": current / len(rows),
+        "peak_bytes_per_row": peak / len(rows), "result": rows}
+
+
+def main():
+    parser = ArgumentParser(description="Settlement file readers compared")
+    parser.add_argument("--rows", type=int, default=200000, help="Number of synthetic settlement rows")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per reader, the best time is reported")
+    args = parser.parse_args()
+    columns = PaymentDB.payment_columns
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "settlement-bench-DE.csv"
+        write_settlement_file(path, SyntheticData().settlement_rows("DE", args.rows))
+        print("{:<12}{:>10}{:>10}{:>16}{:>21}".format("", "ROWS", "SECONDS", "BYTES PER ROW", "PEAK BYTES PER ROW"))
+        expected = None
+        for name, loader in loaders:
+            res = measure(loader, path, columns, args.repeat)
+            print("{:<12}{:>10}{:>10.3f}{:>16.0f}{:>21.0f}".format(name, res["rows"], res["seconds"],
+                res["bytes_per_row"], res["peak_bytes_per_row"]))
+            picked = [{key: row[key] for key in columns} for row in res["result"]]
+            if expected is None:
+                expected = picked
+            elif picked != expected:
+                raise Exception("{} read different rows".format(name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Memory per settlement row kept by load_payments:
+csv.DictReader dicts with all payment_schema columns against prepared Payment records.
+
+    python -m benchmarks.records_memory --rows 1000000
+"""
+import csv
+import gc
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from pathlib import Path
+
+from modules.payments import PaymentDB
+from modules.cues import CueClassifier
+from modules import parsing
+from .synthetic import SyntheticData, write_settlement_file
+
+
+def load_dicts(path:'Path') -> list:
+    """Rows the way load_payments used to keep them"""
+    with path.open(encoding="utf-8") as f:
+        rows = list(csv.DictReader(f, fieldnames=PaymentDB.payment_schema))
+    return rows[PaymentDB.skip_lines:]
+
+
+def load_records(path:'Path') -> list:
+    return PaymentDB._load_payment_file(path, CueClassifier(SyntheticData().cues))
+
+
+def measure(loader, path:'Path') -> dict:
+    parsing.cache_clear()
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = loader(path)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = len(rows)
+    del rows
+    return {"rows": count, "bytes_per_row": current / count, "peak_bytes_per_row": peak / count, "seconds": elapsed}
+
+
+def main():
+    parser = ArgumentParser(description="Memory per settlement row before and after the Payment records")
+    parser.add_argument("--rows", type=int, default=1000000, help="Number of synthetic settlement rows")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "settlement-bench-DE.csv"
+        write_settlement_file(path, SyntheticData().settlement_rows("DE", args.rows))
+        print("{:<10}{:>10}{:>16}{:>21}{:>10}".format("", "ROWS", "BYTES PER ROW", "PEAK BYTES PER ROW", "SECONDS"))
+        for name, loader in (("dict", load_dicts), ("Payment", load_records)):
+            res = measure(loader, path)
+            print("{:<10}{:>10}{:>16.0f}{:>21.0f}{:>10.2f}".format(name, res["rows"], res["bytes_per_row"], 
+                res["peak_bytes_per_row"], res["seconds"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Rows per second of formatting and writing the result and fee rows of prepared
+settlement rows: dicts copied from a template with strftime and _decimal_tostring
+per value (the way _reconcile used to build them) against RowRenderer tuples.
+
+    python -m benchmarks.rendering --rows 200000
+"""
+import csv
+import gc
+import io
+import tempfile
+import time
+from argparse import ArgumentParser
+from decimal import Decimal
+from pathlib import Path
+
+from modules.payments import PaymentDB
+from modules.cues import CueClassifier
+from modules.rendering import RowRenderer
+from .synthetic import SyntheticData, write_settlement_file
+
+
+account = "1234"
+accounts = {"Payouts": "1360", "Fees": "4970"}
+sales_account = "8400"
+amazon_account = "4970"
+
+
+def booked(prepared:'Payment') -> tuple:
+    """(gegenkonto, beleg1, total) as PaymentDB._classify books a row"""
+    if prepared.category == "Payouts":
+        return accounts["Payouts"], prepared.type, prepared.total
+    if prepared.category == "Fees":
+        return accounts["Fees"], None, prepared.total
+    return sales_account, None, prepared.product_sales + prepared.postage_credits
+
+
+def decimal_tostring(dec):
+    if not isinstance(dec, Decimal):
+        return dec
+    return str(dec).replace(".", ",")
+
+
+def render_dicts(payments:list) -> tuple:
+    result_row = dict.fromkeys(PaymentDB.result_schema)
+    fee_row = dict.fromkeys(PaymentDB.fees_schema)
+    results = []
+    fees = []
+    for prepared in payments:
+        gegenkonto, beleg1, total = booked(prepared)
+        order = prepared.order
+        if order:
+            fee = fee_row.copy()
+            fee["Umsatz in Euro"] = decimal_tostring(prepared.selling_fees)
+            fee["Gegenkonto"] = amazon_account
+            fee["Beleg1"] = order
+            fee["Beleg2"] = order
+            fee["Datum"] = prepared.date_time.strftime("%d.%m.%Y %H:%M:%S")
+            fee["Konto"] = account
+            fee["Buchungstext"] = prepared.description
+            fee["Zusatzinformation"] = prepared.type
+            fees.append(fee)
+        res = result_row.copy()
+        res["Umsatz in Euro"] = decimal_tostring(total)
+        res["Steuerschlüssel"] = decimal_tostring(total if order else None)
+        res["Gegenkonto"] = gegenkonto
+        res["Beleg1"] = beleg1
+        res["Beleg2"] = order if order else prepared.description
+        res["Datum"] = prepared.date_time.strftime("%d.%m.%Y %H:%M:%S")
+        res["Konto"] = account
+        res["Buchungstext"] = prepared.description if order else prepared.type
+        res["Zusatzinformation"] = prepared.type
+        results.append(res)
+    return results, fees
+
+
+def render_tuples(payments:list) -> tuple:
+    renderer = RowRenderer()
+    results = []
+    fees = []
+    for prepared in payments:
+        gegenkonto, beleg1, total = booked(prepared)
+        if prepared.order:
+            fees.append(renderer.fee(prepared, account, amazon_account))
+        results.append(renderer.result(prepared, account, total, total if prepared.order else None, gegenkonto, beleg1))
+    return results, fees
+
+
+def write_dicts(rows:list, fieldnames:list) -> str:
+    output = io.StringIO(newline="")
+    writer = csv.DictWriter(output, fieldnames=fieldnames, extrasaction='ignore', delimiter=';', quoting=csv.QUOTE_MINIMAL)
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+def write_tuples(rows:list, fieldnames:list) -> str:
+    output = io.StringIO(newline="")
+    writer = csv.writer(output, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+    writer.writerow(fieldnames)
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+engines = (("dicts", render_dicts, write_dicts), ("tuples", render_tuples, write_tuples))
+
+
+def measure(render, write, payments:list, repeat:int) -> dict:
+    best_render = best_total = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        results, fees = render(payments)
+        rendered = time.perf_counter()
+        text = write(results, PaymentDB.result_schema) + write(fees, PaymentDB.fees_schema)
+        end = time.perf_counter()
+        best_render = rendered - start if best_render is None else min(best_render, rendered - start)
+        best_total = end - start if best_total is None else min(best_total, end - start)
+    return {"render": best_render, "total": best_total, "text": text}
+
+
+def main():
+    parser = ArgumentParser(description="Result row formatting with dicts and RowRenderer tuples")
+    parser.add_argument("--rows", type=int, default=200000, help="Number of synthetic settlement rows")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per engine, the best time is reported")
+    args = parser.parse_args()
+    data = SyntheticData()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "settlement-bench-DE.csv"
+        write_settlement_file(path, data.settlement_rows("DE", args.rows))
+        payments = PaymentDB._load_payment_file(path, CueClassifier(data.cues))
+    print("{:<10}{:>10}{:>20}{:>24}".format("", "ROWS", "RENDER ROWS/SEC", "RENDER+WRITE ROWS/SEC"))
+    expected = None
+    for name, render, write in engines:
+        res = measure(render, write, payments, args.repeat)
+        print("{:<10}{:>10}{:>20.0f}{:>24.0f}".format(name, len(payments), len(payments) / res["render"],
+            len(payments) / res["total"]))
+        if expected is None:
+            expected = res["text"]
+        elif res["text"] != expected:
+            raise Exception("{} wrote different rows".format(name))
+
+
+if __name__ == "__main__":
+    main()
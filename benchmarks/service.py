@@ -0,0 +1,91 @@
+"""
+Latency of the query service on the results of a synthetic reconciliation run:
+lookups answered by the index in process and over HTTP on localhost (one kept-alive
+connection), with the median and the 99th percentile per kind of request.
+
+    python -m benchmarks.service --rows 20000 --requests 2000
+"""
+import http.client
+import json
+import random
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+from modules.service import ResultService
+from .pipeline import run_once
+from .synthetic import generate
+
+
+def percentiles(seconds:list) -> tuple:
+    """(median, 99th percentile) in microseconds"""
+    ordered = sorted(seconds)
+    return (ordered[len(ordered) // 2] * 1e6, ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e6)
+
+
+def targets(index:'ResultIndex', count:int, seed:int=1) -> dict:
+    """Request paths of each kind, for orders, Beleg1 and settlements found in the results"""
+    rnd = random.Random(seed)
+    orders = list(index._by_order)
+    belege = list(index._by_beleg1)
+    settlements = list(index.settlements or [])
+    days = sorted({key[:8] for key in index._date_keys})
+    requests = {
+        "order": ["/orders/" + rnd.choice(orders) for _ in range(count)],
+        "beleg1": ["/beleg1/" + rnd.choice(belege) for _ in range(count)],
+        "rows (one day)": [],
+    }
+    for _ in range(count):
+        day = rnd.choice(days)
+        day = "{}-{}-{}".format(day[:4], day[4:6], day[6:8])
+        requests["rows (one day)"].append("/rows?from={0}&to={0}&limit=100".format(day))
+    if settlements:
+        requests["settlement"] = ["/settlements/" + rnd.choice(settlements) for _ in range(count)]
+    return requests
+
+
+def main():
+    parser = ArgumentParser(description="Lookup latency of the query service")
+    parser.add_argument("--rows", type=int, default=20000, help="Settlement rows per marketplace")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests of each kind")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        config = generate(Path(tmp), args.rows)
+        config["rollups"] = True
+        run_once(config)
+        service = ResultService(config)
+        index = service.load()
+        requests = targets(index, args.requests)
+        server = service.server(port=0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        connection = http.client.HTTPConnection(*server.server_address[:2])
+        print()
+        print("{:<16}{:>14}{:>14}{:>14}{:>14}".format("", "INDEX P50 µs", "INDEX P99 µs", "HTTP P50 µs", "HTTP P99 µs"))
+        try:
+            for name, paths in requests.items():
+                local = []
+                for path in paths:
+                    start = time.perf_counter()
+                    service.answer(path)
+                    local.append(time.perf_counter() - start)
+                remote = []
+                for path in paths:
+                    start = time.perf_counter()
+                    connection.request("GET", path)
+                    response = connection.getresponse()
+                    body = json.loads(response.read())
+                    remote.append(time.perf_counter() - start)
+                    if response.status != 200:
+                        raise Exception("{} answered {}: {}".format(path, response.status, body))
+                print("{:<16}{:>14.0f}{:>14.0f}{:>14.0f}{:>14.0f}".format(name, *percentiles(local), *percentiles(remote)))
+        finally:
+            connection.close()
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
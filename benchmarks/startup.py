@@ -0,0 +1,77 @@
+"""
+Cold-start import time of the CLI, measured with python -X importtime in fresh
+interpreters. Exits with status 1 when the imports take longer than the budget,
+so it can guard against slow imports creeping back into the normal path.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --budget-ms 60 --repeat 10
+"""
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+
+root = Path(__file__).resolve().parent.parent
+
+# what a normal run imports before it starts loading files
+statement = "import main, modules.payments"
+
+
+def import_times(statement:str=statement) -> list:
+    """
+    (module, self microseconds, cumulative microseconds, depth) of each import in a fresh interpreter
+    """
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], capture_output=True, text=True,
+        cwd=str(root), check=True)
+    times = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        times.append((name.strip(), int(own), int(cumulative), depth))
+    return times
+
+
+def cli_import_us(times:list) -> int:
+    """Time spent importing the CLI modules, without the interpreter startup (site, encodings)"""
+    return sum(cumulative for name, _, cumulative, depth in times if depth == 0 and (name == "main" or name.startswith("modules")))
+
+
+def help_seconds() -> float:
+    """Wall time of main.py --help, interpreter start included"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "main.py", "--help"], capture_output=True, cwd=str(root), check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description="Cold-start import time of the CLI against a budget")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters, the best time is reported")
+    parser.add_argument("--budget-ms", type=float, default=100.0, help="Largest import time of the CLI modules")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    args = parser.parse_args()
+
+    best = None
+    for _ in range(args.repeat):
+        times = import_times()
+        if best is None or cli_import_us(times) < cli_import_us(best):
+            best = times
+    imports_ms = cli_import_us(best) / 1000
+    help_ms = min(help_seconds() for _ in range(args.repeat)) * 1000
+
+    print("{:<40}{:>12}".format("SLOWEST IMPORTS", "SELF MS"))
+    for name, own, _, _ in sorted(best, key=lambda x: -x[1])[:args.top]:
+        print("{:<40}{:>12.1f}".format(name, own / 1000))
+    print()
+    print("main.py --help: {:.1f} ms".format(help_ms))
+    print("CLI imports ({}): {:.1f} ms, budget {:.1f} ms".format(statement, imports_ms, args.budget_ms))
+    if imports_ms > args.budget_ms:
+        print("[ERROR] Import time over budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
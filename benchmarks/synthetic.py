@@ -0,0 +1,255 @@
+"""
+Synthetic Amazon settlement rows and DATEV receipts for benchmarks
+"""
+import csv
+import json
+import random
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+
+cuelines_file = Path(__file__).resolve().parent.parent / "dailycommerce-cli-payment-reconciliation-amazon-cuelines.json"
+
+languages = ["DE", "FR", "IT", "ES", "UK"]
+
+# index of each language's cueline in the cuelines JSON
+cue_index = {"DE": 4, "FR": 2, "IT": 1, "ES": 3, "UK": 0}
+payout_index = {"DE": 0, "FR": 2, "IT": 3, "ES": 1, "UK": 4}
+
+month_names = {
+    "FR": ["janv.", "févr.", "mars", "avr.", "mai", "juin", "juil.", "août", "sept.", "oct.", "nov.", "déc."],
+    "IT": ["gen", "feb", "mar", "apr", "mag", "giu", "lug", "ago", "set", "ott", "nov", "dic"],
+    "ES": ["ene.", "feb.", "mar.", "abr.", "may.", "jun.", "jul.", "ago.", "sept.", "oct.", "nov.", "dic."],
+    "UK": ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"],
+}
+
+payment_schema = ["date/time", "settlement id", "type", "order id", "sku", "description", "quantity", "marketplace",
+    "fulfilment", "order city", "order state", "order postal", "tax collection model", "product sales", "product sales tax",
+    "postage credits", "shipping credits tax", "gift wrap credits", "giftwrap credits tax", "promotional rebates",
+    "promotional rebates tax", "marketplace withheld tax", "selling fees", "fba fees", "other transaction fees", "other", "total"]
+
+receipt_schema = ["Umsatz in Euro", "Steuerschlüssel", "Gegenkonto", "Beleg1", "Beleg2", "Datum", "Konto", "Kost1", "Kost2",
+    "Skonto in Euro", "Buchungstext", "Umsatzsteuer-ID", "Zusatzart", "Zusatzinformation"]
+
+marketplaces = {"DE": "amazon.de", "FR": "amazon.fr", "IT": "amazon.it", "ES": "amazon.es", "UK": "amazon.co.uk"}
+
+
+def load_cues(path=cuelines_file) -> dict:
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    return {cue["parameter"]: cue["cuelines"] for cue in data["cues"]}
+
+
+def format_amount(amount:'Decimal', lang:str) -> str:
+    """Amount the way the marketplace writes it: 1.234,56 or 1234.56 for UK"""
+    text = "{:.2f}".format(amount)
+    if lang == "UK":
+        return text
+    sign = ""
+    if text.startswith("-"):
+        sign = "-"
+        text = text[1:]
+    whole, cents = text.split(".")
+    if len(whole) > 3:
+        whole = whole[:-3] + "." + whole[-3:]
+    return sign + whole + "," + cents
+
+
+def format_date_time(dt:'datetime', lang:str) -> str:
+    """Date/time the way the marketplace writes it: 03.01.2018 09:41:31 UTC or 9 ene. 2018 12:33:58 UTC"""
+    if lang == "DE":
+        return dt.strftime("%d.%m.%Y %H:%M:%S UTC")
+    return "{} {} {} {} UTC".format(dt.day, month_names[lang][dt.month - 1], dt.year, dt.strftime("%H:%M:%S"))
+
+
+def swap_digits(order:str, rnd:'random.Random') -> str:
+    """Order id with two neighbouring digits swapped"""
+    positions = [i for i in range(len(order) - 1) if order[i].isdigit() and order[i + 1].isdigit()
+        and order[i] != order[i + 1]]
+    if not positions:
+        return order
+    i = rnd.choice(positions)
+    return order[:i] + order[i + 1] + order[i] + order[i + 2:]
+
+
+class SyntheticData:
+    """
+    Generates settlement rows of all marketplaces and the receipts matching them.
+
+    Prices come from a fixed catalogue and rows of one settlement share a few
+    timestamps, so values repeat the way they do in real exports. Most orders get
+    a receipt, refunds get a credit note ("-CO"), some receipts are left unassigned,
+    some amounts differ from the receipts and some receipts have a typo in the order id.
+    """
+
+    def __init__(self, seed:int=1, cues:dict=None, start:'datetime'=datetime(2018, 1, 1)):
+        self.random = random.Random(seed)
+        self.cues = cues if cues is not None else load_cues()
+        self.start = start
+        self.receipts = []
+        self._orders = 0
+        self.catalogue = [(self.random.randint(1, 2500) * 100 - 1, "Product {}".format(i)) for i in range(500)]
+
+    def _types(self, lang:str) -> tuple:
+        cues = self.cues
+        index = cue_index[lang]
+        return (cues["Sales"][index], cues["Refund"][index], cues["Payouts"][payout_index[lang]], cues["Fees"][0])
+
+    def settlement_rows(self, lang:str, count:int):
+        """
+        Yields count settlement rows of a marketplace as dicts with all payment_schema columns
+        """
+        rnd = self.random
+        sale_type, refund_type, payout_type, fee_type = self._types(lang)
+        orders = []
+        settlement = 1000
+        dt = self.start
+        for i in range(count):
+            if i % 200 == 0:
+                settlement += 1
+            if rnd.random() < 0.3:
+                dt = dt + timedelta(minutes=rnd.randint(1, 30))
+            row = dict.fromkeys(payment_schema, "")
+            row["date/time"] = format_date_time(dt, lang)
+            row["settlement id"] = str(settlement)
+            r = rnd.random()
+            if r < 0.03:
+                row["type"] = payout_type
+                row["total"] = format_amount(Decimal(-rnd.randint(10000, 900000)) / 100, lang)
+            elif r < 0.08:
+                row["type"] = fee_type
+                row["description"] = "Servicegebühr"
+                row["total"] = format_amount(Decimal(-rnd.randint(100, 9000)) / 100, lang)
+            else:
+                is_refund = r < 0.16 and orders
+                if is_refund:
+                    order = rnd.choice(orders)
+                else:
+                    self._orders += 1
+                    order = "{:03d}-{:07d}-{:07d}".format(rnd.randint(100, 999), self._orders, rnd.randint(0, 9999999))
+                    orders.append(order)
+                cents, description = rnd.choice(self.catalogue)
+                sales = Decimal(cents) / 100
+                postage = Decimal(rnd.choice([0, 299, 499])) / 100
+                if is_refund:
+                    sales, postage = -sales, -postage
+                fees = (-(sales + postage) * Decimal("0.15")).quantize(Decimal("0.01"))
+                row["type"] = refund_type if is_refund else sale_type
+                row["order id"] = order
+                row["sku"] = "SKU-{}".format(cents)
+                row["description"] = description
+                row["quantity"] = "1"
+                row["marketplace"] = marketplaces[lang]
+                row["fulfilment"] = "Amazon"
+                row["product sales"] = format_amount(sales, lang)
+                row["postage credits"] = format_amount(postage, lang)
+                row["selling fees"] = format_amount(fees, lang)
+                row["total"] = format_amount(sales + postage + fees, lang)
+                self._add_receipts(order, dt, sales, postage, is_refund)
+            yield row
+
+    def _add_receipts(self, order, dt, sales, postage, is_refund):
+        rnd = self.random
+        r = rnd.random()
+        if r >= 0.85:
+            # no receipt -> #UNKNOWN!
+            return
+        beleg1 = "RE-{}".format(len(self.receipts))
+        if is_refund:
+            beleg1 = beleg1 + "-CO"
+        total = sales + postage if r < 0.8 else sales      # -> #DIFF!
+        parts = [total] if rnd.random() < 0.7 else [total - postage, postage]
+        if rnd.random() < 0.02:
+            # typo in the order id -> #UNKNOWN!, found by fuzzy matching
+            order = swap_digits(order, rnd)
+        for part in parts:
+            receipt = dict.fromkeys(receipt_schema, "")
+            receipt["Umsatz in Euro"] = format_amount(part, "DE")
+            receipt["Beleg1"] = beleg1
+            receipt["Beleg2"] = order
+            receipt["Datum"] = dt.strftime("%d%m")
+            receipt["Konto"] = "8400"
+            receipt["Buchungstext"] = "Rechnung"
+            receipt["Zusatzinformation"] = order
+            self.receipts.append(receipt)
+
+    def unassigned_receipts(self, count:int) -> list:
+        """Adds count receipts no settlement row refers to"""
+        added = []
+        for i in range(count):
+            receipt = dict.fromkeys(receipt_schema, "")
+            receipt["Umsatz in Euro"] = format_amount(Decimal(self.random.randint(100, 10000)) / 100, "DE")
+            receipt["Beleg1"] = "X-{}".format(i)
+            receipt["Zusatzinformation"] = "999-{:07d}-0000000".format(i)
+            added.append(receipt)
+        self.receipts.extend(added)
+        return added
+
+
+def write_settlement_file(path:'Path', rows, preamble:int=8) -> int:
+    """
+    Writes settlement rows the way Amazon exports them: preamble lines, the header
+    and quoted comma separated rows
+
+    :param rows: iterable of dicts with the payment_schema columns
+    :param preamble: number of lines before the first row, including the header
+    :returns: number of rows written
+    """
+    count = 0
+    with Path(path).open("w", encoding="utf-8", newline="") as f:
+        for i in range(preamble - 1):
+            f.write('"Synthetic settlement report, preamble line {}"\n'.format(i + 1))
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(payment_schema)
+        for row in rows:
+            writer.writerow([row[key] for key in payment_schema])
+            count += 1
+    return count
+
+
+def write_receipts_file(path:'Path', receipts:list) -> None:
+    """Writes receipts as a DATEV semicolon csv file"""
+    with Path(path).open("w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=receipt_schema, delimiter=";")
+        writer.writeheader()
+        writer.writerows(receipts)
+
+
+def generate(directory:'Path', rows:int, seed:int=1, langs:list=languages, unassigned:float=0.1) -> dict:
+    """
+    Generates one settlement file per marketplace and the matching receipts file
+
+    :param directory: target directory, gets payment_source/, receipts_source/ and results/
+    :param rows: settlement rows per marketplace
+    :param unassigned: share of extra receipts no settlement row refers to
+    :returns: configuration for PaymentDB pointing at the generated files
+    """
+    directory = Path(directory)
+    payment_source = directory / "payment_source"
+    receipt_source = directory / "receipts_source" / "receipts-source.csv"
+    results = directory / "results"
+    for d in (payment_source, receipt_source.parent, results):
+        d.mkdir(parents=True, exist_ok=True)
+    data = SyntheticData(seed)
+    for lang in langs:
+        write_settlement_file(payment_source / "settlement-synthetic-{}.csv".format(lang), data.settlement_rows(lang, rows))
+    data.unassigned_receipts(int(len(data.receipts) * unassigned))
+    data.random.shuffle(data.receipts)
+    write_receipts_file(receipt_source, data.receipts)
+    return {
+        "payment_source": str(payment_source),
+        "receipt_source": str(receipt_source),
+        "results": str(results),
+        "result_amazon-fees": "result-amazon-fees.csv",
+        "result_payments_assigned": "result-payments-assigned.csv",
+        "result_report": "result-report.csv",
+        "account_DE": "1840",
+        "account_FR": "1841",
+        "account_IT": "1842",
+        "account_ES": "1843",
+        "account_UK": "1844",
+        "amazon_account": "70001",
+        "sales_account": "20018",
+        "account_bank": "1460",
+        "debug": False,
+    }
@@ -5,7 +5,8 @@ import time
 from pathlib import Path
 from argparse import Namespace, ArgumentParser
 
-from modules.payments import PaymentDB
+# the reconciliation modules are imported in main() after the arguments are parsed,
+# so --help and argument errors don't pay for them
 
 
 
@@ -40,7 +41,8 @@ def all_files_with_ext(source_name: str, ext:str) -> list:
             message = "[Error] Invalid file type %s" % source_name
             raise Exception(message)
     elif source_path.is_dir():
-        all_files = list(source_path.glob("**/*{}".format(ext)))
+        # in path order like the --concurrency loader, glob order depends on the file system
+        all_files = sorted(source_path.glob("**/*{}".format(ext)))
         if len(all_files) == 0:
             print("Folder %s is empty" % source_name)
         return all_files
@@ -72,25 +74,321 @@ def parse_comand_line(dir_path: 'Path') -> 'Namespace':
         default=dir_path / "dailycommerce-cli-payment-reconciliation-amazon-config.json",
         help="Path to configuration file",
     )
+    parser.add_argument(
+        "-s",
+        "--stream",
+        dest="stream",
+        action="store_true",
+        default=False,
+        help="Stream settlement rows straight into the result files instead of loading them all into memory",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes loading and parsing settlement files",
+    )
+    parser.add_argument(
+        "--shards",
+        dest="shards",
+        type=int,
+        default=None,
+        help="Partition receipts and settlement rows by order id into this many on-disk shards and reconcile "
+             "them one by one (or with --jobs in parallel), for receipt files larger than memory",
+    )
+    parser.add_argument(
+        "--shard-dir",
+        dest="shard_dir",
+        default=None,
+        help="Directory of the temporary shard files (default: the results directory)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        dest="concurrency",
+        type=int,
+        default=None,
+        help="Find and read settlement files with this many concurrent file system calls (for slow network shares), "
+             "not with --stream",
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        dest="incremental",
+        action="store_true",
+        default=False,
+        help="Only process settlement files not processed before and append to the result files",
+    )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        dest="watch",
+        action="store_true",
+        default=False,
+        help="Keep running and reconcile new settlement files as they arrive (implies --incremental)",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        dest="watch_interval",
+        type=float,
+        default=None,
+        help="Seconds between two scans of the watched directories where inotify isn't available (default: 2)",
+    )
+    parser.add_argument(
+        "--state-file",
+        dest="state_file",
+        default=None,
+        help="State file of incremental runs (default: reconciliation-state.sqlite in the results directory, "
+             "reconciliation-totals-state.sqlite with --totals-only)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        dest="checkpoint",
+        action="store_true",
+        default=False,
+        help="Save the progress after each settlement file and every --checkpoint-rows rows, so an interrupted "
+             "run can be continued with --resume",
+    )
+    parser.add_argument(
+        "--checkpoint-rows",
+        dest="checkpoint_rows",
+        type=int,
+        default=None,
+        help="Settlement rows between two checkpoints within a file (default: 100000)",
+    )
+    parser.add_argument(
+        "--checkpoint-file",
+        dest="checkpoint_file",
+        default=None,
+        help="Checkpoint file (default: reconciliation-checkpoint.pickle in the results directory)",
+    )
+    parser.add_argument(
+        "--resume",
+        dest="resume",
+        action="store_true",
+        default=False,
+        help="Continue an interrupted run from its last checkpoint, implies --checkpoint",
+    )
+    parser.add_argument(
+        "--cache",
+        dest="cache",
+        action="store_true",
+        default=False,
+        help="Keep parsed settlement and receipt files in an on-disk cache, so unchanged files aren't parsed again",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        default=None,
+        help="Directory of the parsed file cache, implies --cache (default: parsed-cache in the results directory)",
+    )
+    parser.add_argument(
+        "-t",
+        "--totals-only",
+        dest="totals_only",
+        action="store_true",
+        default=False,
+        help="Only compute the report totals (result-report.csv) with the columnar engine, no receipt matching",
+    )
+    parser.add_argument(
+        "--cue-matching",
+        dest="cue_matching",
+        choices=["exact", "normalized", "substring"],
+        default=None,
+        help="How settlement types not listed in the cuelines are classified (default: exact, they are sales). "
+             "normalized ignores case, accents and spaces, substring also finds cuelines inside the type",
+    )
+    parser.add_argument(
+        "-f",
+        "--fuzzy",
+        dest="fuzzy",
+        action="store_true",
+        default=False,
+        help="Suggest receipts for #UNKNOWN! orders in result-fuzzy-matches.csv",
+    )
+    parser.add_argument(
+        "--receipt-dir",
+        dest="receipt_dir",
+        default=None,
+        help="Directory of the receipt pdf files (named after Beleg1), exported into receipts_assigned/receipts_unassigned",
+    )
+    parser.add_argument(
+        "--output-format",
+        dest="output_format",
+        choices=["csv", "parquet", "arrow", "columns"],
+        default=None,
+        help="Format of the result files (default: csv). parquet and arrow need pyarrow, "
+             "columns is a JSON lines file of column lists",
+    )
+    parser.add_argument(
+        "--compress",
+        dest="compress",
+        choices=["gzip", "zstd"],
+        default=None,
+        help="Compress the result files (zstd needs the zstandard package)",
+    )
+    parser.add_argument(
+        "--rollups",
+        dest="rollups",
+        action="store_true",
+        default=False,
+        help="Add up the settlement rows by settlement id, account, day and category into result-rollups.sqlite "
+             "for drill-down queries (see the query command)",
+    )
+    parser.add_argument(
+        "--rollups-file",
+        dest="rollups_file",
+        default=None,
+        help="Rollup file written with --rollups and read by query (default: result-rollups.sqlite in the results directory)",
+    )
+    parser.add_argument(
+        "--metrics-out",
+        dest="metrics_out",
+        default=None,
+        help="Write wall/CPU time, rows and peak memory of each stage into this JSON file",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        nargs="?",
+        const="reconciliation.prof",
+        default=None,
+        help="Print the metrics of each stage and dump cProfile stats into this file (default: reconciliation.prof)",
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    query = commands.add_parser(
+        "query",
+        help="Totals from the rollup file of earlier runs, without reprocessing anything",
+        description="Totals from the rollup file of earlier --rollups runs, e.g. query --settlement 1000 --by day",
+    )
+    query.add_argument(
+        "--by",
+        dest="query_by",
+        nargs="*",
+        choices=["settlement_id", "account", "day", "category"],
+        default=None,
+        help="Group by these columns (default: settlement_id), none for one grand total",
+    )
+    query.add_argument("--settlement", dest="query_settlement", default=None, help="Only this settlement id")
+    query.add_argument("--account", dest="query_account", default=None, help="Only this marketplace account")
+    query.add_argument("--day", dest="query_day", default=None, help="Only this day (YYYY-MM-DD)")
+    query.add_argument("--from", dest="query_from", default=None, help="From this day on (YYYY-MM-DD)")
+    query.add_argument("--to", dest="query_to", default=None, help="Up to this day (YYYY-MM-DD)")
+    query.add_argument("--category", dest="query_category", choices=["Sales", "Refund", "Payouts", "Fees"],
+        default=None, help="Only this category")
+    serve = commands.add_parser(
+        "serve",
+        help="Answer lookups from the result files of the latest run over HTTP/JSON",
+        description="Local read-only HTTP/JSON service over the result files of the latest run, reloaded "
+                    "when a new run finished: /orders/<order id>, /beleg1/<Beleg1>, /settlements/<settlement id>, "
+                    "/rows?from=YYYY-MM-DD&to=YYYY-MM-DD, /status",
+    )
+    serve.add_argument("--host", dest="serve_host", default=None, help="Address to listen on (default: 127.0.0.1)")
+    serve.add_argument("--port", dest="serve_port", type=int, default=None, help="Port to listen on (default: 8765)")
+    serve.add_argument("--reload-interval", dest="serve_interval", type=float, default=None,
+        help="Seconds between two checks for new result files (default: 2)")
     
     args = parser.parse_args()
     return args
 
 
+def run_query(config:dict) -> None:
+    """
+    Prints the totals of the rollup file asked for by the query command
+    """
+    from modules.payments import result_directory, rollups_file
+    from modules.rollups import print_query
+    path = config.get("rollups_file", None)
+    if path is None:
+        path = (result_directory(config) or Path(".")) / rollups_file
+    day = config.get("query_day", None)
+    print_query(path, config["query_by"] if config.get("query_by") is not None else ["settlement_id"],
+        settlement_id=config.get("query_settlement", None), account=config.get("query_account", None),
+        day_from=day or config.get("query_from", None), day_to=day or config.get("query_to", None),
+        category=config.get("query_category", None))
+
+
+def run_service(config:dict) -> None:
+    """
+    Serves the result files of the latest run until interrupted
+    """
+    from modules.service import ResultService
+    service = ResultService(config, interval=float(config.get("serve_interval", 2)))
+    service.serve(config.get("serve_host", "127.0.0.1"), int(config.get("serve_port", 8765)))
+
+
+def save_metrics(args:'Namespace', metrics:'Metrics', profiler, classification:dict) -> None:
+    """
+    Dumps the cProfile stats and prints and saves the stage metrics asked for with --profile and --metrics-out
+
+    :param classification: rows per category of each settlement file
+    """
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    if metrics.enabled:
+        print()
+        metrics.print_table()
+        if args.metrics_out:
+            from modules.parsing import cache_stats
+            metrics.save(args.metrics_out, {"parser_cache": cache_stats(), "classification": classification})
+            print("Metrics written to {}".format(args.metrics_out))
+        if profiler is not None:
+            print("cProfile stats written to {}".format(args.profile))
+
+
 def main():
     tt = time.time()
     parent_directory = Path(__file__).resolve().parent
     args = parse_comand_line(parent_directory)
-    config = load_config(args)
+    if args.command == "query":
+        config = load_config(args)
+        config.update((key, val) for key, val in vars(args).items() if val != None)
+        run_query(config)
+        return
+    if args.command == "serve":
+        config = load_config(args)
+        config.update((key, val) for key, val in vars(args).items() if val != None)
+        run_service(config)
+        return
+    from modules.payments import PaymentDB
+    from modules.metrics import Metrics
+    metrics = Metrics(enabled=bool(args.metrics_out or args.profile))
+    with metrics.stage("load config"):
+        config = load_config(args)
     args_list = [(key, val) for key, val in vars(args).items() if val != None]
     config.update(args_list)
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
     
+    if config.get("watch", False):
+        from modules.daemon import WatchDaemon
+        daemon = WatchDaemon(config, metrics=metrics, interval=float(config.get("watch_interval", 2)))
+        try:
+            daemon.run()
+        finally:
+            save_metrics(args, metrics, profiler,
+                daemon.payment_db.classification if daemon.payment_db is not None else {})
+        return
+
     payment_source = config["payment_source"]
-    source_files = all_files_with_ext(payment_source, ".csv")
-    payment_db = PaymentDB(source_files, config)
+    if config.get("concurrency"):
+        # searched while the files are loaded, see PaymentDB.load_payments
+        source_files = Path(payment_source)
+    else:
+        with metrics.stage("find settlement files") as stage:
+            source_files = all_files_with_ext(payment_source, ".csv")
+            stage["rows"] = len(source_files)
+    payment_db = PaymentDB(source_files, config, metrics=metrics)
     payment_db.load_payments()
     
-    if payment_db.process():
+    done = payment_db.process()
+    save_metrics(args, metrics, profiler, payment_db.classification)
+    if done:
         print("All done in {} seconds".format(time.time() - tt))
         
 
@@ -0,0 +1,147 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from hashlib import sha256
+from pathlib import Path
+
+from .utility import file_digest
+
+
+class ParsedFileCache:
+    """
+    On-disk cache of parsed input files, so reruns with unchanged settlement and
+    receipt files don't parse them again.
+
+    Entries are pickle files keyed by the content hash of the input file, the kind of
+    data and a variant (e.g. a hash of the cuelines the rows were classified with).
+    The hash of a file is only recomputed when its path, size or modification time
+    changed. The cache is kept below max_bytes by removing the least recently used
+    entries. It can be used from several threads.
+    """
+
+    # part of every key, changing it drops all entries written before
+    version = 2
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT);
+        CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, kind TEXT, path TEXT, bytes INTEGER, used REAL);
+    """
+
+    def __init__(self, directory:'Path', max_bytes:int=1 << 30):
+        """
+        :param directory: cache directory, created if needed
+        :param max_bytes: largest total size of the entries
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.directory / "index.sqlite"), check_same_thread=False)
+        self._db.executescript(self.schema)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def size(self) -> int:
+        """Total size of the entries in bytes"""
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM entries").fetchone()[0]
+
+    def digest(self, path:'Path') -> str:
+        """
+        Content hash of a file, reused while its size and modification time are the same
+        """
+        path = Path(path).resolve()
+        stat = path.stat()
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime_ns, digest FROM files WHERE path = ?", (str(path),)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        digest = file_digest(path)
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                (str(path), stat.st_size, stat.st_mtime_ns, digest))
+        return digest
+
+    def key(self, kind:str, path:'Path', variant:str="") -> str:
+        content = "\x1f".join((str(self.version), kind, self.digest(path), variant))
+        return sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, kind:str, path:'Path', variant:str=""):
+        """
+        Cached data of a file
+
+        :returns: (True, data) or (False, None) if there is no entry
+        """
+        key = self.key(kind, path, variant)
+        try:
+            with self._entry_path(key).open("rb") as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return False, None
+        with self._lock, self._db:
+            self._db.execute("UPDATE entries SET used = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        return True, data
+
+    def put(self, kind:str, path:'Path', data, variant:str="") -> None:
+        """
+        Stores data of a file and evicts the least recently used entries above max_bytes
+        """
+        key = self.key(kind, path, variant)
+        target = self._entry_path(key)
+        temporary = target.with_name("{}.{}.{}.tmp".format(target.name, os.getpid(), threading.get_ident()))
+        with temporary.open("wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, target)
+        size = target.stat().st_size
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, kind, str(Path(path).resolve()), size, time.time()))
+        self.evict()
+
+    def load(self, kind:str, path:'Path', loader, variant:str=""):
+        """
+        Cached data of a file, loader(path) parses and caches it on a miss
+        """
+        found, data = self.get(kind, path, variant)
+        if not found:
+            data = loader(path)
+            self.put(kind, path, data, variant)
+        return data
+
+    def evict(self) -> int:
+        """
+        Removes the least recently used entries until the cache fits into max_bytes
+
+        :returns: number of entries removed
+        """
+        removed = []
+        with self._lock, self._db:
+            total = self._db.execute("SELECT COALESCE(SUM(bytes), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            for key, size in self._db.execute("SELECT key, bytes FROM entries ORDER BY used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                removed.append(key)
+                total -= size
+            self._db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in removed])
+        for key in removed:
+            try:
+                self._entry_path(key).unlink()
+            except FileNotFoundError:
+                pass
+        return len(removed)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def _entry_path(self, key:str) -> 'Path':
+        return self.directory / (key + ".pickle")
@@ -0,0 +1,70 @@
+import os
+import pickle
+from pathlib import Path
+
+
+def file_signature(paths:list) -> list:
+    """(path, size, modification time) of files, to tell whether a checkpoint was written for them"""
+    signature = []
+    for path in paths:
+        stat = Path(path).stat()
+        signature.append((str(path), stat.st_size, stat.st_mtime_ns))
+    return signature
+
+
+class Checkpoint:
+    """
+    Progress of a reconciliation run, saved after each settlement file and every
+    interval rows so an interrupted run can be resumed (see the resume option).
+
+    A checkpoint holds the position in the settlement files, the totals, the assigned
+    flags of the receipts and the sizes the result files had at that point, among
+    other things PaymentDB needs to continue. It is replaced atomically, so a run
+    killed while saving leaves the previous checkpoint.
+    """
+
+    # part of every checkpoint, checkpoints of other versions aren't resumed
+    version = 1
+
+    def __init__(self, path:'Path', interval:int=100000):
+        """
+        :param path: checkpoint file
+        :param interval: settlement rows between two checkpoints within a file
+        """
+        self.path = Path(path)
+        self.interval = max(1, interval)
+
+    def load(self) -> dict:
+        """The saved checkpoint, None if there is none"""
+        try:
+            with self.path.open("rb") as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        if data.get("version") != self.version:
+            print("[WARNING] Checkpoint {} was written by another version, ignoring it".format(self.path))
+            return None
+        return data
+
+    def save(self, data:dict) -> None:
+        data = dict(data, version=self.version)
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        with temporary.open("wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    def remove(self) -> None:
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def truncate(path:'Path', size:int) -> None:
+    """Cuts a result file back to the size it had at a checkpoint"""
+    path = Path(path)
+    if not path.is_file() or path.stat().st_size < size:
+        raise Exception("Result file {} is shorter than at the checkpoint, can't resume".format(path))
+    os.truncate(path, size)
@@ -0,0 +1,177 @@
+from array import array
+from decimal import Decimal
+from functools import lru_cache
+
+try:
+    import numpy
+except ImportError:
+    # optional, the totals are summed up in pure Python without it
+    numpy = None
+
+from .parsing import parse_decimal, cache_size
+
+
+# category codes
+SALES = 0
+REFUND = 1
+PAYOUTS = 2
+FEES = 3
+
+# columns of payment_schema the totals need
+totals_columns = ["type", "order id", "product sales", "postage credits", "selling fees", "total"]
+
+
+# category code of each category name of CueClassifier
+category_codes = {"Sales": SALES, "Refund": REFUND, "Payouts": PAYOUTS, "Fees": FEES}
+
+
+class CueTable:
+    """
+    Lookup table from settlement "type" values to category codes, filled by a
+    CueClassifier with the types of each column the first time they occur
+    """
+
+    def __init__(self, classifier:'CueClassifier'):
+        self.classifier = classifier
+        self.codes = {}
+
+    def lookup(self, types:list) -> 'array':
+        codes = self.codes
+        for payment_type in set(types).difference(codes):
+            codes[payment_type] = category_codes[self.classifier.classify(payment_type)]
+        return array("b", map(codes.__getitem__, types))
+
+
+@lru_cache(maxsize=cache_size)
+def parse_cents(raw_str:str) -> tuple:
+    """
+    Amount as (integer cents, Decimal exponent), None if it has more than two decimals
+    or is not a finite number
+    """
+    value = parse_decimal(raw_str)
+    if not value.is_finite():
+        return None
+    exponent = value.as_tuple().exponent
+    if exponent < -2 or exponent > 100:
+        return None
+    return int(value.scaleb(2)), exponent
+
+
+class ColumnarTotals:
+    """
+    Report totals of PaymentDB.process computed over whole columns.
+
+    Amounts are kept as integer cents (NumPy int64 arrays when NumPy is installed,
+    array("q") otherwise) and the type column is mapped to category codes with a
+    CueTable, so each total is one masked sum. The results are Decimals equal to the
+    ones the row by row Decimal arithmetic gives, including their exponent: amounts
+    with more than two decimals are summed up as Decimals instead.
+    """
+
+    # total name -> (amount columns, categories, only rows with an order id)
+    layout = {
+        "sales": (("product sales", "postage credits"), (SALES,), False),
+        "reimbursements": (("product sales", "postage credits"), (REFUND,), False),
+        "payouts": (("total",), (PAYOUTS,), False),
+        "fees": (("total",), (FEES,), False),
+        "sale_fees": (("selling fees",), (SALES, REFUND, PAYOUTS, FEES), True),
+    }
+
+    # exponent of amounts summed up as Decimals, above any real one
+    no_exponent = 127
+
+    def __init__(self, classifier:'CueClassifier'):
+        self.table = CueTable(classifier)
+        self.payments = 0
+        self._cents = dict.fromkeys(self.layout, 0)
+        self._exponent = dict.fromkeys(self.layout, None)
+        self._extra = dict.fromkeys(self.layout, None)
+
+    def add(self, columns:dict, counts:dict=None) -> int:
+        """
+        Adds the rows of one settlement file
+
+        :param columns: lists of raw strings by column name, see totals_columns
+        :param counts: rows by category name, updated in place
+        :returns: number of rows added
+        """
+        size = len(columns["type"])
+        categories = self.table.lookup(columns["type"])
+        if counts is not None:
+            for category, code in category_codes.items():
+                counts[category] = counts.get(category, 0) + categories.count(code)
+        has_order = array("b", [1 if order else 0 for order in columns["order id"]])
+        amounts = {}
+        for name in ("product sales", "postage credits", "selling fees", "total"):
+            amounts[name] = self._amount_column(columns[name])
+        for total, (names, codes, needs_order) in self.layout.items():
+            for name in names:
+                cents, exponents, inexact = amounts[name]
+                self._add_masked(total, self._mask(categories, codes, has_order if needs_order else None),
+                    cents, exponents, inexact, columns[name])
+        self.payments += size
+        return size
+
+    def _amount_column(self, raw:list) -> tuple:
+        cents = array("q")
+        exponents = array("b")
+        inexact = []
+        for i, raw_str in enumerate(raw):
+            parsed = parse_cents(raw_str)
+            if parsed is None:
+                inexact.append(i)
+                parsed = (0, self.no_exponent)
+            cents.append(parsed[0])
+            exponents.append(parsed[1])
+        if numpy is not None:
+            cents = numpy.frombuffer(cents, dtype=numpy.int64)
+            exponents = numpy.frombuffer(exponents, dtype=numpy.int8)
+        return cents, exponents, inexact
+
+    def _mask(self, categories, codes, has_order):
+        if numpy is not None:
+            mask = numpy.isin(numpy.frombuffer(categories, dtype=numpy.int8), codes)
+            if has_order is not None:
+                mask &= numpy.frombuffer(has_order, dtype=numpy.int8).astype(bool)
+            return mask
+        if has_order is None:
+            return [category in codes for category in categories]
+        return [category in codes and order for category, order in zip(categories, has_order)]
+
+    def _add_masked(self, total, mask, cents, exponents, inexact, raw):
+        if numpy is not None:
+            if not mask.any():
+                return
+            self._cents[total] += int(cents[mask].sum())
+            exponent = int(exponents[mask].min())
+        else:
+            selected = [i for i, selected in enumerate(mask) if selected]
+            if not selected:
+                return
+            self._cents[total] += sum(cents[i] for i in selected)
+            exponent = min(exponents[i] for i in selected)
+        if exponent != self.no_exponent:
+            current = self._exponent[total]
+            self._exponent[total] = exponent if current is None else min(current, exponent)
+        for i in inexact:
+            if mask[i]:
+                value = parse_decimal(raw[i])
+                extra = self._extra[total]
+                self._extra[total] = value if extra is None else extra + value
+
+    def totals(self) -> dict:
+        """
+        Totals like the ones PaymentDB.process adds up, 0 for totals without any row
+        """
+        result = {"payments": self.payments}
+        for total in self.layout:
+            exponent = self._exponent[total]
+            extra = self._extra[total]
+            value = 0
+            if exponent is not None:
+                # the exponent of an exact Decimal sum is the smallest exponent of its terms
+                value = Decimal(self._cents[total]).scaleb(-2).quantize(Decimal(1).scaleb(exponent))
+            if extra is not None:
+                value = value + extra
+            result[total] = value
+        return result
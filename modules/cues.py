@@ -0,0 +1,158 @@
+import json
+import unicodedata
+from collections import deque
+from hashlib import sha256
+from types import MappingProxyType
+
+
+# categories in the order PaymentDB has always checked them, the first match wins
+precedence = ("Payouts", "Fees", "Refund", "Sales")
+
+# categories of settlement rows, types no cueline matches are sales
+categories = ("Sales", "Refund", "Payouts", "Fees")
+
+matching_modes = ("exact", "normalized", "substring")
+
+
+def normalize(text:str) -> str:
+    """
+    Case-folded text without accents and with single spaces, e.g. " ÜBERTRAG " -> "ubertrag"
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
+
+
+class PatternMatcher:
+    """
+    Aho–Corasick automaton: finds all patterns occurring in a text in one pass over it
+    """
+
+    def __init__(self, patterns:dict):
+        """
+        :param patterns: value reported for each pattern
+        """
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for pattern, value in patterns.items():
+            if pattern:
+                self._add(pattern, value)
+        self._link()
+
+    def _add(self, pattern:str, value) -> None:
+        state = 0
+        for char in pattern:
+            following = self._goto[state].get(char)
+            if following is None:
+                following = len(self._goto)
+                self._goto[state][char] = following
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = following
+        self._output[state].append(value)
+
+    def _link(self) -> None:
+        # breadth first, so the failure state of a state is linked before the state
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, following in self._goto[state].items():
+                queue.append(following)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[following] = self._goto[fail].get(char, 0)
+                self._output[following] = self._output[following] + self._output[self._fail[following]]
+
+    def find(self, text:str) -> set:
+        """Values of all patterns occurring in text"""
+        found = set()
+        state = 0
+        goto = self._goto
+        fail = self._fail
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            found.update(self._output[state])
+        return found
+
+
+class CueClassifier:
+    """
+    Settlement "type" -> category table, compiled once from the cuelines.
+
+    Types listed in the cuelines are found in a frozen dict. How other types are
+    classified depends on the matching mode:
+
+    * exact: they are sales, as they always were
+    * normalized: compared with the cuelines ignoring case, accents and extra spaces
+    * substring: the normalized type is searched for all normalized cuelines at once
+      (Aho–Corasick), e.g. "Erstattung durch Amazon" is a refund
+
+    With several matches the category checked first by PaymentDB wins (Payouts, Fees,
+    Refund, Sales). The result for each type is kept, so every type is only looked up
+    in the cuelines once.
+    """
+
+    def __init__(self, cues:dict, matching:str="exact"):
+        """
+        :param cues: cuelines by category, see PaymentDB.get_cuelines
+        :param matching: "exact", "normalized" or "substring"
+        """
+        if matching not in matching_modes:
+            raise Exception("Invalid cue matching {}. Supported modes - {}".format(matching, ", ".join(matching_modes)))
+        self.cues = cues
+        self.matching = matching
+        table = {}
+        normalized = {}
+        for category in precedence:
+            for cueline in cues.get(category, []):
+                table.setdefault(cueline, category)
+                normalized.setdefault(normalize(cueline), category)
+        # types classified by the cuelines and the categories without cuelines
+        self.table = MappingProxyType({cueline: category for cueline, category in table.items() if category != "Sales"})
+        self._normalized = normalized
+        self._matcher = PatternMatcher(normalized) if matching == "substring" else None
+        self._seen = {}
+
+    def __reduce__(self):
+        # mappingproxy can't be pickled, worker processes compile the cuelines again
+        return CueClassifier, (self.cues, self.matching)
+
+    @property
+    def key(self) -> str:
+        """Hash of the cuelines and the matching mode, prepared rows depend on both"""
+        data = self.cues if self.matching == "exact" else {"cues": self.cues, "matching": self.matching}
+        return sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def classify(self, payment_type:str) -> str:
+        """Category of a settlement row by its type"""
+        category = self.table.get(payment_type)
+        if category is not None:
+            return category
+        category = self._seen.get(payment_type)
+        if category is None:
+            category = self._seen[payment_type] = self._lookup(payment_type)
+        return category
+
+    def matched(self) -> dict:
+        """
+        Types not in the cuelines that the normalized or substring matching classified
+        as other than sales (in this process), by type
+        """
+        return {payment_type: category for payment_type, category in self._seen.items() if category != "Sales"}
+
+    def _lookup(self, payment_type:str) -> str:
+        if self.matching == "exact" or payment_type is None:
+            return "Sales"
+        text = normalize(payment_type)
+        if self._matcher is None:
+            return self._normalized.get(text, "Sales")
+        found = self._matcher.find(text)
+        for category in precedence:
+            if category in found:
+                return category
+        return "Sales"
@@ -0,0 +1,121 @@
+import time
+from pathlib import Path
+
+from .payments import PaymentDB
+from .watch import Watcher, snapshot
+
+
+class WatchDaemon:
+    """
+    Long-running reconciliation: watches payment_source and the receipt source and
+    processes new or changed settlement files as they arrive.
+
+    Works like repeated incremental runs (see PaymentDB.update), but the PaymentDB
+    with its receipts, receipt index and state is loaded once and kept in memory.
+    Files are only processed once their size and modification time stayed the same
+    for settle seconds, so files still being written are picked up later.
+    """
+
+    def __init__(self, config:dict, metrics=None, interval:float=2.0, settle:float=0.5):
+        """
+        :param config: configuration as for a normal run, incremental mode is turned on
+        :param interval: seconds between two scans when inotify isn't available
+        :param settle: seconds a file has to stay unchanged before it is processed
+        """
+        self.config = config
+        self.config["incremental"] = True
+        self.metrics = metrics
+        self.interval = interval
+        self.settle = settle
+        self.payment_source = Path(config["payment_source"])
+        self.receipt_source = Path(config["receipt_source"])
+        self.payment_db = None
+        self.cycles = 0
+        # settlement files as they were when last handed to PaymentDB
+        self._known = {}
+        # settlement files seen changing in the last cycle
+        self._pending = False
+        self._receipts_seen = None
+
+    def start(self) -> None:
+        """Loads the receipts and the state of earlier runs"""
+        self.payment_db = PaymentDB([], self.config, metrics=self.metrics)
+        self._receipts_seen = self._receipts_stat()
+
+    def run(self, max_cycles:int=None) -> None:
+        """
+        Processes what is new, then waits for changes until interrupted (Ctrl+C)
+
+        :param max_cycles: stop after this many cycles that processed files (for tests and benchmarks)
+        """
+        if self.payment_db is None:
+            self.start()
+        trees = [self.payment_source] if self.payment_source.is_dir() else []
+        flat = [self.receipt_source.parent] + ([] if trees else [self.payment_source.parent])
+        watcher = Watcher(trees, interval=self.interval, flat=flat, use_inotify=self.config.get("watch_inotify", True))
+        print()
+        print("Watching {} and {} ({})".format(self.payment_source, self.receipt_source,
+            "inotify" if watcher.uses_inotify else "polling every {} seconds".format(self.interval)))
+        try:
+            while max_cycles is None or self.cycles < max_cycles:
+                if not self.poll():
+                    # wait a bit longer than the settle time for files still being written
+                    watcher.wait(self.interval if self._pending else None)
+        except KeyboardInterrupt:
+            print()
+            print("Stopped watching")
+        finally:
+            watcher.close()
+            if self.payment_db.state is not None:
+                self.payment_db.state.close()
+
+    def poll(self) -> bool:
+        """
+        One cycle: reloads changed receipts and processes the settled new or changed settlement files
+
+        :returns: True if settlement files were processed
+        """
+        receipts = self._receipts_stat()
+        if receipts is not None and receipts != self._receipts_seen:
+            time.sleep(self.settle)
+            if receipts == self._receipts_stat():
+                print()
+                print("Receipts changed, reloading")
+                self.payment_db.reload_receipts()
+                self._receipts_seen = receipts
+        ready = self._settled_files()
+        if not ready:
+            return False
+        start = time.perf_counter()
+        # files that failed are only tried again once they change
+        self._known.update(ready)
+        self.cycles += 1
+        try:
+            self.payment_db.update(sorted(ready))
+        except Exception as ex:
+            print()
+            print("[ERROR] {}".format(ex))
+            return True
+        print("Processed {} settlement files in {:.2f} seconds".format(len(ready), time.perf_counter() - start))
+        return True
+
+    def _settled_files(self) -> dict:
+        before = self._changed(snapshot(self.payment_source, ".csv"))
+        self._pending = bool(before)
+        if not before:
+            return {}
+        time.sleep(self.settle)
+        after = snapshot(self.payment_source, ".csv")
+        ready = {path: stat for path, stat in before.items() if after.get(path) == stat}
+        self._pending = len(ready) < len(before)
+        return ready
+
+    def _changed(self, files:dict) -> dict:
+        return {path: stat for path, stat in files.items() if self._known.get(path) != stat}
+
+    def _receipts_stat(self):
+        try:
+            stat = self.receipt_source.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
@@ -0,0 +1,132 @@
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, no reflinks there
+    fcntl = None
+
+
+# ioctl cloning a file on copy-on-write file systems (Btrfs, XFS), from linux/fs.h
+FICLONE = 0x40049409
+
+link_modes = ("auto", "reflink", "hardlink", "copy")
+
+
+def is_up_to_date(source_stat:'os.stat_result', target:'Path') -> bool:
+    """Target exists with the size and modification time of the source, as copy2 and links leave it"""
+    try:
+        target_stat = target.stat()
+    except FileNotFoundError:
+        return False
+    return target_stat.st_size == source_stat.st_size and target_stat.st_mtime_ns == source_stat.st_mtime_ns
+
+
+def reflink(source:'Path', target:'Path') -> None:
+    """Copy-on-write clone of source, raises OSError where the file system can't clone"""
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            target.unlink()
+            raise
+    shutil.copystat(source, target)
+
+
+class PdfExporter:
+    """
+    Copies receipt PDFs into the receipts_assigned and receipts_unassigned directories
+    of an output directory.
+
+    The directories are created once per batch and the files are exported by a
+    bounded thread pool. With the "auto" link mode each file is cloned (reflink)
+    where the file system supports it, hard linked when source and target are on the
+    same file system and copied otherwise. Files already exported with the same size
+    and modification time are skipped.
+    """
+
+    def __init__(self, output_dir:'Path', workers:int=8, link:str="auto"):
+        """
+        :param output_dir: directory getting receipts_assigned/ and receipts_unassigned/
+        :param workers: largest number of files exported at the same time
+        :param link: "auto", "reflink", "hardlink" or "copy"
+        """
+        if link not in link_modes:
+            raise Exception("Invalid link mode {}. Supported modes - {}".format(link, ", ".join(link_modes)))
+        self.output_dir = Path(output_dir)
+        self.workers = max(1, workers)
+        self.link = link
+        self._no_reflink = False
+
+    def target_dir(self, assigned:bool) -> 'Path':
+        return self.output_dir / ("receipts_assigned" if assigned else "receipts_unassigned")
+
+    def export(self, files:list) -> dict:
+        """
+        Exports a batch of PDFs
+
+        :param files: (source path, target file name, assigned) of each PDF
+        :returns: counts by outcome ("reflinked", "linked", "copied", "skipped", "failed"),
+            "bytes" exported, "seconds" and the "errors" as (source, message)
+        """
+        start = time.perf_counter()
+        devices = {}
+        for assigned in set(assigned for _, _, assigned in files):
+            directory = self.target_dir(assigned)
+            directory.mkdir(parents=True, exist_ok=True)
+            devices[assigned] = directory.stat().st_dev
+        stats = dict.fromkeys(("reflinked", "linked", "copied", "skipped", "failed"), 0)
+        stats["bytes"] = 0
+        stats["errors"] = []
+        tasks = [(Path(source), self.target_dir(assigned) / name, devices[assigned]) for source, name, assigned in files]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for (source, _, _), (outcome, size) in zip(tasks, pool.map(self._export_one, tasks)):
+                if isinstance(outcome, Exception):
+                    stats["failed"] += 1
+                    stats["errors"].append((source, str(outcome)))
+                    continue
+                stats[outcome] += 1
+                if outcome != "skipped":
+                    stats["bytes"] += size
+        stats["seconds"] = time.perf_counter() - start
+        return stats
+
+    def _export_one(self, task:tuple) -> tuple:
+        source, target, device = task
+        try:
+            source_stat = source.stat()
+            if is_up_to_date(source_stat, target):
+                return "skipped", source_stat.st_size
+            if target.exists() or target.is_symlink():
+                # outdated export, a hard link to it must not change the old source
+                target.unlink()
+            return self._transfer(source, target, source_stat.st_dev == device), source_stat.st_size
+        except OSError as ex:
+            return ex, 0
+
+    def _transfer(self, source:'Path', target:'Path', same_device:bool) -> str:
+        if self.link in ("auto", "reflink") and same_device and not self._no_reflink:
+            try:
+                reflink(source, target)
+                return "reflinked"
+            except OSError:
+                if self.link == "reflink":
+                    raise
+                # the file system can't clone, don't try again for every file
+                self._no_reflink = True
+        if self.link in ("auto", "hardlink") and same_device:
+            try:
+                os.link(source, target)
+                return "linked"
+            except OSError:
+                if self.link == "hardlink":
+                    raise
+        shutil.copy2(source, target)
+        return "copied"
@@ -0,0 +1,152 @@
+import re
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+from .parsing import parse_decimal
+from .utility import find_similarity
+
+
+fuzzy_schema = ["order id", "Datum", "Umsatz in Euro", "Konto", "Beleg1", "Zusatzinformation",
+    "Receipt Umsatz in Euro", "Receipt Datum", "Score"]
+
+_non_alnum = re.compile(r"[^0-9A-Za-z]+")
+
+
+def blocking_keys(order:str, min_segment:int=5, affix:int=6) -> set:
+    """
+    Keys an order id is filed under in the candidate index: its longer "-" separated
+    segments plus the first and last characters of the id without separators.
+    Two ids with a typo in one place still share at least one key.
+    """
+    keys = set()
+    for segment in order.split("-"):
+        segment = segment.strip().upper()
+        if len(segment) >= min_segment:
+            keys.add(("s", segment))
+    norm = _non_alnum.sub("", order).upper()
+    if len(norm) >= affix:
+        keys.add(("p", norm[:affix]))
+        keys.add(("x", norm[-affix:]))
+    return keys
+
+
+def parse_receipt_date(raw:str, year:int):
+    """
+    DATEV "Datum" of a receipt: DDMM (year of the payment assumed) or DD.MM.YYYY, None if unknown
+    """
+    if not raw:
+        return None
+    raw = raw.strip()
+    try:
+        if len(raw) == 4 and raw.isdigit():
+            return datetime(year, int(raw[2:]), int(raw[:2]))
+        parts = raw.split(" ")[0].split(".")
+        if len(parts) == 3:
+            return datetime(int(parts[2]), int(parts[1]), int(parts[0]))
+    except ValueError:
+        return None
+    return None
+
+
+class FuzzyMatcher:
+    """
+    Suggests receipts for orders without an exact order id match.
+
+    Unassigned receipts are grouped by Beleg1 and filed in a blocking index
+    (see blocking_keys). An order is only compared with the groups that share a
+    key with it and whose amount and date are within the given windows, and these
+    few candidates are scored with utility.find_similarity on the order ids.
+    """
+
+    def __init__(self, receipts:list, min_score:int=80, amount_tolerance:'Decimal'=Decimal("1.00"),
+        date_window:int=7, max_bucket:int=100, max_suggestions:int=3):
+        """
+        :param receipts: receipts to suggest, usually the unassigned ones
+        :param min_score: lowest similarity (0-100) of the order ids to suggest a receipt
+        :param amount_tolerance: largest difference between payment and receipt amounts
+        :param date_window: largest difference in days between payment and receipt, where the receipt has a date
+        :param max_bucket: keys shared by more receipt groups are too common to narrow anything down and ignored
+        :param max_suggestions: suggestions per order
+        """
+        self.min_score = min_score
+        self.amount_tolerance = amount_tolerance
+        self.date_window = date_window
+        self.max_bucket = max_bucket
+        self.max_suggestions = max_suggestions
+        groups = {}
+        for receipt in receipts:
+            beleg1 = receipt["Beleg1"]
+            group = groups.get(beleg1)
+            if group is None:
+                group = groups[beleg1] = {"beleg1": beleg1, "order": receipt["Zusatzinformation"] or "",
+                    "amount": 0, "date": receipt.get("Datum"), "receipts": []}
+            group["amount"] = group["amount"] + parse_decimal(receipt["Umsatz in Euro"])
+            group["receipts"].append(receipt)
+        self.groups = list(groups.values())
+        self._index = defaultdict(list)
+        for group in self.groups:
+            for key in blocking_keys(group["order"]):
+                self._index[key].append(group)
+        self.comparisons = 0
+
+    def candidates(self, order:str, amount:'Decimal', dt:'datetime') -> list:
+        """
+        Receipt groups sharing a blocking key with the order, within the amount and date windows
+        """
+        seen = set()
+        found = []
+        for key in blocking_keys(order):
+            bucket = self._index.get(key)
+            if not bucket or len(bucket) > self.max_bucket:
+                continue
+            for group in bucket:
+                if id(group) in seen:
+                    continue
+                seen.add(id(group))
+                if abs(group["amount"] - amount) > self.amount_tolerance:
+                    continue
+                if dt is not None and self.date_window is not None:
+                    date = parse_receipt_date(group["date"], dt.year)
+                    if date is not None and abs((date - dt.replace(hour=0, minute=0, second=0, tzinfo=None)).days) > self.date_window:
+                        continue
+                found.append(group)
+        return found
+
+    def suggest(self, order:str, amount:'Decimal', dt:'datetime') -> list:
+        """
+        Best scoring receipt groups for an order
+
+        :returns: list of (score, group), best first
+        """
+        scored = []
+        for group in self.candidates(order, amount, dt):
+            self.comparisons += 1
+            score = find_similarity(order, group["order"])
+            if score >= self.min_score:
+                scored.append((score, group))
+        scored.sort(key=lambda x: -x[0])
+        return scored[:self.max_suggestions]
+
+    def match(self, unknown:list, to_string) -> list:
+        """
+        Suggestions for all unknown payments as rows of fuzzy_schema
+
+        :param unknown: (order, amount, date/time, account) of payments without receipts
+        :param to_string: formats amounts for the result file
+        """
+        rows = []
+        for order, amount, dt, account in unknown:
+            for score, group in self.suggest(order, amount, dt):
+                rows.append({
+                    "order id": order,
+                    "Datum": dt.strftime("%d.%m.%Y %H:%M:%S"),
+                    "Umsatz in Euro": to_string(amount),
+                    "Konto": account,
+                    "Beleg1": group["beleg1"],
+                    "Zusatzinformation": group["order"],
+                    "Receipt Umsatz in Euro": to_string(group["amount"]),
+                    "Receipt Datum": group["date"],
+                    "Score": score,
+                })
+        return rows
@@ -0,0 +1,95 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+def _scan(directory:'Path') -> list:
+    """(path, is directory) of the entries of a directory, symlinked directories are not followed"""
+    with os.scandir(directory) as entries:
+        return [(Path(entry.path), entry.is_dir(follow_symlinks=False)) for entry in entries]
+
+
+class ConcurrentLoader:
+    """
+    Finds and loads files with a thread pool driven by asyncio, so the latency of
+    slow (network mounted) file systems overlaps.
+
+    Directories are listed in parallel and every file found is handed to the load
+    job right away, while the rest of the tree is still being searched. At most
+    `concurrency` listings and reads run at the same time. Results are returned
+    sorted by path, whatever order they complete in.
+    """
+
+    def __init__(self, concurrency:int=8):
+        """
+        :param concurrency: largest number of file system calls running at the same time
+        """
+        if concurrency < 1:
+            raise Exception("Invalid concurrency {}, must be at least 1".format(concurrency))
+        self.concurrency = concurrency
+
+    def run(self, source, ext:str, job) -> dict:
+        """
+        Loads all files with extension ext
+
+        :param source: file, directory searched recursively or list of files
+        :param ext: file extension, e.g. ".csv"
+        :param job: coroutine function job(path, call) loading one file, call(function, *args)
+            runs a blocking function in the thread pool. The job runs in the event loop thread.
+        :returns: results of job by path, sorted by path
+        """
+        return asyncio.run(self._run(source, ext, job))
+
+    async def _run(self, source, ext:str, job) -> dict:
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+
+            async def call(function, *args):
+                async with semaphore:
+                    return await loop.run_in_executor(executor, function, *args)
+
+            def found(path):
+                tasks[path] = asyncio.ensure_future(job(path, call))
+
+            try:
+                if isinstance(source, (list, tuple)):
+                    for path in source:
+                        found(Path(path))
+                else:
+                    await self._find(Path(source), ext, call, found)
+            finally:
+                # let the jobs started so far finish before the pool shuts down
+                paths = sorted(tasks)
+                results = await asyncio.gather(*(tasks[path] for path in paths), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return dict(zip(paths, results))
+
+    async def _find(self, source:'Path', ext:str, call, found) -> None:
+        """Same lookup and errors as main.all_files_with_ext"""
+        if await call(source.is_file):
+            if source.suffix != ext:
+                raise Exception("[Error] Invalid file type %s" % source)
+            found(source)
+        elif await call(source.is_dir):
+            count = await self._walk(source, ext, call, found)
+            if count == 0:
+                print("Folder %s is empty" % source)
+        else:
+            raise FileNotFoundError("[Error] No such file of directory: %s" % source)
+
+    async def _walk(self, directory:'Path', ext:str, call, found) -> int:
+        count = 0
+        subdirectories = []
+        for path, is_dir in await call(_scan, directory):
+            if is_dir:
+                subdirectories.append(path)
+            elif path.suffix == ext:
+                found(path)
+                count += 1
+        counts = await asyncio.gather(*(self._walk(subdirectory, ext, call, found) for subdirectory in subdirectories))
+        return count + sum(counts)
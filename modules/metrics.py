@@ -0,0 +1,135 @@
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+def peak_rss_kb() -> int:
+    """
+    Peak resident set size of the process so far in KiB, None where unknown
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if peak > 1 << 32:
+        # macOS reports bytes
+        peak = peak // 1024
+    return peak
+
+
+class Metrics:
+    """
+    Collects wall time, CPU time, row counts and peak memory per stage of a run.
+
+    A disabled Metrics object keeps the same interface but records nothing, so
+    callers don't have to check whether metrics are wanted.
+    """
+
+    def __init__(self, enabled:bool=True):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self._stages = {}
+
+    @contextmanager
+    def stage(self, name:str, rows:int=None):
+        """
+        Times the enclosed block as stage name.
+        Yields a dict whose "rows" entry can be set inside the block.
+        """
+        record = {"rows": rows}
+        if not self.enabled:
+            yield record
+            return
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu, record["rows"])
+
+    def add(self, name:str, wall:float, cpu:float, rows:int=None, calls:int=1) -> None:
+        """
+        Adds time spent in a stage, repeated stages are summed up
+        """
+        if not self.enabled:
+            return
+        entry = self._stages.get(name)
+        if entry is None:
+            entry = self._stages[name] = {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "rows": None}
+        entry["calls"] += calls
+        entry["wall_seconds"] += wall
+        entry["cpu_seconds"] += cpu
+        if rows is not None:
+            entry["rows"] = (entry["rows"] or 0) + rows
+        entry["peak_rss_kb"] = peak_rss_kb()
+
+    def laps(self) -> 'Laps':
+        """Stopwatch for stages that alternate within one loop, see Laps"""
+        return Laps(self)
+
+    def as_dict(self) -> dict:
+        stages = []
+        for name, entry in self._stages.items():
+            stage = dict(name=name, **entry)
+            rows = entry["rows"]
+            stage["rows_per_second"] = rows / entry["wall_seconds"] if rows and entry["wall_seconds"] else None
+            stages.append(stage)
+        return {
+            "wall_seconds": time.perf_counter() - self.started,
+            "cpu_seconds": time.process_time(),
+            "peak_rss_kb": peak_rss_kb(),
+            "stages": stages,
+        }
+
+    def save(self, path:'Path', extra:dict=None) -> None:
+        data = self.as_dict()
+        if extra:
+            data.update(extra)
+        Path(path).write_text(json.dumps(data, indent=2, default=str), encoding="utf-8")
+
+    def print_table(self) -> None:
+        print("{:<45}{:>8}{:>10}{:>10}{:>10}{:>12}".format("STAGE", "CALLS", "WALL", "CPU", "ROWS", "ROWS/SEC"))
+        for stage in self.as_dict()["stages"]:
+            print("{:<45}{:>8}{:>10.3f}{:>10.3f}{:>10}{:>12}".format(stage["name"][:44], stage["calls"],
+                stage["wall_seconds"], stage["cpu_seconds"], stage["rows"] if stage["rows"] is not None else "",
+                "{:.0f}".format(stage["rows_per_second"]) if stage["rows_per_second"] else ""))
+
+
+class Laps:
+    """
+    Times consecutive parts of a loop body: each lap(name) adds the time since the
+    previous lap (or start) to stage name. The sums are added to the Metrics on close.
+    """
+
+    def __init__(self, metrics:'Metrics'):
+        self.metrics = metrics
+        self._totals = {}
+        self._wall = None
+        self._cpu = None
+
+    def start(self) -> None:
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def lap(self, name:str) -> None:
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        entry = self._totals.get(name)
+        if entry is None:
+            entry = self._totals[name] = [0.0, 0.0, 0]
+        entry[0] += wall - self._wall
+        entry[1] += cpu - self._cpu
+        entry[2] += 1
+        self._wall = wall
+        self._cpu = cpu
+
+    def close(self) -> None:
+        for name, (wall, cpu, rows) in self._totals.items():
+            self.metrics.add(name, wall, cpu, rows)
+        self._totals = {}
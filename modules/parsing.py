@@ -0,0 +1,139 @@
+import re
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+
+
+# Settlement files repeat the same amounts and timestamps a lot, parsed values are cached
+cache_size = 65536
+
+# 1.234,56 / -1 234,56
+thousands_regex = re.compile(r'^(?P<sign>-?)(?P<tous>\d{1,3})[^\d](?P<hun>\d{3}),(?P<dec>\d{2})')
+# 12,34 / -12.34 / 0
+plain_number_regex = re.compile(r'-?\d+(?:[.,]\d+)?\Z')
+
+# 9 ene. 2018 12:33:58 UTC
+month_date_regex = re.compile(r"^(?P<day>\d{1,2})\s*(?P<mon>[^\d\s\.\-_]{2,5})\.?\s*(?P<year>\d{2,4})\s*(?P<hour>\d{1,2}):(?P<min>\d{1,2}):(?P<sec>\d{1,2})(\s[A-Z]+)$")
+# 03.01.2018 09:41:31 UTC
+dotted_date_regex = re.compile(r"^(?P<day>\d{1,2})\.(?P<mon>\d{1,2})\.(?P<year>\d{2,4})\s+(?P<hour>\d{1,2}):(?P<min>\d{1,2}):(?P<sec>\d{1,2})(\s[A-Z]+)$")
+
+months = {"jan":"01","janv":"01","genn":"01","gen":"01","ene":"01",
+        "febr":"02","feb":"02","févr":"02","fév":"02","fev":"02",
+        "febbr":"02","febb":"02","maar":"03","maa":"03","mar":"03",
+        "mars":"03","märz":"03","mär":"03","marz":"03","apr":"04",
+        "avr":"04","mei":"05","may":"05","mai":"05","maj":"05","magg":"05",
+        "mag":"05","mayo":"05","jun":"06","juin":"06","giug":"06",
+        "giu":"06","jui":"06","jul":"07","juil":"07","jui":"07","lugl":"07",
+        "lug":"07","aug":"08","août":"08","aoû":"08","agos":"08","ago":"08",
+        "sept":"09","sep":"09","sett":"09","set":"09","okt":"10",
+        "otto":"10","ott":"10","nov":"11","dec":"12","déc":"12","dez":"12",
+        "dic":"12"}
+
+unknown_date = datetime(1970,1,1,0,0,0,0)
+
+
+@lru_cache(maxsize=cache_size)
+def parse_decimal(raw_str: str, abs:bool=False) -> Decimal:
+    """
+    Parse string representing some price into a Decimal.
+    Results are cached, so a warning about an unknown format is only printed once per string.
+    """
+    try:
+        if plain_number_regex.match(raw_str):
+            # fast path, always a valid Decimal
+            result = Decimal(raw_str.replace(",", "."))
+            if abs and result < 0:
+                result = 0 - result
+            return result
+        m = thousands_regex.search(raw_str)
+        if m:
+            string_decimal = m.group("sign") + m.group("tous") + m.group("hun") + "." + m.group("dec")
+        else:
+            string_decimal = raw_str.replace(",", ".")
+        try:
+            result = Decimal(string_decimal)
+            if abs and result < 0:
+                result = 0 - result
+        except Exception as err:
+            print()
+            print("Can't parse number {}. Unknown format".format(raw_str))
+            result = Decimal(0)
+    except Exception as err:
+        return Decimal(0)
+    return result
+
+
+@lru_cache(maxsize=cache_size)
+def parse_date_time(date_str:str) -> datetime:
+    """
+    Parse a settlement date/time into a datetime.
+    Results are cached, so a warning about an unknown format is only printed once per string.
+    """
+    dt = _parse_dotted_date_time(date_str)
+    if dt is not None:
+        return dt
+    if date_str[4:5] == "-":
+        # ISO dates never match the regexes below
+        try:
+            return datetime.fromisoformat(date_str)
+        except ValueError:
+            # not a valid ISO date after all, the parser below warns about it
+            pass
+    m = month_date_regex.match(date_str)
+    try:
+        if m:
+            month = int(months[m.group('mon').lower()])
+        else:
+            m = dotted_date_regex.match(date_str)
+            month = int(m.group('mon'))
+        year = int(m.group('year'))
+        day = int(m.group('day'))
+        hour = int(m.group('hour'))
+        min = int(m.group('min'))
+        sec = int(m.group('sec'))
+        dt = datetime(year, month, day, hour, min, sec)
+        return dt
+    except Exception as err:
+        print()
+        print("WARNING: UNKNOWN DATE FORMAT {}".format(date_str))
+        pass
+    try:
+        dt = datetime.fromisoformat(date_str)
+    except:
+        dt = unknown_date
+    return dt
+
+
+def _parse_dotted_date_time(date_str:str) -> datetime:
+    """
+    Fast path for the fixed "dd.mm.yyyy hh:mm:ss TZ" layout, None for anything else
+    """
+    if len(date_str) < 21 or date_str[2] != "." or date_str[5] != "." or date_str[10] != " " \
+        or date_str[13] != ":" or date_str[16] != ":" or date_str[19] != " ":
+        return None
+    zone = date_str[20:]
+    if not (zone.isascii() and zone.isalpha() and zone.isupper()):
+        return None
+    parts = (date_str[6:10], date_str[3:5], date_str[0:2], date_str[11:13], date_str[14:16], date_str[17:19])
+    if not all(part.isdecimal() for part in parts):
+        return None
+    try:
+        return datetime(*map(int, parts))
+    except ValueError:
+        return None
+
+
+def cache_stats() -> dict:
+    """
+    Hit and miss counts of the parser caches
+    """
+    stats = {}
+    for name, parser in (("decimal", parse_decimal), ("date_time", parse_date_time)):
+        info = parser.cache_info()
+        stats[name] = {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+    return stats
+
+
+def cache_clear() -> None:
+    parse_decimal.cache_clear()
+    parse_date_time.cache_clear()
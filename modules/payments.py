@@ -1,16 +1,48 @@
 
 import sys
 import re
-import typing
 import json
+from itertools import starmap, islice, chain
 from datetime import datetime
 from decimal import Decimal
 from pathlib import Path
-from shutil import copy2
-from collections import defaultdict
 
+# modules only some runs need (worker processes, asyncio loading, SQLite state and
+# cache, columnar totals, fuzzy matching, pdf copies) are imported where they are used
+from .utility import printProgressBar, readcsv, iter_csv, file_with_suffix, file_with_prefix, create_directory, \
+    file_digest
+from .receipts import ReceiptIndex
+from .cues import CueClassifier, categories
+from .records import Payment
+from .rendering import RowRenderer
+from .metrics import Metrics
+from .writers import open_writer, open_binary, output_format, result_file_name
+from .parsing import parse_decimal, parse_date_time, cache_stats
 
-from .utility import printProgressBar, readcsv, save_csv, file_with_suffix, file_with_prefix, create_directory
+
+# result files of earlier runs in the payment source
+_result_file = re.compile(r"result.*\.csv$")
+# marketplace in settlement file names, e.g. settlement-2018-DE.csv
+_lang_in_name = re.compile(r"(?<=[\-_])([A-Z]{2})[_\-\.]", flags=re.IGNORECASE)
+
+# default name of the rollup file in the results directory
+rollups_file = "result-rollups.sqlite"
+
+
+def result_directory(options:dict) -> 'Path':
+    """
+    Results directory of a run: the "results" option, otherwise next to payment_source
+    (None if payment_source doesn't exist)
+    """
+    output_dir = options.get("results", None)
+    if output_dir is not None:
+        return Path(output_dir)
+    source_path = Path(options["payment_source"])
+    if source_path.is_file():
+        return source_path.parent
+    if source_path.is_dir():
+        return source_path.parent / "results"
+    return None
 
 
 class PaymentDB:
@@ -28,120 +60,540 @@ class PaymentDB:
     receipt_schema = ["Umsatz in Euro", "Steuerschlüssel", "Gegenkonto", "Beleg1", "Beleg2", "Datum", "Konto", "Kost1", "Kost2",
     "Skonto in Euro", "Buchungstext", "Umsatzsteuer-ID", "Zusatzart", "Zusatzinformation"]
 
+    # columns of payment_schema used by process
+    payment_columns = ["date/time", "settlement id", "type", "order id", "description", "product sales", "postage credits",
+    "selling fees", "total"]
+
+    totals_keys = ["payments", "sales", "fees", "payouts", "reimbursements", "sale_fees"]
+
     skip_lines = 8
 
-    def __init__(self, source, options):       
+    def __init__(self, source, options, metrics=None, receipts=None):       
+        """
+        :param receipts: receipts to match against instead of loading receipt_source
+            (the receipts of one shard, see modules.shards)
+        """
         self._source = source
         self.options = options
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
         self.db = []
-        self.receipts = self.load_receipts(options["receipt_source"])
+        self.cache = self.open_cache()
+        if receipts is not None:
+            self.receipts = receipts
+            self.receipt_index = ReceiptIndex(receipts)
+        elif options.get("totals_only", False) or options.get("shards"):
+            # the report totals don't depend on the receipts, sharded runs partition them on disk
+            self.receipts = []
+            self.receipt_index = ReceiptIndex(self.receipts)
+        else:
+            with self.metrics.stage("load receipts") as stage:
+                self.receipts = self.load_receipts(options["receipt_source"])
+                stage["rows"] = len(self.receipts)
         self.cues = self.get_cuelines('dailycommerce-cli-payment-reconciliation-amazon-cuelines.json')
+        self.classifier = CueClassifier(self.cues, options.get("cue_matching", None) or "exact")
+        # prepared rows depend on the cuelines they were classified with
+        self._cues_key = self.classifier.key
+        # rows by category of each settlement file, for monitoring
+        self.classification = {}
+        self._classified = dict.fromkeys(categories, 0)
+        # drill-down totals by settlement id, account, day and category, see modules.rollups
+        self.rollups = None
+        if options.get("rollups", False) and not options.get("totals_only", False):
+            from .rollups import Rollups
+            self.rollups = Rollups()
+        # result and fee rows are tuples in the order of result_schema / fees_schema
+        self.renderer = RowRenderer()
+        # payments without receipts, collected for fuzzy matching
+        self._unknown = [] if options.get("fuzzy", False) else None
+        self.output_format = output_format(options.get("output_format"))
+        self.compression = options.get("compress", None)
+        # checks the compression before anything is processed
+        result_file_name("result.csv", self.output_format, self.compression)
+        checkpointed = options.get("checkpoint", False) or options.get("resume", False)
+        if checkpointed and not options.get("totals_only", False) and \
+                (self.output_format != "csv" or self.compression is not None):
+            raise Exception("Checkpointed runs cut the result files back when resuming and need uncompressed csv output")
+        if options.get("concurrency") and options.get("stream", False) and not options.get("totals_only", False):
+            # streamed files are only read while their rows are processed, one by one
+            raise Exception("Streamed runs read each settlement file while processing it and can't read them concurrently")
+        if options.get("shards") and not options.get("totals_only", False):
+            if options.get("incremental", False):
+                raise Exception("Sharded runs can't be incremental")
+            if checkpointed:
+                raise Exception("Sharded runs can't be checkpointed")
+            if self._unknown is not None:
+                raise Exception("Fuzzy matching needs all receipts in memory and doesn't work with shards")
+        self.state = None
+        if options.get("incremental", False):
+            if self.output_format != "csv":
+                raise Exception("Incremental runs append to the result files and need csv output")
+            self.state = self.open_state()
+
+
+    def update(self, source):
+        """
+        Loads and processes further settlement files, keeping the receipts, the receipt
+        index and the state of the earlier runs of this object (see modules.daemon)
+
+        :param source: settlement files
+        """
+        self._source = source
+        self.db = []
+        if self._unknown is not None:
+            self._unknown = []
+        if self.rollups is not None:
+            # the rollups of earlier runs are kept in the rollup file
+            self.rollups.clear()
+        self.load_payments()
+        return self.process()
+
+
+    def reload_receipts(self):
+        """
+        Loads the receipt source again after it changed, the receipts assigned in
+        earlier runs are restored from the state
+        """
+        with self.metrics.stage("load receipts") as stage:
+            self.receipts = self.load_receipts(self.options["receipt_source"])
+            stage["rows"] = len(self.receipts)
+        if self.state is not None:
+            restored = self.state.restore_receipts(self.receipts)
+            print("Receipts assigned before: {}".format(restored))
+
+
+    def open_cache(self):
+        """
+        Opens the parsed file cache if the "cache" or "cache_dir" option is set
+        """
+        options = self.options
+        if not options.get("cache", False) and options.get("cache_dir", None) is None:
+            return None
+        from .cache import ParsedFileCache
+        cache_dir = options.get("cache_dir", None)
+        if cache_dir is None:
+            cache_dir = self._result_path("parsed-cache")
+        max_bytes = int(options.get("cache_max_mb", 1024)) * (1 << 20)
+        return ParsedFileCache(cache_dir, max_bytes)
+
+
+    def open_state(self):
+        """
+        Opens the state of incremental runs and restores the receipts assigned so far.
+        Runs with totals_only keep their own state, their files have no result rows.
+        """
+        state_file = self.options.get("state_file", None)
+        if state_file is None:
+            state_file = self._result_path("reconciliation-totals-state.sqlite" if self.options.get("totals_only", False)
+                else "reconciliation-state.sqlite")
+        from .state import StateStore
+        state = StateStore(state_file)
+        print("Incremental run, {} settlement files processed before".format(len(state)))
+        restored = state.restore_receipts(self.receipts)
+        print("Receipts assigned before: {}".format(restored))
+        return state
 
 
     def process(self):
-        result = []
-        _schema = dict.fromkeys(self.result_schema)
-        fee_schema = dict.fromkeys(self.fees_schema)
-        fees_result = []
-        total_sales = 0
-        total_fees = 0
-        total_payouts = 0
-        total_reimbursements = 0
-        total_payments = 0
-        total_sale_fees = 0
+        if self.options.get("totals_only", False):
+            return self.process_totals()
+        if self.options.get("shards"):
+            return self.process_sharded()
+        stream = self.options.get("stream", False)
+        checkpoint = self.open_checkpoint()
+        resumed = self.resume_checkpoint(checkpoint) if checkpoint is not None else None
+        # incremental runs continue the totals and append to the result files of earlier runs,
+        # resumed runs continue the ones of the interrupted run
+        append = self.state is not None or resumed is not None
+        processed = []
+        if resumed is not None:
+            totals = resumed["totals"]
+            processed = resumed["processed"]
+        elif self.state is not None:
+            totals = self.state.restore_totals(self.totals_keys)
+            totals["payments"] = 0
+        else:
+            totals = dict.fromkeys(self.totals_keys, 0)
+        start, skip = (resumed["store"], resumed["row"]) if resumed is not None else (0, 0)
+        result_file = self.options.get("result_payments_assigned", "result-payments-assigned.csv")
+        fees_file = self.options.get("result_amazon-fees", "result-amazon-fees.csv")
+        streams = stream or checkpoint is not None
+        if streams:
+            # rows go straight into the result files instead of being collected first,
+            # checkpoints record how far the files got
+            result = self._open_writer(result_file, self.result_schema, append=append, tuples=True)
+            fees_result = self._open_writer(fees_file, self.fees_schema, append=append, tuples=True)
+            add_result = result.writerow
+            add_fee = fees_result.writerow
+        else:
+            result = []
+            fees_result = []
+            add_result = result.append
+            add_fee = fees_result.append
 
-        for store in self.db:
-            print()
-            lang = store['lang']
-            payments = store['payments']
-            account = store['account']
-            print("Processing {}...".format(store["file"]), end="")
-            for payment in payments:
-                total_payments += 1
-                res = _schema.copy()
-                order = payment["order id"]
-                summa = self._parse_decimal(payment["product sales"])
-                shiping = self._parse_decimal(payment["postage credits"])
-                description = payment["description"]
-                fees = self._parse_decimal(payment["selling fees"])
-                payment_type = payment["type"]
-                dt = self._parse_date_time(payment["date/time"])
-                gegenkonto = None
-                beleg1 = None
-                total = self._parse_decimal(payment["total"])
-                is_refund = False
-                if payment_type in self.cues["Payouts"]:
-                    # transfer
-                    gegenkonto = self.options["account_bank"]
-                    beleg1 = payment_type
-                    total_payouts = total_payouts + total               
-                elif payment_type in self.cues["Fees"]:
-                    gegenkonto = self.options["amazon_account"]
-                    total_fees = total_fees + total
-                else :
-                    gegenkonto = self.options["sales_account"]
-                    total = summa + shiping
-                    if payment_type in self.cues["Refund"]:
-                        total_reimbursements = total_reimbursements + total
-                        is_refund = True
-                    else:
-                        total_sales = total_sales + total                    
-
-                total_receipts = None
-                if order:
-                    receipts = self.find_receipt(order, is_refund)
-                    if receipts:
-                        total_receipts = 0
-                        beleg1 = receipts[0]["Beleg1"]
-                        for receipt in receipts:
-                            sale = self._parse_decimal(receipt["Umsatz in Euro"])
-                            total_receipts = total_receipts + sale
-                        if total_receipts != total:
-                            total_receipts = "#DIFF!" + " " + str(total_receipts)
-                    else:
-                        total_receipts = "#UNKNOWN!"
-                    
-                    # FEES
-                    fee = fee_schema.copy()
-                    fee["Umsatz in Euro"] = self._decimal_tostring(fees)                
-                    fee["Gegenkonto"] = self.options["amazon_account"]                                
-                    fee["Beleg1"] = order                                        
-                    fee["Beleg2"] = order
-                    fee["Datum"] = dt.strftime("%d.%m.%Y %H:%M:%S")                 
-                    fee["Konto"] = account                                    
-                    fee["Buchungstext"] = description 
-                    fee["Zusatzinformation"] = payment_type
-                    total_sale_fees = total_sale_fees + fees
-                    fees_result.append(fee)
-    
-                res["Umsatz in Euro"] = self._decimal_tostring(total)           # "product sales" + "postage credits" / "total" for transfers
-                res["Steuerschlüssel"] = self._decimal_tostring(total_receipts) # sum of receipts["Umsatz in Euro"]
-                res["Gegenkonto"] = gegenkonto                                  # options["sales_account"] / options["account_bank"] for transfers
-                res["Beleg1"] = beleg1                                          # recipts["Beleg1"] / "type" for transfers
-                res["Beleg2"] = order if order else description
-                res["Datum"] = dt.strftime("%d.%m.%Y %H:%M:%S")                 # "date/time" reformatted 
-                res["Konto"] = account                                          # account 
-                res["Buchungstext"] = description if order else payment_type    # "description" / "type" for transfers
-                res["Zusatzinformation"] = payment_type                         # "type"
-
-                result.append(res)
-            print("...done!")
+        laps = self.metrics.laps() if self.metrics.enabled else None
+        save_checkpoint = None
+        if checkpoint is not None:
+            signature = self._checkpoint_signature()
+            save_checkpoint = lambda store, row: self.save_checkpoint(checkpoint, signature, store, row, totals,
+                processed, (result, fees_result))
+        try:
+            for index, store, payments in self._prepared_stores(start):
+                print()
+                account = store['account']
+                print("Processing {}...".format(store["file"]), end="")
+                first = totals["payments"]
+                # rows reconciled by earlier incremental runs, rows were appended to the file since
+                earlier = store.get("earlier_rows", 0)
+                if index == start and skip:
+                    # reconciled before the checkpoint
+                    payments = islice(payments, earlier + skip, None)
+                    first -= skip
+                    self._classified = self.classification[store["file"]]
+                else:
+                    if earlier:
+                        payments = islice(payments, earlier, None)
+                    self._classified = self.classification[store["file"]] = dict.fromkeys(categories, 0)
+                chunks = (payments,) if checkpoint is None else self._chunks(payments, checkpoint.interval)
+                try:
+                    for chunk in chunks:
+                        if laps is None:
+                            for prepared in chunk:
+                                res, fee = self._reconcile(prepared, account, totals)
+                                if fee is not None:
+                                    add_fee(fee)
+                                add_result(res)
+                        else:
+                            laps.start()
+                            for prepared in chunk:
+                                laps.lap("read (stream)" if stream else "next row")
+                                res, fee = self._reconcile(prepared, account, totals, laps)
+                                if fee is not None:
+                                    add_fee(fee)
+                                add_result(res)
+                                laps.lap("write (stream)" if stream else "collect rows")
+                        if save_checkpoint is not None:
+                            save_checkpoint(index, totals["payments"] - first)
+                except Exception as ex:
+                    if not stream:
+                        raise
+                    # the rows read so far are already written and in the totals, continue with the
+                    # next file. Incremental runs record it as incomplete and continue after those rows
+                    print("[ERROR] {}".format(ex))
+                    processed.append((store.get("hash"), store["file"], earlier + totals["payments"] - first,
+                        store["path"], store.get("size"), False))
+                    continue
+                processed.append((store.get("hash"), store["file"], earlier + totals["payments"] - first,
+                    store["path"], store.get("size"), True))
+                if save_checkpoint is not None:
+                    save_checkpoint(index + 1, 0)
+                print("...done!")
+            if save_checkpoint is not None:
+                save_checkpoint(len(self.db), 0)
+        finally:
+            if laps is not None:
+                laps.close()
+            if streams:
+                result.close()
+                fees_result.close()
 
         print()
-        print("Payments processed: {}".format(total_payments))
+        print("Payments processed: {}".format(totals["payments"]))
+        self._print_classification()
+        if self.options.get("debug"):
+            for name, stats in cache_stats().items():
+                print("Parser cache {}: {} hits, {} misses".format(name, stats["hits"], stats["misses"]))
 
         assigned = list(filter(lambda x: x["assigned"], self.receipts))
         unassigned = list(filter(lambda x: not x["assigned"], self.receipts))
         print()
         print("Assigned {} receipts".format(len(assigned)))
         print("Unassigned receipts left: {}".format(len(unassigned)))
-        total_payouts = 0 - total_payouts
+        report_str = self._report(totals)
+        suggestions = None
+        if self._unknown is not None:
+            suggestions = self.fuzzy_match(unassigned)
+        print()
+        print("Saving results...",)
+        if suggestions is not None:
+            from .fuzzy import fuzzy_schema
+            self.save_results(suggestions, "result-fuzzy-matches.csv", fuzzy_schema)
+        if not streams:
+            self.save_results(result, result_file, self.result_schema, append=append, tuples=True)
+            self.save_results(fees_result, fees_file, self.fees_schema, append=append, tuples=True)
+        if unassigned:
+            unassigned_file = "result-receipts-left.csv"
+            self.save_results(unassigned, unassigned_file, self.receipt_schema)
+        if self.rollups is not None:
+            self.save_rollups(append=self.state is not None)
+        # written last, readers of the results (see modules.service) wait for it
+        self.save_results(report_str, "result-report.csv", None, istext=True)
+        if self.options.get("receipt_dir"):
+            self.export_receipt_pdfs()
+        if self.state is not None:
+            self.state.save(processed, self.receipts, totals)
+        if checkpoint is not None:
+            # the run is complete, there is nothing to resume
+            checkpoint.remove()
+        print("done!")
+
+        return True
+
+
+    def process_sharded(self):
+        """
+        Out-of-core run for receipt sets larger than memory, see the "shards" option.
+
+        Receipts and settlement rows are partitioned by order id into shard files,
+        each shard is reconciled on its own (in worker processes with the "jobs"
+        option) and the shard results are merged back in the order of a normal run.
+        Writes the same result files and report as process.
+        """
+        from . import shards
+        import shutil
+        import tempfile
+        options = self.options
+        count = int(options["shards"])
+        if count < 1:
+            raise Exception("Invalid number of shards {}".format(count))
+        shard_dir = options.get("shard_dir", None)
+        parent = Path(shard_dir) if shard_dir is not None else self._result_path("")
+        parent.mkdir(parents=True, exist_ok=True)
+        directory = Path(tempfile.mkdtemp(prefix="shards-", dir=str(parent)))
+        # the worker processes build their PaymentDB from these options
+        shard_options = dict(options, shards=None, cache=False, cache_dir=None, incremental=False,
+            receipt_dir=None, stream=False)
+        try:
+            print()
+            print("Partitioning {} into {} shards...".format(options["receipt_source"], count), end="")
+            with self.metrics.stage("partition receipts"):
+                receipt_paths = shards.partition_receipts(options["receipt_source"], directory, count)
+            print("...done!")
+            load = lambda path: self._load_payment_file(path, self.classifier, lazy=True)
+            with self.metrics.stage("partition settlement files") as stage:
+                payment_paths, stage["rows"], skipped = shards.partition_payments(self.db, load, directory, count,
+                    self.classification)
+            tasks = [(shard, receipt_paths[shard], payment_paths[shard], str(directory), skipped, shard_options)
+                for shard in range(count)]
+            print()
+            print("Reconciling {} shards...".format(count), end="")
+            jobs = options.get("jobs") or 1
+            with self.metrics.stage("reconcile shards"):
+                if jobs > 1:
+                    from concurrent.futures import ProcessPoolExecutor
+                    with ProcessPoolExecutor(max_workers=jobs) as pool:
+                        shard_results = list(pool.map(shards.reconcile_shard, tasks))
+                else:
+                    shard_results = [shards.reconcile_shard(task) for task in tasks]
+            print("...done!")
+            totals = shards.merge_totals([shard_totals for shard_totals, _ in shard_results], self.totals_keys)
+            if self.rollups is not None:
+                for _, shard_rollups in shard_results:
+                    self.rollups.merge(shard_rollups)
+            print()
+            print("Payments processed: {}".format(totals["payments"]))
+            self._print_classification()
+            print()
+            print("Saving results...",)
+            result_file = options.get("result_payments_assigned", "result-payments-assigned.csv")
+            fees_file = options.get("result_amazon-fees", "result-amazon-fees.csv")
+            with self.metrics.stage("merge shards"):
+                for name, file, fieldnames in (("results", result_file, self.result_schema),
+                        ("fees", fees_file, self.fees_schema)):
+                    with self._open_writer(file, fieldnames, tuples=True) as writer:
+                        for _, row in shards.merge_records(shards.shard_outputs(directory, name, count)):
+                            writer.writerow(row)
+                assigned = 0
+                unassigned = 0
+                # only Beleg1 and the flag are kept, for the pdf export
+                flags = [] if options.get("receipt_dir") else None
+                writer = None
+                try:
+                    for receipt, is_assigned in shards.merge_receipts(shards.shard_outputs(directory, "assigned", count)):
+                        if flags is not None:
+                            flags.append({"Beleg1": receipt["Beleg1"], "assigned": is_assigned})
+                        if is_assigned:
+                            assigned += 1
+                            continue
+                        unassigned += 1
+                        if writer is None:
+                            writer = self._open_writer("result-receipts-left.csv", self.receipt_schema)
+                        writer.writerow(receipt)
+                finally:
+                    if writer is not None:
+                        writer.close()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        print("Assigned {} receipts".format(assigned))
+        print("Unassigned receipts left: {}".format(unassigned))
+        report_str = self._report(totals)
+        if self.rollups is not None:
+            self.save_rollups()
+        self.save_results(report_str, "result-report.csv", None, istext=True)
+        if flags is not None:
+            self.export_receipt_pdfs(flags)
+        print("done!")
+
+        return True
+
+
+    def save_rollups(self, append=False):
+        """
+        Writes the rollups of the run into the rollup file (rollups_file, default
+        result-rollups.sqlite in the results directory)
+
+        :param append: add them to the rollups of earlier runs, for incremental runs
+        """
+        from .rollups import RollupStore
+        path = self.options.get("rollups_file", None) or self._result_path(rollups_file)
+        print("Saving rollups into {}...".format(path))
+        with self.metrics.stage("save rollups", len(self.rollups)):
+            store = RollupStore(path)
+            try:
+                store.save(self.rollups, append=append)
+            finally:
+                store.close()
+
+
+    def open_checkpoint(self):
+        """
+        Checkpoint of the run if the "checkpoint" or "resume" option is set, kept in
+        checkpoint_file (default reconciliation-checkpoint.pickle in the results directory)
+        """
+        options = self.options
+        if not options.get("checkpoint", False) and not options.get("resume", False):
+            return None
+        from .checkpoint import Checkpoint
+        path = options.get("checkpoint_file", None) or self._result_path("reconciliation-checkpoint.pickle")
+        return Checkpoint(path, int(options.get("checkpoint_rows", 100000)))
+
+
+    def resume_checkpoint(self, checkpoint):
+        """
+        Restores the progress of an interrupted run from its checkpoint with the
+        "resume" option and cuts the result files back to their size at the checkpoint
+
+        :returns: the checkpoint, None if the run starts from the beginning
+        """
+        if not self.options.get("resume", False):
+            return None
+        data = checkpoint.load()
+        if data is None:
+            print()
+            print("No checkpoint in {}, starting from the beginning".format(checkpoint.path))
+            return None
+        if data["signature"] != self._checkpoint_signature():
+            raise Exception("Checkpoint {} was written for other settlement or receipt files or options, "
+                "run without resume to start again".format(checkpoint.path))
+        from .checkpoint import truncate
+        for path, size in data["offsets"].items():
+            truncate(path, size)
+        for receipt, assigned in zip(self.receipts, data["assigned"]):
+            receipt["assigned"] = bool(assigned)
+        self.classification = data["classification"]
+        self._unknown = data["unknown"]
+        self.rollups = data["rollups"]
+        print()
+        print("Resuming from checkpoint {}: {} payments processed before".format(checkpoint.path, data["totals"]["payments"]))
+        return data
+
+
+    def save_checkpoint(self, checkpoint, signature, store, row, totals, processed, writers):
+        """
+        Saves the progress of the run, see modules.checkpoint
+
+        :param store: index of the settlement file in progress
+        :param row: rows of that file reconciled
+        :param writers: result file writers, their rows are written through first
+        """
+        with self.metrics.stage("save checkpoints"):
+            offsets = {str(writer.path): writer.sync() for writer in writers}
+            checkpoint.save({
+                "signature": signature,
+                "store": store,
+                "row": row,
+                "totals": totals,
+                "processed": processed,
+                "assigned": bytes(receipt["assigned"] for receipt in self.receipts),
+                "classification": self.classification,
+                "unknown": self._unknown,
+                "rollups": self.rollups,
+                "offsets": offsets,
+            })
+
+
+    def _checkpoint_signature(self):
+        """
+        What the output of the run depends on: the input files and the options
+        changing the rows, totals or receipts kept in a checkpoint
+        """
+        options = self.options
+        files = [store["path"] for store in self.db] + [options["receipt_source"]]
+        from .checkpoint import file_signature
+        return (file_signature(files), self._cues_key, self._unknown is not None, self.rollups is not None,
+            self.state is not None)
+
+
+    @staticmethod
+    def _chunks(payments, size):
+        """
+        Splits rows into consecutive iterators of size rows, each one has to be used
+        up before the next one is taken
+        """
+        iterator = iter(payments)
+        for first in iterator:
+            yield chain((first,), islice(iterator, size - 1))
+
+
+    def fuzzy_match(self, receipts):
+        """
+        Suggests receipts for the payments reported as #UNKNOWN!
+
+        :param receipts: receipts to choose from, the unassigned ones
+        :returns: rows of result-fuzzy-matches.csv
+        """
+        from .fuzzy import FuzzyMatcher
+        options = self.options
+        with self.metrics.stage("fuzzy matching", len(self._unknown)):
+            matcher = FuzzyMatcher(receipts,
+                min_score=int(options.get("fuzzy_min_score", 80)),
+                amount_tolerance=Decimal(str(options.get("fuzzy_amount_tolerance", "1.00"))),
+                date_window=int(options.get("fuzzy_date_window", 7)))
+            suggestions = matcher.match(self._unknown, self._decimal_tostring)
+        print()
+        print("Fuzzy matching: {} unknown orders, {} comparisons, {} suggestions".format(
+            len(self._unknown), matcher.comparisons, len(suggestions)))
+        return suggestions
+
+
+    def _print_classification(self):
+        """
+        Prints the rows per category, in debug mode also per settlement file and the
+        types only the normalized or substring cue matching classified
+        """
+        summed = dict.fromkeys(categories, 0)
+        for counts in self.classification.values():
+            for category, count in counts.items():
+                summed[category] += count
+        print("Rows by category: {}".format(", ".join("{} {}".format(category, count) for category, count in summed.items())))
+        if not self.options.get("debug"):
+            return
+        for file, counts in self.classification.items():
+            print("  {}: {}".format(file, ", ".join("{} {}".format(category, count) for category, count in counts.items())))
+        for payment_type, category in sorted(self.classifier.matched().items()):
+            print("Cue matching classified \"{}\" as {}".format(payment_type, category))
+
+
+    def _report(self, totals):
+        """
+        Prints the report totals and returns them as the text of result-report.csv
+        """
+        total_payouts = 0 - totals["payouts"]
         report =[
-            {"text":"Total Sales", "amount": self._decimal_tostring(total_sales)},
-            {"text":"Total Reimboursements", "amount": self._decimal_tostring(total_reimbursements)},
+            {"text":"Total Sales", "amount": self._decimal_tostring(totals["sales"])},
+            {"text":"Total Reimboursements", "amount": self._decimal_tostring(totals["reimbursements"])},
             {"text":"Total Paypouts", "amount": self._decimal_tostring(total_payouts)},
-            {"text":"Total Fees", "amount": self._decimal_tostring(total_fees)},
-            {"text":"Total Sale Fees", "amount": self._decimal_tostring(total_sale_fees)}
+            {"text":"Total Fees", "amount": self._decimal_tostring(totals["fees"])},
+            {"text":"Total Sale Fees", "amount": self._decimal_tostring(totals["sale_fees"])}
         ]
         report_str = [";Amount"]
         print("{:<25}{:>10}".format("", "AMOUNT"))
@@ -149,35 +601,229 @@ class PaymentDB:
             print("{:<25}{:>10}".format(entry["text"], entry["amount"]))
             report_str.append(entry["text"] + ";" + entry["amount"])
         report_str = "\n".join(report_str)
+        return report_str
+
+
+    def process_totals(self):
+        """
+        Computes only the report totals, with the columnar engine: no receipt matching
+        and no result files besides result-report.csv. Incremental runs add them to the
+        totals of earlier runs.
+        """
+        from .columnar import ColumnarTotals
+        if self.options.get("rollups", False):
+            print("[WARNING] Rollups need the settlement rows and are not built with totals_only")
+        engine = ColumnarTotals(self.classifier)
+        processed = []
+        for store in self.db:
+            print()
+            print("Adding up {}...".format(store["file"]), end="")
+            columns = store["columns"]
+            # rows added up by earlier incremental runs, rows were appended to the file since
+            earlier = store.get("earlier_rows", 0)
+            if earlier:
+                columns = {name: values[earlier:] for name, values in columns.items()}
+            self.classification[store["file"]] = dict.fromkeys(categories, 0)
+            with self.metrics.stage("totals " + store["file"]) as stage:
+                stage["rows"] = rows = engine.add(columns, self.classification[store["file"]])
+            processed.append((store.get("hash"), store["file"], earlier + rows, store["path"], store.get("size"), True))
+            print("...done!")
+        totals = engine.totals()
+        if self.state is not None:
+            # exact Decimal sums, the same as adding up the rows of all runs at once
+            earlier_totals = self.state.restore_totals(self.totals_keys)
+            for name in self.totals_keys:
+                if name != "payments":
+                    totals[name] = earlier_totals[name] + totals[name]
+        print()
+        print("Payments processed: {}".format(totals["payments"]))
+        self._print_classification()
+        print()
+        report_str = self._report(totals)
         print()
         print("Saving results...",)
-        result_file = self.options.get("result_payments_assigned", "result-payments-assigned.csv")
-        self.save_results(result, result_file, self.result_schema)
-        fees_file = self.options.get("result_amazon-fees", "result-amazon-fees.csv")
-        self.save_results(fees_result, fees_file, self.fees_schema)
-        if unassigned:
-            unassigned_file = "result-receipts-left.csv"
-            self.save_results(unassigned, unassigned_file, self.receipt_schema)
         self.save_results(report_str, "result-report.csv", None, istext=True)
+        if self.state is not None:
+            self.state.save(processed, self.receipts, totals)
         print("done!")
 
         return True
 
 
-    def find_receipt(self, order, is_refund):
-        result = []
-        id = None
-        for receipt in self.receipts:
-            if order == receipt["Zusatzinformation"]:
-                id = receipt["Beleg1"]
-                if is_refund:
-                    id = id.upper().strip()
-                    if id.endswith("-CO"):
-                        break
-                    else:
+    @staticmethod
+    def _prepare(payment, classifier):
+        """
+        Parses and classifies one settlement row.
+        Needs no state of the PaymentDB, so it can run in a worker process.
+
+        :param payment: settlement row
+        :param classifier: CueClassifier of the cuelines
+        :returns: Payment record
+        """
+        payment_type = payment["type"]
+        category = classifier.classify(payment_type)
+        summa = parse_decimal(payment["product sales"])
+        shiping = parse_decimal(payment["postage credits"])
+        fees = parse_decimal(payment["selling fees"])
+        dt = parse_date_time(payment["date/time"])
+        total = parse_decimal(payment["total"])
+        return Payment(payment["order id"], payment_type, payment["description"], dt, summa, shiping, fees, total, category,
+            payment["settlement id"])
+
+
+    def _reconcile(self, prepared, account, totals, laps=None):
+        """
+        Reconciles one prepared settlement row against the receipts
+
+        :param prepared: Payment record as returned by _prepare
+        :param account: account of the marketplace the row belongs to
+        :param totals: running totals, updated in place
+        :param laps: Laps timing the steps, if metrics are collected
+        :returns: (result row, fee row or None)
+        """
+        totals["payments"] += 1
+        self._classified[prepared.category] += 1
+        order = prepared.order
+        gegenkonto, beleg1, total, is_refund = self._classify(prepared, totals)
+        if self.rollups is not None:
+            self.rollups.add(prepared, account, total)
+        if laps is not None:
+            laps.lap("classification")
+
+        total_receipts = None
+        fee = None
+        if order:
+            receipts, total_receipts = self._match(order, is_refund, total)
+            if receipts:
+                beleg1 = receipts[0]["Beleg1"]
+            elif self._unknown is not None:
+                self._unknown.append((order, total, prepared.date_time, account))
+            if laps is not None:
+                laps.lap("receipt matching")
+            fee = self._fee(prepared, account, totals)
+            if laps is not None:
+                laps.lap("fee generation")
+
+        # Umsatz in Euro: "product sales" + "postage credits" / "total" for transfers,
+        # Steuerschlüssel: sum of receipts["Umsatz in Euro"], Gegenkonto: options["sales_account"] /
+        # options["account_bank"] for transfers, Beleg1: recipts["Beleg1"] / "type" for transfers
+        res = self.renderer.result(prepared, account, total, total_receipts, gegenkonto, beleg1)
+        if laps is not None:
+            laps.lap("result rows")
+        return res, fee
+
+
+    def _classify(self, prepared, totals):
+        """
+        Books a settlement row by its category
+
+        :returns: (gegenkonto, beleg1, total, is_refund)
+        """
+        category = prepared.category
+        total = prepared.total
+        beleg1 = None
+        is_refund = False
+        if category == "Payouts":
+            # transfer
+            gegenkonto = self.options["account_bank"]
+            beleg1 = prepared.type
+            totals["payouts"] = totals["payouts"] + total
+        elif category == "Fees":
+            gegenkonto = self.options["amazon_account"]
+            totals["fees"] = totals["fees"] + total
+        else :
+            gegenkonto = self.options["sales_account"]
+            total = prepared.product_sales + prepared.postage_credits
+            if category == "Refund":
+                totals["reimbursements"] = totals["reimbursements"] + total
+                is_refund = True
+            else:
+                totals["sales"] = totals["sales"] + total
+        return gegenkonto, beleg1, total, is_refund
+
+
+    def _match(self, order, is_refund, total):
+        """
+        Finds the receipts of an order and compares their sum with the payment
+
+        :returns: (receipts, sum of the receipts / "#DIFF! sum" / "#UNKNOWN!")
+        """
+        receipts = self.find_receipt(order, is_refund)
+        if not receipts:
+            return receipts, "#UNKNOWN!"
+        total_receipts = 0
+        for receipt in receipts:
+            sale = parse_decimal(receipt["Umsatz in Euro"])
+            total_receipts = total_receipts + sale
+        if total_receipts != total:
+            total_receipts = "#DIFF!" + " " + str(total_receipts)
+        return receipts, total_receipts
+
+
+    def _fee(self, prepared, account, totals):
+        """
+        Fee row of an order
+        """
+        totals["sale_fees"] = totals["sale_fees"] + prepared.selling_fees
+        return self.renderer.fee(prepared, account, self.options["amazon_account"])
+
+
+    def _prepared_stores(self, start=0):
+        """
+        Yields each loaded settlement file with its index in self.db and its prepared rows.
+        With the "jobs" option the files are loaded, parsed and classified in worker
+        processes; the results come back in the original file order, so receipt
+        assignment and totals stay the same as in a serial run. At most two files per
+        worker are loaded ahead, so streamed runs keep their memory bounded. Files
+        failing to load in a worker are skipped, the indexes of the following files
+        stay their own.
+
+        :param start: index of the first settlement file, for resumed runs
+        """
+        stores = list(enumerate(self.db))[start:]
+        jobs = self.options.get("jobs") or 1
+        if jobs <= 1:
+            for index, store in stores:
+                yield index, store, store["payments"]
+            return
+        # files found in the parsed file cache aren't loaded again
+        tasks = iter([(store["path"], self.classifier) for _, store in stores if store["payments"] is None])
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            # in file order, the first one is the next file to process
+            pending = deque()
+            def submit():
+                for task in islice(tasks, 2 * jobs - len(pending)):
+                    pending.append(pool.submit(_prepare_file, task))
+            submit()
+            try:
+                for index, store in stores:
+                    if store["payments"] is not None:
+                        yield index, store, store["payments"]
                         continue
-                break
-        result = list(filter(lambda x: x["Beleg1"] == id, self.receipts))
+                    future = pending.popleft()
+                    submit()
+                    # time spent waiting for the workers
+                    with self.metrics.stage("load " + store["file"]) as stage:
+                        prepared, error = future.result()
+                        if prepared is not None:
+                            stage["rows"] = len(prepared)
+                    if error is not None:
+                        print()
+                        print("[ERROR] {}".format(error))
+                        continue
+                    if self.cache is not None:
+                        self._cache_payments(store["path"], prepared)
+                    yield index, store, prepared
+            finally:
+                # files not started yet aren't loaded when the run stops early
+                for future in pending:
+                    future.cancel()
+
+
+    def find_receipt(self, order, is_refund):
+        result = self.receipt_index.lookup(order, is_refund)
         for receipt in result:
             receipt["assigned"] = True
 
@@ -187,39 +833,226 @@ class PaymentDB:
     def load_payments(self):
         print()
         options = self.options
-        for path in self._source:
+        loaded = None
+        source = self._source
+        if options.get("concurrency"):
+            loaded = self._load_concurrently()
+            source = list(loaded)
+        for path in source:
             name = path.name
             print("Loading {}...".format(name), end = "")
-            if re.match(r"result.*\.csv$", name):
+            if _result_file.match(name):
                 print("skipping {}".format(name))
                 continue
-            try:
-                db = readcsv(path, fieldset=self.payment_schema, skip_row=self.skip_lines)
-            except Exception as ex:
-                print("[ERROR] {}", format(ex)) 
+            if loaded is not None:
+                digest, processed, columns, db, error = loaded[path]
+            else:
+                digest, processed, columns, db, error = self._load_file(path)
+            if processed:
+                print("already processed, skipping")
+                continue
+            if error is not None:
+                print("[ERROR] {}", format(error)) 
                 continue
-            lang = self._search_in_text(name, r"(?<=[\-_])([A-Z]{2})[_\-\.]")
+            lang = self._search_in_text(name, _lang_in_name)
             if lang is None:
                 print("WARNING: COULD NOT DETECT LANGUAGE IN THE NAME", end="\n")
                 continue
+            size = None
+            earlier_rows = 0
+            if self.state is not None:
+                size = path.stat().st_size
+                earlier_rows = self._earlier_rows(path, size)
+                if earlier_rows is None:
+                    continue
 
             account_key = "account_" + lang.upper()
             account = options[account_key]
             
             self.db.append({
                 "file":name,
+                "path":path,
+                "hash":digest,
                 "lang":lang,
                 "payments": db,
-                "account": account
+                "columns": columns,
+                "account": account,
+                "size": size,
+                "earlier_rows": earlier_rows
             })
             print("...done!")
-            
+        if self.cache is not None:
+            print("Parsed file cache: {} hits, {} misses".format(self.cache.hits, self.cache.misses))
+
+
+    def _earlier_rows(self, path, size):
+        """
+        Rows of a settlement file reconciled by earlier incremental runs, if rows were
+        appended to it since (the file starts with the contents processed before) or
+        an earlier run failed in the middle of it
+
+        :returns: 0 for new files, None if the file changed in another way
+        """
+        earlier = self.state.earlier(path)
+        if earlier is None:
+            return 0
+        digest, rows, earlier_size = earlier
+        if earlier_size is None or size < earlier_size or file_digest(path, size=earlier_size) != digest:
+            print("[ERROR] {} changed since it was processed, its rows are in the result files already. "
+                "Only appending rows is supported, start again without the state file to reprocess it".format(path.name))
+            return None
+        print("{} rows processed before, continuing after them".format(rows), end="")
+        return rows
+
+
+    def _load_file(self, path):
+        """
+        Loads one settlement file
+
+        :returns: (content hash, already processed, columns, payments, error)
+        """
+        digest = None
+        if self.state is not None:
+            digest = file_digest(path)
+            if self.state.is_processed(digest):
+                return digest, True, None, None, None
+        try:
+            if self._loads_in_workers():
+                # only looked up in the cache, the worker processes load the rest
+                columns, db = self._load_data(path)
+            else:
+                with self.metrics.stage("load " + path.name) as stage:
+                    columns, db = self._load_data(path)
+                    stage["rows"] = self._count_rows(columns, db)
+        except Exception as ex:
+            return digest, False, None, None, ex
+        return digest, False, columns, db, None
+
+
+    def _load_concurrently(self):
+        """
+        Finds and loads the settlement files with a ConcurrentLoader, see the concurrency option.
+        The source may be the payment_source file or directory, which is searched while loading.
+
+        :returns: results of _load_file by path, sorted by path
+        """
+        state = self.state
+
+        async def load(path, call):
+            if _result_file.match(path.name):
+                return None, False, None, None, None
+            digest = None
+            if state is not None:
+                digest = await call(file_digest, path)
+                # the state is only used in the event loop thread, which opened it
+                if state.is_processed(digest):
+                    return digest, True, None, None, None
+            try:
+                columns, db = await call(self._load_data, path)
+            except Exception as ex:
+                return digest, False, None, None, ex
+            return digest, False, columns, db, None
+
+        from .loader import ConcurrentLoader
+        loader = ConcurrentLoader(self.options["concurrency"])
+        with self.metrics.stage("find and load settlement files") as stage:
+            loaded = loader.run(self._source, ".csv", load)
+            stage["rows"] = sum(self._count_rows(columns, db) or 0 for _, _, columns, db, _ in loaded.values())
+        return loaded
+
+
+    def _load_data(self, path):
+        """
+        Reads one settlement file the way the run needs it
+
+        :returns: (columns, payments), columns with totals_only, payments otherwise
+            (None if loaded by the worker processes)
+        """
+        options = self.options
+        cache = self.cache
+        if options.get("totals_only", False):
+            if cache is None:
+                return self._load_totals_columns(path), None
+            return cache.load("totals", path, self._load_totals_columns), None
+        if options.get("shards"):
+            # read again while partitioning, see process_sharded
+            return None, None
+        if cache is not None:
+            found, rows = cache.get("payments", path, self._cues_key)
+            if found:
+                return None, list(starmap(Payment, rows))
+        if self._loads_in_workers():
+            # loaded by the worker processes in process()
+            return None, None
+        lazy = options.get("stream", False)
+        payments = self._load_payment_file(path, self.classifier, lazy=lazy)
+        if cache is not None and not lazy:
+            self._cache_payments(path, payments)
+        return None, payments
+
+
+    def _cache_payments(self, path, payments):
+        self.cache.put("payments", path, [payment.astuple() for payment in payments], self._cues_key)
+
+
+    def _loads_in_workers(self):
+        options = self.options
+        return not options.get("totals_only", False) and not options.get("shards") and (options.get("jobs") or 1) > 1
+
+
+    @staticmethod
+    def _count_rows(columns, db):
+        if columns is not None:
+            return len(columns["type"])
+        if isinstance(db, list):
+            return len(db)
+        return None
+
+
+    @classmethod
+    def _load_payment_file(cls, path, classifier, lazy=False):
+        """
+        Loads one settlement file as prepared Payment records
+
+        :param path: settlement file
+        :param classifier: CueClassifier of the cuelines
+        :param lazy: return an iterator reading the file on iteration instead of a list
+        """
+        payments = iter_csv(path, fieldset=cls.payment_schema, skip_row=cls.skip_lines, columns=cls.payment_columns)
+        prepared = (cls._prepare(payment, classifier) for payment in payments)
+        if lazy:
+            return prepared
+        prepared = list(prepared)
+        if not prepared:
+            raise Exception("File {} is empty".format(path))
+        return prepared
+
+
+    @classmethod
+    def _load_totals_columns(cls, path):
+        """
+        Loads the columns the report totals need from one settlement file, as lists of raw strings
+        """
+        from .columnar import totals_columns
+        columns = {name: [] for name in totals_columns}
+        appends = [(name, columns[name].append) for name in totals_columns]
+        for payment in iter_csv(path, fieldset=cls.payment_schema, skip_row=cls.skip_lines, columns=totals_columns):
+            for name, append in appends:
+                append(payment[name])
+        if not columns["type"]:
+            raise Exception("File {} is empty".format(path))
+        return columns
+
 
     def load_receipts(self, path):
         print("Loading {}...".format(path), end = "")
-        db = readcsv(path)
+        if self.cache is not None:
+            db = self.cache.load("receipts", path, readcsv)
+        else:
+            db = readcsv(path)
         for receipt in db:
             receipt["assigned"] = False
+        self.receipt_index = ReceiptIndex(db)
         print("...done!")
         return db
 
@@ -254,7 +1087,9 @@ class PaymentDB:
         """
         pattern must contain 1 (group) 
         """
-        pat = re.compile(pattern,flags=re.IGNORECASE)
+        pat = pattern
+        if isinstance(pat, str):
+            pat = re.compile(pattern,flags=re.IGNORECASE)
         match = pat.search(text)
         if match:
             return match.group(1)
@@ -263,48 +1098,92 @@ class PaymentDB:
 
     def save_pdf(self, path, receipt_id=None, assigned=True):
         """Copies assigned pdf file to assigned directory"""
-        output_dir = self.options.get("output", None)
+        return self.save_pdfs([(path, receipt_id, assigned)])
+
+
+    def save_pdfs(self, pdfs):
+        """
+        Exports receipt pdf files in one batch with a PdfExporter
+
+        :param pdfs: (pdf path, receipt id or None, assigned) of each file, the receipt id is prefixed to the file name
+        :returns: export statistics, see PdfExporter.export
+        """
+        from .export import PdfExporter
+        options = self.options
+        output_dir = options.get("output", None)
         if not output_dir:
-            output_dir = (Path(self.options["receipt_dir"]).parent) / "results"
-        else:
-            output_dir = Path(output_dir)
-        if not output_dir.is_dir():
-            create_directory(output_dir, self.options["debug"])
-        if assigned:
-            output_dir = output_dir / "receipts_assigned"
-        else:
-            output_dir = output_dir / "receipts_unassigned"
-        if not output_dir.is_dir():
-            create_directory(output_dir, self.options["debug"])
-        input_file = path.resolve()
-        if receipt_id:
-            output_file = file_with_prefix(path, receipt_id).resolve()
-        else:
-            output_file = path
-        dst = output_dir / output_file.name
-        copy2(input_file, dst)
-
-
-    def save_results(self, results, file, fieldnames, istext=False):
-        output_dir = self.options.get("results", None)
-        if output_dir is None:
-            source = self.options["payment_source"]
-            source_path = Path(source)
-            if source_path.is_file():
-                output_dir = source_path.parent
-            elif source_path.is_dir():
-                output_dir = source_path.parent / "results"
-        else:
-            output_dir = Path(output_dir)
+            output_dir = (Path(options["receipt_dir"]).parent) / "results"
+        files = []
+        for path, receipt_id, assigned in pdfs:
+            path = Path(path)
+            name = file_with_prefix(path, receipt_id).name if receipt_id else path.name
+            files.append((path.resolve(), name, assigned))
+        exporter = PdfExporter(output_dir, workers=int(options.get("pdf_workers", 8)), link=options.get("pdf_link", "auto"))
+        with self.metrics.stage("export pdfs", len(files)):
+            stats = exporter.export(files)
+        exported = stats["reflinked"] + stats["linked"] + stats["copied"]
+        seconds = stats["seconds"]
+        print("Exported {} pdf files ({} reflinked, {} linked, {} copied), {} up to date, {} failed".format(
+            exported, stats["reflinked"], stats["linked"], stats["copied"], stats["skipped"], stats["failed"]))
+        print("{:.0f} files/s, {:.1f} MB/s".format(len(files) / seconds if seconds else 0,
+            stats["bytes"] / (1 << 20) / seconds if seconds else 0))
+        for source, error in stats["errors"]:
+            print("[ERROR] {}: {}".format(source, error))
+        return stats
+
+
+    def export_receipt_pdfs(self, receipts=None):
+        """
+        Exports the pdf files in receipt_dir named after a receipt (Beleg1, e.g. RE-123.pdf)
+        into receipts_assigned or receipts_unassigned
+
+        :param receipts: receipts with their assigned flag, the loaded receipts by default
+        """
+        receipt_dir = Path(self.options["receipt_dir"])
+        pdfs = {}
+        for path in receipt_dir.glob("**/*.pdf"):
+            pdfs.setdefault(path.stem.strip().upper(), path)
+        assigned = {}
+        for receipt in (self.receipts if receipts is None else receipts):
+            beleg1 = (receipt["Beleg1"] or "").strip().upper()
+            if beleg1 in pdfs:
+                assigned[beleg1] = assigned.get(beleg1, False) or receipt["assigned"]
+        print()
+        print("Exporting the pdf files of {} receipts from {}...".format(len(assigned), receipt_dir))
+        return self.save_pdfs([(pdfs[beleg1], None, is_assigned) for beleg1, is_assigned in sorted(assigned.items())])
+
+
+    def save_results(self, results, file, fieldnames, istext=False, append=False, tuples=False):
+        with self.metrics.stage("save " + file, None if istext else len(results or [])):
+            if istext:
+                # the report is a few lines of text, it is only compressed
+                output_path = self._result_path(result_file_name(file, "csv", self.compression))
+                if self.compression is None:
+                    output_path.write_text(results)
+                else:
+                    with open_binary(output_path, self.compression) as f:
+                        f.write(results.encode("utf-8"))
+            else: 
+                with self._open_writer(file, fieldnames, append=append, tuples=tuples) as writer:
+                    writer.writerows(results or [])
+        return True
+
+
+    def _open_writer(self, file, fieldnames, append=False, tuples=False):
+        """
+        Writer of a result file in the output format and compression of the run, see modules.writers
+        """
+        output_path = self._result_path(result_file_name(file, self.output_format, self.compression))
+        return open_writer(output_path, fieldnames, self.output_format, self.compression, append=append,
+            batch=self.options.get("output_batch_size", None), tuples=tuples)
+
+
+    def _result_path(self, file):
+        """Path of a result file in the results directory, creating the directory if needed"""
+        output_dir = result_directory(self.options)
         if not output_dir.is_dir():
             create_directory(output_dir, self.options["debug"])
-        result_file = file
-        output_path = output_dir / result_file
-        if istext:
-            output_path.write_text(results)
-        else: 
-            save_csv(output_path, results, fieldnames)
-        return True
+        return output_dir / file
 
 
     def _decimal_tostring(self, dec:'Decimal') -> str:
@@ -315,69 +1194,30 @@ class PaymentDB:
         return res
 
         
-    def _parse_decimal(self, raw_str: str, abs:bool=False) -> Decimal:
+    @staticmethod
+    def _parse_decimal(raw_str: str, abs:bool=False) -> Decimal:
         """
         Parse string representing some price into a Decimal
-        """      
-        regex = re.compile(r'^(?P<sign>-?)(?P<tous>\d{1,3})[^\d](?P<hun>\d{3}),(?P<dec>\d{2})')
-        try:
-            m = regex.search(raw_str)
-            if m:
-                string_decimal = m.group("sign") + m.group("tous") + m.group("hun") + "." + m.group("dec")
-            else:
-                string_decimal = raw_str.replace(",", ".")
-            try: 
-                result = Decimal(string_decimal)
-                if abs and result < 0:
-                    result = 0 - result
-            except Exception as err:
-                print()
-                print("Can't parse number {}. Unknown format".format(raw_str))
-                result = Decimal(0)
-        except Exception as err:
-            return Decimal(0)
-        return result
-        
+        """
+        return parse_decimal(raw_str, abs)
+
 
-    months = {"jan":"01","janv":"01","genn":"01","gen":"01","ene":"01",
-            "febr":"02","feb":"02","févr":"02","fév":"02","fev":"02",
-            "febbr":"02","febb":"02","maar":"03","maa":"03","mar":"03",
-            "mars":"03","märz":"03","mär":"03","marz":"03","apr":"04",
-            "avr":"04","mei":"05","may":"05","mai":"05","maj":"05","magg":"05",
-            "mag":"05","mayo":"05","jun":"06","juin":"06","giug":"06",
-            "giu":"06","jui":"06","jul":"07","juil":"07","jui":"07","lugl":"07",
-            "lug":"07","aug":"08","août":"08","aoû":"08","agos":"08","ago":"08",
-            "sept":"09","sep":"09","sett":"09","set":"09","okt":"10",
-            "otto":"10","ott":"10","nov":"11","dec":"12","déc":"12","dez":"12",
-            "dic":"12"}
-
-    def _parse_date_time(self, date_str:str) -> datetime:
+    @staticmethod
+    def _parse_date_time(date_str:str) -> datetime:
         # 9 ene. 2018 12:33:58 UTC
         # 03.01.2018 09:41:31 UTC
-        regex1 = re.compile(r"^(?P<day>\d{1,2})\s*(?P<mon>[^\d\s\.\-_]{2,5})\.?\s*(?P<year>\d{2,4})\s*(?P<hour>\d{1,2}):(?P<min>\d{1,2}):(?P<sec>\d{1,2})(\s[A-Z]+)$")
-        regex2 = re.compile(r"^(?P<day>\d{1,2})\.(?P<mon>\d{1,2})\.(?P<year>\d{2,4})\s+(?P<hour>\d{1,2}):(?P<min>\d{1,2}):(?P<sec>\d{1,2})(\s[A-Z]+)$")
-        m = regex1.match(date_str)
-        try:
-            if m:
-                month = int(self.months[m.group('mon').lower()])
-            else:
-                m = regex2.match(date_str)
-                month = int(m.group('mon'))
-            year = int(m.group('year'))
-            day = int(m.group('day'))
-            hour = int(m.group('hour'))
-            min = int(m.group('min'))
-            sec = int(m.group('sec'))
-            dt = datetime(year, month, day, hour, min, sec)
-            return dt
-        except Exception as err:
-            print()
-            print("WARNING: UNKNOWN DATE FORMAT {}".format(date_str))
-            pass
-        try:
-            dt = datetime.fromisoformat(date_str)
-        except:
-            dt = datetime(1970,1,1,0,0,0,0)        
-        return dt
+        return parse_date_time(date_str)
+
 
+def _prepare_file(task):
+    """
+    Worker process entry point: loads one settlement file and prepares all of its rows
 
+    :param task: (path, CueClassifier)
+    :returns: (prepared rows, None) or (None, error message)
+    """
+    path, classifier = task
+    try:
+        return PaymentDB._load_payment_file(path, classifier), None
+    except Exception as ex:
+        return None, str(ex)
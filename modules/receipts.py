@@ -0,0 +1,70 @@
+from collections import defaultdict
+
+
+class ReceiptIndex:
+    """
+    Hash index over the DATEV receipts used by PaymentDB.find_receipt.
+
+    The index is built once from the loaded receipts and answers each lookup
+    in constant time, with the same results as a scan over all receipts:
+
+    * order id ("Zusatzinformation") -> Beleg1 of the first receipt with that order id
+    * order id -> Beleg1 to use for refunds: the first credit note ("-CO") with that
+      order id, otherwise the last receipt with that order id (upper-cased and stripped)
+    * Beleg1 -> all receipts sharing that Beleg1, in file order
+    """
+
+    credit_note_suffix = "-CO"
+
+    def __init__(self, receipts:list):
+        self._sales = {}
+        self._refunds = {}
+        self._credit_notes = set()
+        self._groups = defaultdict(list)
+        for receipt in receipts:
+            self.add(receipt)
+
+    def add(self, receipt:dict) -> None:
+        """
+        Add one receipt to the index
+
+        :param receipt: receipt row as loaded by readcsv
+        """
+        order = receipt["Zusatzinformation"]
+        beleg1 = receipt["Beleg1"]
+        self._groups[beleg1].append(receipt)
+        if order not in self._sales:
+            self._sales[order] = beleg1
+        if order in self._credit_notes:
+            return
+        refund_id = beleg1.upper().strip() if beleg1 is not None else None
+        self._refunds[order] = refund_id
+        if refund_id and refund_id.endswith(self.credit_note_suffix):
+            self._credit_notes.add(order)
+
+    def beleg1(self, order:str, is_refund:bool):
+        """
+        Beleg1 value the receipts of an order are grouped by, None if the order is unknown
+        """
+        if is_refund:
+            return self._refunds.get(order)
+        return self._sales.get(order)
+
+    def group(self, beleg1) -> list:
+        """
+        All receipts with the given Beleg1
+        """
+        return self._groups.get(beleg1, [])
+
+    def lookup(self, order:str, is_refund:bool) -> list:
+        """
+        Receipts belonging to an order
+
+        :param order: Amazon order id
+        :param is_refund: look up the credit note of a refund
+        :returns: list of matching receipts, empty if none found
+        """
+        return self.group(self.beleg1(order, is_refund))
+
+    def __len__(self):
+        return sum(len(group) for group in self._groups.values())
@@ -0,0 +1,41 @@
+import sys
+
+
+class Payment:
+    """
+    Settlement row reduced to the columns process uses, parsed once.
+
+    Uses __slots__ instead of a per-row dict, the type, category and settlement id
+    strings are interned so rows of the same type or settlement share them.
+    """
+    __slots__ = ("order", "type", "description", "date_time", "product_sales", "postage_credits",
+        "selling_fees", "total", "category", "settlement_id")
+
+    def __init__(self, order:str, type:str, description:str, date_time:'datetime', product_sales:'Decimal',
+        postage_credits:'Decimal', selling_fees:'Decimal', total:'Decimal', category:str, settlement_id:str=None):
+        self.order = order
+        self.type = sys.intern(type) if type is not None else None
+        self.description = description
+        self.date_time = date_time
+        self.product_sales = product_sales
+        self.postage_credits = postage_credits
+        self.selling_fees = selling_fees
+        self.total = total
+        self.category = sys.intern(category)
+        self.settlement_id = sys.intern(settlement_id) if settlement_id is not None else None
+
+    def astuple(self) -> tuple:
+        return (self.order, self.type, self.description, self.date_time, self.product_sales,
+            self.postage_credits, self.selling_fees, self.total, self.category, self.settlement_id)
+
+    def __reduce__(self):
+        # compact pickling for the worker processes
+        return (Payment, self.astuple())
+
+    def __eq__(self, other):
+        if not isinstance(other, Payment):
+            return NotImplemented
+        return self.astuple() == other.astuple()
+
+    def __repr__(self):
+        return "Payment({})".format(", ".join(repr(value) for value in self.astuple()))
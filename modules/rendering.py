@@ -0,0 +1,109 @@
+from decimal import Decimal
+
+
+# formatted timestamps and amounts kept, the caches are emptied when they are full
+cache_size = 65536
+
+date_format = "%d.%m.%Y %H:%M:%S"
+
+
+def amount_text(value):
+    """
+    Amount as written into the result files (decimal comma), other values like
+    "#UNKNOWN!" unchanged, see PaymentDB._decimal_tostring
+    """
+    if not isinstance(value, Decimal):
+        return value
+    return str(value).replace(".", ",")
+
+
+class RowRenderer:
+    """
+    Formats the result and fee rows of reconciled settlement rows as tuples in the
+    column order of PaymentDB.result_schema / fees_schema, which the result writers
+    take instead of dicts (see writers.ResultWriter).
+
+    Settlement files repeat the same timestamps and amounts a lot, so each one is
+    formatted once: timestamps are cached by value, amounts by object, since equal
+    Decimals like 1.0 and 1.00 are written differently. Only the parsed amounts of the
+    rows are cached, they are shared by the rows through the parser cache; sums
+    computed per row are new objects each time and formatted without the cache.
+    """
+
+    def __init__(self, size:int=cache_size):
+        """
+        :param size: timestamps and amounts kept in each cache
+        """
+        self.size = size
+        self._dates = {}
+        self._amounts = {}
+
+    def date(self, date_time:'datetime') -> str:
+        """Datum of a row, e.g. 09.01.2018 12:33:58"""
+        text = self._dates.get(date_time)
+        if text is None:
+            if len(self._dates) >= self.size:
+                self._dates.clear()
+            text = self._dates[date_time] = date_time.strftime(date_format)
+        return text
+
+    def amount(self, value):
+        """
+        Parsed amount of a settlement row as written into the result files, see amount_text
+        """
+        entry = self._amounts.get(id(value))
+        # the cache keeps a reference to each amount, so its id isn't reused while cached
+        if entry is not None and entry[0] is value:
+            return entry[1]
+        if not isinstance(value, Decimal):
+            return value
+        if len(self._amounts) >= self.size:
+            self._amounts.clear()
+        text = amount_text(value)
+        self._amounts[id(value)] = (value, text)
+        return text
+
+    def result(self, prepared:'Payment', account:str, total, total_receipts, gegenkonto:str, beleg1:str) -> tuple:
+        """
+        Result row of a settlement row
+
+        :param total: amount booked, see PaymentDB._classify
+        :param total_receipts: sum of the receipts, "#DIFF! sum", "#UNKNOWN!" or None for transfers
+        """
+        order = prepared.order
+        # the total of transfers and fees is a parsed amount, the one of sales and refunds a sum
+        umsatz = self.amount(total) if total is prepared.total else amount_text(total)
+        return (
+            umsatz,                                                 # Umsatz in Euro
+            amount_text(total_receipts),                            # Steuerschlüssel
+            gegenkonto,                                             # Gegenkonto
+            beleg1,                                                 # Beleg1
+            order if order else prepared.description,               # Beleg2
+            self.date(prepared.date_time),                          # Datum
+            account,                                                # Konto
+            None, None, None,                                       # Kost1, Kost2, Skonto in Euro
+            prepared.description if order else prepared.type,       # Buchungstext
+            None, None,                                             # Umsatzsteuer-ID, Zusatzart
+            prepared.type,                                          # Zusatzinformation
+        )
+
+    def fee(self, prepared:'Payment', account:str, gegenkonto:str) -> tuple:
+        """Fee row of an order"""
+        order = prepared.order
+        return (
+            self.amount(prepared.selling_fees),                     # Umsatz in Euro
+            None,                                                   # Steuerschlüssel
+            gegenkonto,                                             # Gegenkonto
+            order,                                                  # Beleg1
+            order,                                                  # Beleg2
+            self.date(prepared.date_time),                          # Datum
+            account,                                                # Konto
+            None, None, None,                                       # Kost1, Kost2, Skonto in Euro
+            prepared.description,                                   # Buchungstext
+            None, None,                                             # Umsatzsteuer-ID, Zusatzart
+            prepared.type,                                          # Zusatzinformation
+        )
+
+    def clear(self) -> None:
+        self._dates.clear()
+        self._amounts.clear()
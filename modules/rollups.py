@@ -0,0 +1,249 @@
+import sqlite3
+import time
+from decimal import Decimal
+from operator import itemgetter
+from pathlib import Path
+
+
+# amounts of a rollup group, in the order of the group lists after the row count
+amounts = ("sales", "refunds", "payouts", "fees", "sale_fees")
+
+# group list position of the amount each category adds up, see PaymentDB._classify
+_category_amount = {"Sales": 1, "Refund": 2, "Payouts": 3, "Fees": 4}
+_sale_fees = 5
+
+# what a rollup group is keyed by, also the columns drill-down queries group by
+dimensions = ("settlement_id", "account", "day", "category")
+
+
+class Rollups:
+    """
+    Totals of the settlement rows by settlement id, marketplace account, day and
+    category, added up while PaymentDB reconciles the rows.
+
+    Each group is [rows, sales, refunds, payouts, fees, sale fees] with the amounts
+    PaymentDB adds to the report totals, so the groups add up to the report.
+    """
+
+    def __init__(self):
+        self.groups = {}
+
+    def __len__(self):
+        return len(self.groups)
+
+    def clear(self) -> None:
+        self.groups = {}
+
+    def add(self, prepared:'Payment', account:str, total:'Decimal') -> None:
+        """
+        Adds one reconciled settlement row
+
+        :param prepared: Payment record
+        :param account: account of the marketplace of the row
+        :param total: amount of the row in its category, as returned by PaymentDB._classify
+        """
+        key = (prepared.settlement_id or "", account, prepared.date_time.date(), prepared.category)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = [0, 0, 0, 0, 0, 0]
+        group[0] += 1
+        index = _category_amount[prepared.category]
+        group[index] = group[index] + total
+        if prepared.order:
+            group[_sale_fees] = group[_sale_fees] + prepared.selling_fees
+
+    def merge(self, other:'Rollups') -> None:
+        """Adds the groups of other, e.g. the rollups of a shard"""
+        for key, values in other.groups.items():
+            group = self.groups.get(key)
+            if group is None:
+                self.groups[key] = list(values)
+                continue
+            for i, value in enumerate(values):
+                group[i] = group[i] + value
+
+
+class RollupStore:
+    """
+    Rollups of reconciliation runs in a SQLite file, indexed by settlement id, day and
+    account so drill-down queries only read the groups they need.
+
+    Amounts are kept as exact Decimal strings and, like in ColumnarTotals, as integer
+    cents with the Decimal exponent, so SQLite adds them up exactly in the query.
+    Amounts with more than two decimals have no cents, queries including one of them
+    add up the Decimal strings instead.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS rollups (settlement_id TEXT NOT NULL, account TEXT NOT NULL, day TEXT NOT NULL,
+            category TEXT NOT NULL, rows INTEGER, {}, PRIMARY KEY (settlement_id, account, day, category)) WITHOUT ROWID
+    """.format(", ".join("{0} TEXT, {0}_cents INTEGER, {0}_exponent INTEGER".format(amount) for amount in amounts))
+
+    indexes = {
+        "rollups_day": "CREATE INDEX IF NOT EXISTS rollups_day ON rollups (day)",
+        "rollups_account": "CREATE INDEX IF NOT EXISTS rollups_account ON rollups (account, day)",
+    }
+
+    def __init__(self, path:'Path'):
+        self.path = Path(path)
+        self._db = sqlite3.connect(str(self.path))
+        with self._db:
+            self._db.execute(self.schema)
+            for create in self.indexes.values():
+                self._db.execute(create)
+
+    def save(self, rollups:'Rollups', append:bool=False) -> None:
+        """
+        Writes the rollups of a run in one transaction
+
+        :param append: add them to the stored rollups instead of replacing those
+        """
+        groups = {}
+        for (settlement_id, account, day, category), values in rollups.groups.items():
+            groups[(settlement_id, str(account), day.isoformat(), category)] = values
+        columns = ", ".join(amounts)
+        with self._db:
+            if append:
+                for row in self._db.execute("SELECT settlement_id, account, day, category, rows, {} FROM rollups".format(columns)):
+                    key = row[:4]
+                    if key in groups:
+                        stored = [row[4]] + [_decimal(value) for value in row[5:]]
+                        groups[key] = [value + stored[i] for i, value in enumerate(groups[key])]
+            else:
+                # the indexes are built again after the rows are inserted, which is faster than updating them
+                for name in self.indexes:
+                    self._db.execute("DROP INDEX IF EXISTS {}".format(name))
+                self._db.execute("DELETE FROM rollups")
+            rows = [key + (values[0],) + _columns(values[1]) + _columns(values[2]) + _columns(values[3]) +
+                _columns(values[4]) + _columns(values[5]) for key, values in groups.items()]
+            # in primary key order, so the rows are appended to the table instead of inserted all over it
+            rows.sort(key=_primary_key)
+            self._db.executemany("INSERT OR REPLACE INTO rollups VALUES ({})".format(", ".join("?" * (5 + 3 * len(amounts)))),
+                rows)
+            for create in self.indexes.values():
+                self._db.execute(create)
+
+    def query(self, by:list=("settlement_id",), settlement_id:str=None, account:str=None, day_from:str=None,
+        day_to:str=None, category:str=None) -> list:
+        """
+        Drill-down totals
+
+        :param by: dimensions to group by, empty for one grand total
+        :param day_from: first day (YYYY-MM-DD), day_to: last day, both included
+        :returns: (dimension values, [rows, sales, refunds, payouts, fees, sale fees]) sorted by the dimension values
+        """
+        for dimension in by:
+            if dimension not in dimensions:
+                raise Exception("Invalid rollup dimension {}. Supported - {}".format(dimension, ", ".join(dimensions)))
+        conditions = []
+        parameters = []
+        for column, operator, value in (("settlement_id", "=", settlement_id), ("account", "=", account),
+                ("day", ">=", day_from), ("day", "<=", day_to), ("category", "=", category)):
+            if value is not None:
+                conditions.append("{} {} ?".format(column, operator))
+                parameters.append(str(value))
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        group_by = " GROUP BY " + ", ".join(by) if by else ""
+        sums = ", ".join("SUM({0}_cents), MIN({0}_exponent)".format(amount) for amount in amounts)
+        inexact = " + ".join("SUM({}_cents IS NULL)".format(amount) for amount in amounts)
+        sql = "SELECT {}SUM(rows), {}, {} FROM rollups{}{}".format("".join(column + ", " for column in by), sums,
+            inexact, where, group_by)
+        count = len(by)
+        totals = []
+        for row in self._db.execute(sql, parameters):
+            if row[count] is None:
+                # no rollups match
+                continue
+            if row[-1]:
+                return self._query_decimals(by, where, parameters)
+            values = [row[count]]
+            for i in range(count + 1, count + 1 + 2 * len(amounts), 2):
+                values.append(_from_cents(row[i], row[i + 1]))
+            totals.append((tuple(row[:count]), values))
+        return sorted(totals)
+
+    def _query_decimals(self, by:list, where:str, parameters:list) -> list:
+        sql = "SELECT {}rows, {} FROM rollups{}".format("".join(column + ", " for column in by), ", ".join(amounts), where)
+        count = len(by)
+        totals = {}
+        for row in self._db.execute(sql, parameters):
+            key = row[:count]
+            values = [row[count]] + [_decimal(value) for value in row[count + 1:]]
+            group = totals.get(key)
+            if group is None:
+                totals[key] = values
+                continue
+            for i, value in enumerate(values):
+                group[i] = group[i] + value
+        return sorted(totals.items())
+
+    def close(self) -> None:
+        self._db.close()
+
+
+_primary_key = itemgetter(0, 1, 2, 3)
+
+
+def _decimal(value:str):
+    # totals without any amount are the int 0
+    return 0 if value == "0" else Decimal(value)
+
+
+def _columns(value) -> tuple:
+    """(exact string, cents, exponent) stored for an amount"""
+    text = str(value)
+    if not isinstance(value, Decimal):
+        return text, value * 100, None
+    if "E" in text or not value.is_finite():
+        # exponent notation, rare enough for the slow way
+        exponent = value.as_tuple().exponent if value.is_finite() else None
+        if exponent is None or exponent < -2 or exponent > 100:
+            return text, None, None
+        return text, int(value.scaleb(2)), exponent
+    whole, _, fraction = text.partition(".")
+    places = len(fraction)
+    if places > 2:
+        return text, None, None
+    return text, int(whole + fraction) * 10 ** (2 - places), -places
+
+
+def _from_cents(cents:int, exponent:int):
+    """Decimal sum of amounts from their cents and smallest exponent, see ColumnarTotals.totals"""
+    if exponent is None:
+        return 0
+    return Decimal(cents).scaleb(-2).quantize(Decimal(1).scaleb(exponent))
+
+
+def print_query(path:'Path', by:list, **filters) -> int:
+    """
+    Prints the drill-down totals of a rollup file as a table, see RollupStore.query
+
+    :returns: number of groups
+    """
+    path = Path(path)
+    if not path.is_file():
+        raise Exception("Rollup file {} does not exist, run the reconciliation with --rollups first".format(path))
+    start = time.perf_counter()
+    store = RollupStore(path)
+    try:
+        groups = store.query(by, **filters)
+    finally:
+        store.close()
+    elapsed = time.perf_counter() - start
+    header = [dimension.upper().replace("_", " ") for dimension in by] + ["ROWS"] + \
+        [amount.upper().replace("_", " ") for amount in amounts]
+    lines = [[str(value) for value in key] + [str(values[0])] + [_amount_tostring(value) for value in values[1:]]
+        for key, values in groups]
+    widths = [max([len(header[i])] + [len(line[i]) for line in lines]) + 2 for i in range(len(header))]
+    dimension_count = len(by)
+    for line in [header] + lines:
+        print("".join(value.ljust(width) if i < dimension_count else value.rjust(width)
+            for i, (value, width) in enumerate(zip(line, widths))))
+    print()
+    print("{} groups from {} in {:.1f} ms".format(len(groups), path, elapsed * 1000))
+    return len(groups)
+
+
+def _amount_tostring(value) -> str:
+    # like PaymentDB._decimal_tostring
+    return str(value).replace(".", ",")
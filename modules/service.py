@@ -0,0 +1,381 @@
+import csv
+import io
+import json
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit, unquote, parse_qs
+
+from .writers import result_file_name
+
+
+# result files the service answers from, by the option naming them in a run
+result_files = {
+    "payments": ("result_payments_assigned", "result-payments-assigned.csv"),
+    "fees": ("result_amazon-fees", "result-amazon-fees.csv"),
+    "receipts": (None, "result-receipts-left.csv"),
+    "report": (None, "result-report.csv"),
+}
+
+# columns with few distinct values, interned so the rows share them
+_shared_columns = ("Gegenkonto", "Datum", "Konto", "Buchungstext", "Zusatzinformation")
+
+# rows returned by a range query unless a limit is given
+default_limit = 1000
+
+
+def open_result(path:'Path', compression:str=None):
+    """Text stream reading a result file written with the given compression"""
+    if compression is None:
+        return path.open(encoding="utf-8", newline="")
+    if compression == "gzip":
+        import gzip
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("Reading zstd compressed results needs the zstandard package")
+    # appended runs add a frame each
+    binary = zstandard.ZstdDecompressor().stream_reader(path.open("rb"), read_across_frames=True, closefd=True)
+    return io.TextIOWrapper(binary, encoding="utf-8", newline="")
+
+
+def _day_key(datum:str) -> str:
+    """Sortable key of a Datum value: 17.08.2018 09:15:00 -> 20180817 09:15:00"""
+    return datum[6:10] + datum[3:5] + datum[0:2] + datum[10:]
+
+
+class ResultIndex:
+    """
+    Result files of the latest run loaded once, with hash indexes by order id and Beleg1,
+    the result rows sorted by date for range queries and, if the run wrote rollups, the
+    rollup groups by settlement id (the result files have no settlement ids).
+
+    Rows are kept as the tuples read from the files; an index is never changed once
+    loaded, ResultService replaces it as a whole when a new run finished.
+    """
+
+    def __init__(self, paths:dict, compression:str=None, rollups_path:'Path'=None):
+        """
+        :param paths: result file paths by name of result_files
+        :param rollups_path: rollup file of the runs, see modules.rollups
+        """
+        start = time.perf_counter()
+        self.paths = paths
+        self.loaded = time.time()
+        self.header, self.payments = self._read(paths["payments"], compression)
+        self._fees_header, self.fees = self._read(paths["fees"], compression, required=False)
+        self._receipts_header, self.receipts = self._read(paths["receipts"], compression, required=False)
+        column = self.header.index
+        steuer, beleg1, beleg2, datum = (column("Steuerschlüssel"), column("Beleg1"), column("Beleg2"), column("Datum"))
+        self._by_order = {}
+        self._by_beleg1 = {}
+        for i, row in enumerate(self.payments):
+            # order rows have the receipt sum or #UNKNOWN!, Beleg2 of other rows is their description
+            if row[steuer]:
+                self._by_order.setdefault(row[beleg2], []).append(i)
+            if row[beleg1]:
+                self._by_beleg1.setdefault(row[beleg1], []).append(i)
+        self._fees_by_order = {}
+        if self.fees:
+            fee_order = self._fees_header.index("Beleg2")
+            for i, row in enumerate(self.fees):
+                self._fees_by_order.setdefault(row[fee_order], []).append(i)
+        self._receipts_by_beleg1 = {}
+        self._receipts_by_order = {}
+        if self.receipts:
+            receipt_beleg1 = self._receipts_header.index("Beleg1")
+            receipt_order = self._receipts_header.index("Zusatzinformation")
+            for i, row in enumerate(self.receipts):
+                self._receipts_by_beleg1.setdefault(row[receipt_beleg1], []).append(i)
+                self._receipts_by_order.setdefault(row[receipt_order], []).append(i)
+        keys = [_day_key(row[datum]) for row in self.payments]
+        self._by_date = sorted(range(len(keys)), key=keys.__getitem__)
+        self._date_keys = [keys[i] for i in self._by_date]
+        self._konto = column("Konto")
+        self.settlements = self._load_rollups(rollups_path) if rollups_path is not None else None
+        self.seconds = time.perf_counter() - start
+
+    @staticmethod
+    def _read(path:'Path', compression:str, required:bool=True) -> tuple:
+        """(header, row tuples) of a result file"""
+        if path is None or not path.is_file():
+            if required:
+                raise Exception("Result file {} does not exist, run the reconciliation first".format(path))
+            return None, []
+        shared = {}
+        with open_result(path, compression) as f:
+            reader = csv.reader(f, delimiter=";")
+            header = next(reader, None)
+            if header is None:
+                return None, []
+            positions = [i for i, name in enumerate(header) if name in _shared_columns]
+            rows = []
+            for row in reader:
+                for i in positions:
+                    value = row[i]
+                    row[i] = shared.setdefault(value, value)
+                rows.append(tuple(row))
+        return header, rows
+
+    @staticmethod
+    def _load_rollups(path:'Path') -> dict:
+        """Rollup groups by settlement id, None without a rollup file"""
+        if not path.is_file():
+            return None
+        from .rollups import RollupStore, amounts, _amount_tostring
+        store = RollupStore(path)
+        try:
+            groups = store.query(("settlement_id", "account", "day", "category"))
+        finally:
+            store.close()
+        settlements = {}
+        for (settlement_id, account, day, category), values in groups:
+            group = {"account": account, "day": day, "category": category, "rows": values[0]}
+            group.update((amount, _amount_tostring(value)) for amount, value in zip(amounts, values[1:]))
+            settlements.setdefault(settlement_id, []).append(group)
+        return settlements
+
+    def _rows(self, header:list, rows:list, indexes:list) -> list:
+        return [{name: value or None for name, value in zip(header, rows[i])} for i in indexes]
+
+    def order(self, order:str) -> dict:
+        """
+        Result and fee rows of an order with the receipts it was matched against:
+        matched is False if no receipt was found (#UNKNOWN!), diff lists the "#DIFF!" sums
+        """
+        indexes = self._by_order.get(order, [])
+        results = self._rows(self.header, self.payments, indexes)
+        sums = [result["Steuerschlüssel"] for result in results]
+        return {
+            "order": order,
+            "found": bool(indexes),
+            "matched": any(value != "#UNKNOWN!" for value in sums),
+            "beleg1": sorted({result["Beleg1"] for result, value in zip(results, sums)
+                if value != "#UNKNOWN!" and result["Beleg1"]}),
+            "diff": [value for value in sums if value.startswith("#DIFF!")],
+            "results": results,
+            "fees": self._rows(self._fees_header, self.fees, self._fees_by_order.get(order, [])),
+            "unassigned_receipts": self._rows(self._receipts_header, self.receipts, self._receipts_by_order.get(order, [])),
+        }
+
+    def beleg1(self, beleg1:str) -> dict:
+        """Result rows booked against a Beleg1 and its receipts left unassigned"""
+        indexes = self._by_beleg1.get(beleg1, [])
+        unassigned = self._receipts_by_beleg1.get(beleg1, [])
+        return {
+            "beleg1": beleg1,
+            "found": bool(indexes or unassigned),
+            "results": self._rows(self.header, self.payments, indexes),
+            "unassigned_receipts": self._rows(self._receipts_header, self.receipts, unassigned),
+        }
+
+    def settlement(self, settlement_id:str) -> dict:
+        """Rollup groups of a settlement by account, day and category"""
+        if self.settlements is None:
+            raise LookupError("No rollup file, settlement lookups need a run with --rollups")
+        groups = self.settlements.get(settlement_id, [])
+        return {"settlement_id": settlement_id, "found": bool(groups), "groups": groups}
+
+    def date_range(self, day_from:str=None, day_to:str=None, account:str=None, offset:int=0,
+        limit:int=default_limit) -> dict:
+        """
+        Result rows from day_from to day_to (YYYY-MM-DD, both included) sorted by date
+
+        :param account: only rows of this marketplace account (Konto)
+        :returns: count of all rows in the range and the rows from offset on, at most limit
+        """
+        keys = self._date_keys
+        first = bisect_left(keys, day_from.replace("-", "")) if day_from else 0
+        # the days are followed by the time in the keys
+        end = bisect_right(keys, day_to.replace("-", "") + "~") if day_to else len(keys)
+        indexes = self._by_date[first:end]
+        if account is not None:
+            konto = self._konto
+            payments = self.payments
+            indexes = [i for i in indexes if payments[i][konto] == account]
+        return {"from": day_from, "to": day_to, "account": account, "count": len(indexes), "offset": offset,
+            "rows": self._rows(self.header, self.payments, indexes[offset:offset + limit])}
+
+    def status(self) -> dict:
+        return {
+            "files": {name: str(path) for name, path in self.paths.items() if path is not None},
+            "loaded": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded)),
+            "load_seconds": round(self.seconds, 3),
+            "results": len(self.payments),
+            "fees": len(self.fees),
+            "unassigned_receipts": len(self.receipts),
+            "orders": len(self._by_order),
+            "settlements": len(self.settlements) if self.settlements is not None else None,
+        }
+
+
+class ResultService:
+    """
+    Read-only HTTP/JSON service answering lookups from the result files of the latest run:
+
+    * GET /orders/<order id>: result and fee rows, Beleg1, #DIFF! sums of an order
+    * GET /beleg1/<Beleg1>: result rows and unassigned receipts of a Beleg1
+    * GET /settlements/<settlement id>: rollup groups of a settlement (runs with --rollups)
+    * GET /rows?from=YYYY-MM-DD&to=YYYY-MM-DD&account=&offset=&limit=: result rows by date
+    * GET /status: loaded files and row counts
+
+    The files are checked every interval seconds and loaded again in the background
+    once a run finished writing them (the report is written last and all files stayed
+    unchanged for settle seconds); lookups are answered from the previous index meanwhile.
+    """
+
+    def __init__(self, options:dict, interval:float=2.0, settle:float=0.5):
+        """
+        :param options: configuration of the runs whose results are served
+        :param interval: seconds between two checks for new results
+        :param settle: seconds the result files have to stay unchanged before they are loaded
+        """
+        from .payments import result_directory, rollups_file
+        fmt = options.get("output_format", None) or "csv"
+        if fmt != "csv":
+            raise Exception("The query service reads csv result files, not {}".format(fmt))
+        self.compression = options.get("compress", None)
+        directory = result_directory(options) or Path(".")
+        self.paths = {}
+        for name, (option, default) in result_files.items():
+            file = options.get(option, default) if option is not None else default
+            self.paths[name] = directory / result_file_name(file, "csv", self.compression)
+        rollups = options.get("rollups_file", None)
+        self.rollups_path = Path(rollups) if rollups is not None else directory / rollups_file
+        self.interval = interval
+        self.settle = settle
+        self.debug = options.get("debug", False)
+        self.index = None
+        self._loaded_signature = None
+        self._stop = threading.Event()
+
+    def signature(self) -> tuple:
+        """(size, modification time) of the result files, None for missing ones"""
+        stats = []
+        for path in list(self.paths.values()) + [self.rollups_path]:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                stats.append(None)
+                continue
+            stats.append((stat.st_size, stat.st_mtime_ns))
+        return tuple(stats)
+
+    def _finished(self, signature:tuple) -> bool:
+        """Whether a run finished writing the result files: the report is written after the other files and the rollups"""
+        payments, fees, receipts, report, rollups = signature
+        if payments is None or report is None:
+            return False
+        return all(stat is None or stat[1] <= report[1] for stat in (payments, fees, receipts, rollups))
+
+    def load(self) -> 'ResultIndex':
+        signature = self.signature()
+        index = ResultIndex(self.paths, self.compression, self.rollups_path)
+        # replaced at once, requests being answered keep the index they started with
+        self.index = index
+        self._loaded_signature = signature
+        print("Loaded {} result rows from {} in {:.2f} seconds".format(len(index.payments), self.paths["payments"].parent,
+            index.seconds))
+        return index
+
+    def check(self) -> bool:
+        """
+        Loads the result files again if a run changed them since they were loaded
+
+        :returns: True if they were loaded again
+        """
+        signature = self.signature()
+        if signature == self._loaded_signature or not self._finished(signature):
+            return False
+        time.sleep(self.settle)
+        if signature != self.signature():
+            # still being written, checked again next time
+            return False
+        print()
+        print("Result files changed, reloading")
+        try:
+            self.load()
+        except Exception as ex:
+            print("[ERROR] {}, still answering from the results loaded before".format(ex))
+            self._loaded_signature = signature
+            return False
+        return True
+
+    def _reload_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def answer(self, target:str) -> tuple:
+        """
+        Response to a GET request
+
+        :param target: request path with the query string
+        :returns: (HTTP status, JSON-serializable body)
+        """
+        index = self.index
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        try:
+            if parts == ["status"]:
+                return 200, index.status()
+            if len(parts) == 2 and parts[0] == "orders":
+                return 200, index.order(parts[1])
+            if len(parts) == 2 and parts[0] == "beleg1":
+                return 200, index.beleg1(parts[1])
+            if len(parts) == 2 and parts[0] == "settlements":
+                return 200, index.settlement(parts[1])
+            if parts == ["rows"]:
+                query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                return 200, index.date_range(query.get("from"), query.get("to"), query.get("account"),
+                    int(query.get("offset", 0)), int(query.get("limit", default_limit)))
+        except LookupError as ex:
+            return 404, {"error": str(ex)}
+        except ValueError as ex:
+            return 400, {"error": str(ex)}
+        return 404, {"error": "Unknown path {}, see /status, /orders/<order id>, /beleg1/<Beleg1>, "
+            "/settlements/<settlement id> and /rows?from=&to=".format(url.path)}
+
+    def server(self, host:str="127.0.0.1", port:int=8765) -> 'ThreadingHTTPServer':
+        """HTTP server answering from this service, port 0 picks a free port"""
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keeps connections open between requests
+            protocol_version = "HTTP/1.1"
+            # headers and body are written separately, without this each response waits for a delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                status, body = service.answer(self.path)
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                if service.debug:
+                    super().log_message(format, *args)
+
+        return ThreadingHTTPServer((host, port), Handler)
+
+    def serve(self, host:str="127.0.0.1", port:int=8765) -> None:
+        """Loads the results and answers requests until interrupted (Ctrl+C)"""
+        if self.index is None:
+            self.load()
+        server = self.server(host, port)
+        reloader = threading.Thread(target=self._reload_loop, daemon=True)
+        reloader.start()
+        print("Serving results on http://{}:{}/ (reloading when a run finished)".format(*server.server_address[:2]))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print()
+            print("Stopped serving")
+        finally:
+            self._stop.set()
+            server.server_close()
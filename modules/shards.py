@@ -0,0 +1,216 @@
+import heapq
+import pickle
+import zlib
+from operator import itemgetter
+from pathlib import Path
+
+from .utility import iter_csv
+
+
+# records pickled together
+batch_size = 10000
+
+
+def shard_of(order:str, count:int) -> int:
+    """Shard of an order id, the same in every process (unlike hash())"""
+    return zlib.crc32((order or "").encode("utf-8")) % count
+
+
+def _refund_key(beleg1):
+    # ReceiptIndex looks refunds up by the upper-cased and stripped Beleg1
+    return beleg1.upper().strip() if beleg1 is not None else None
+
+
+class ShardWriter:
+    """
+    Appends records to one file per shard as pickled batches, see read_records
+    """
+
+    def __init__(self, directory:'Path', name:str, count:int):
+        self.paths = [Path(directory) / "{}-{:04d}.pickle".format(name, shard) for shard in range(count)]
+        self._files = [path.open("wb") for path in self.paths]
+        self._batches = [[] for _ in range(count)]
+        self.count = 0
+
+    def add(self, shard:int, record) -> None:
+        batch = self._batches[shard]
+        batch.append(record)
+        self.count += 1
+        if len(batch) >= batch_size:
+            pickle.dump(batch, self._files[shard], protocol=pickle.HIGHEST_PROTOCOL)
+            batch.clear()
+
+    def close(self) -> None:
+        for batch, f in zip(self._batches, self._files):
+            if batch:
+                pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+                batch.clear()
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_records(path:'Path') -> 'Iterator':
+    """Records of a shard file, in the order they were added"""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            yield from batch
+
+
+def merge_records(paths:list) -> 'Iterator':
+    """Records of several shard files sorted by (sequence number, ...) in one stream"""
+    return heapq.merge(*(read_records(path) for path in paths), key=itemgetter(0))
+
+
+def partition_receipts(path:'Path', directory:'Path', count:int) -> list:
+    """
+    Splits the receipts into shards by order id, as (row number, receipt) records
+
+    PaymentDB.find_receipt returns all receipts sharing the Beleg1 of the receipt
+    found for an order, and these may belong to other orders. So a receipt is written
+    to the shard of its own order and to the shards of all orders that look up its
+    Beleg1 (as is or as refund id). Receipts without Beleg1 are found for unknown
+    orders and go to every shard. The first pass only keeps the shards per Beleg1.
+
+    :returns: paths of the shard files
+    """
+    every_shard = (1 << count) - 1
+    shards = {None: every_shard}
+    for receipt in iter_csv(path):
+        bit = 1 << shard_of(receipt["Zusatzinformation"], count)
+        beleg1 = receipt["Beleg1"]
+        shards[beleg1] = shards.get(beleg1, 0) | bit
+        refund_key = _refund_key(beleg1)
+        shards[refund_key] = shards.get(refund_key, 0) | bit
+    with ShardWriter(directory, "receipts", count) as writer:
+        for index, receipt in enumerate(iter_csv(path)):
+            mask = shards[receipt["Beleg1"]]
+            shard = 0
+            while mask:
+                if mask & 1:
+                    writer.add(shard, (index, receipt))
+                mask >>= 1
+                shard += 1
+    return writer.paths
+
+
+def partition_payments(stores:list, load, directory:'Path', count:int, classification:dict=None) -> tuple:
+    """
+    Splits the prepared settlement rows into shards by order id, as
+    (sequence number, account, Payment) records. Rows without order id (transfers,
+    fees) don't need receipts and are spread over all shards.
+
+    Like PaymentDB.load_payments, a file that can't be read is skipped: the rows of
+    it already written are left out by reconcile_shard.
+
+    :param stores: loaded settlement files, see PaymentDB.load_payments
+    :param load: load(path) yields the prepared rows of a settlement file
+    :param classification: gets the rows by category of each file, see PaymentDB.classification
+    :returns: (paths of the shard files, number of rows, (first, end) sequence numbers of the skipped files)
+    """
+    from .cues import categories
+    if classification is None:
+        classification = {}
+    sequence = 0
+    skipped = []
+    with ShardWriter(directory, "payments", count) as writer:
+        for store in stores:
+            print()
+            print("Partitioning {}...".format(store["file"]), end="")
+            account = store["account"]
+            first = sequence
+            counts = classification[store["file"]] = dict.fromkeys(categories, 0)
+            try:
+                for payment in load(store["path"]):
+                    counts[payment.category] += 1
+                    order = payment.order
+                    writer.add(shard_of(order, count) if order else sequence % count, (sequence, account, payment))
+                    sequence += 1
+            except Exception as ex:
+                print("[ERROR] {}".format(ex))
+                skipped.append((first, sequence))
+                continue
+            print("...done!")
+    return writer.paths, sequence - sum(end - first for first, end in skipped), skipped
+
+
+def reconcile_shard(task:tuple) -> dict:
+    """
+    Reconciles the settlement rows of one shard against its receipts, in a worker
+    process or the main one. Writes the result rows, fee rows (both by sequence
+    number) and the receipts with their assigned flags (by row number) into the
+    shard directory.
+
+    :param task: (shard, receipt shard file, payment shard file, shard directory,
+        skipped sequence numbers as returned by partition_payments, options)
+    :returns: (totals, Rollups or None) of the shard
+    """
+    from .payments import PaymentDB
+    shard, receipt_path, payment_path, directory, skipped, options = task
+    receipts = []
+    numbers = []
+    for index, receipt in read_records(receipt_path):
+        receipt["assigned"] = False
+        receipts.append(receipt)
+        numbers.append(index)
+    payment_db = PaymentDB([], options, receipts=receipts)
+    totals = dict.fromkeys(PaymentDB.totals_keys, 0)
+    directory = Path(directory)
+    with ShardWriter(directory, "results-{:04d}".format(shard), 1) as results, \
+            ShardWriter(directory, "fees-{:04d}".format(shard), 1) as fees:
+        for sequence, account, payment in read_records(payment_path):
+            if skipped and any(first <= sequence < end for first, end in skipped):
+                continue
+            res, fee = payment_db._reconcile(payment, account, totals)
+            results.add(0, (sequence, res))
+            if fee is not None:
+                fees.add(0, (sequence, fee))
+    with ShardWriter(directory, "assigned-{:04d}".format(shard), 1) as assigned:
+        for index, receipt in zip(numbers, receipts):
+            assigned.add(0, (index, receipt.pop("assigned"), receipt))
+    return totals, payment_db.rollups
+
+
+def shard_outputs(directory:'Path', name:str, count:int) -> list:
+    """Paths of the files reconcile_shard wrote for all shards"""
+    return [Path(directory) / "{}-{:04d}-0000.pickle".format(name, shard) for shard in range(count)]
+
+
+def merge_receipts(paths:list) -> 'Iterator':
+    """
+    Receipts of all shards in file order, copies in several shards merged:
+    yields (receipt, assigned in any shard)
+    """
+    current = None
+    assigned = False
+    receipt = None
+    for index, is_assigned, row in merge_records(paths):
+        if index != current:
+            if current is not None:
+                yield receipt, assigned
+            current = index
+            assigned = False
+            receipt = row
+        assigned = assigned or is_assigned
+    if current is not None:
+        yield receipt, assigned
+
+
+def merge_totals(shard_totals:list, keys:list) -> dict:
+    """
+    Totals of all shards. Decimal sums are exact, so they are the same as the
+    totals of a run over all rows, exponent included.
+    """
+    totals = dict.fromkeys(keys, 0)
+    for shard in shard_totals:
+        for key in keys:
+            totals[key] = totals[key] + shard[key]
+    return totals
@@ -0,0 +1,121 @@
+import sqlite3
+from datetime import datetime
+from decimal import Decimal
+from hashlib import sha1
+from pathlib import Path
+
+
+class StateStore:
+    """
+    On-disk state of incremental reconciliation runs, kept in a SQLite file.
+
+    Records the settlement files already processed (by content hash, with their path,
+    size and number of rows), the receipts already assigned and the running report
+    totals, so the next run only has to process new settlement files and the rows
+    appended to processed ones. Files failing in the middle of a streamed run are
+    recorded as incomplete with the rows written, the next run continues after them.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS files (hash TEXT PRIMARY KEY, name TEXT, rows INTEGER, processed TEXT,
+            path TEXT, size INTEGER, complete INTEGER);
+        CREATE TABLE IF NOT EXISTS receipts (key TEXT PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, kind TEXT, value TEXT);
+    """
+
+    def __init__(self, path:'Path'):
+        self.path = Path(path)
+        self._db = sqlite3.connect(str(self.path))
+        self._db.executescript(self.schema)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(files)")]
+        with self._db:
+            # state files of earlier versions
+            for column, kind in (("path", "TEXT"), ("size", "INTEGER"), ("complete", "INTEGER")):
+                if column not in columns:
+                    self._db.execute("ALTER TABLE files ADD COLUMN {} {}".format(column, kind))
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_path ON files (path)")
+        self._receipt_keys = []
+
+    def __len__(self):
+        """Number of settlement files processed so far"""
+        return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def is_processed(self, digest:str) -> bool:
+        # files of earlier versions have no complete flag and were processed completely
+        row = self._db.execute("SELECT 1 FROM files WHERE hash = ? AND complete IS NOT 0", (digest,)).fetchone()
+        return row is not None
+
+    def earlier(self, path:'Path') -> tuple:
+        """
+        (content hash, rows, size) of the last processed version of a settlement file,
+        also an incomplete one, None if it wasn't processed before
+        """
+        return self._db.execute("SELECT hash, rows, size FROM files WHERE path = ? ORDER BY rowid DESC LIMIT 1",
+            (file_key(path),)).fetchone()
+
+    def restore_receipts(self, receipts:list) -> int:
+        """
+        Sets the "assigned" flag of the receipts assigned in earlier runs
+
+        :param receipts: receipts as loaded by load_receipts
+        :returns: number of receipts restored as assigned
+        """
+        self._receipt_keys = receipt_keys(receipts)
+        assigned = set(key for (key,) in self._db.execute("SELECT key FROM receipts"))
+        count = 0
+        for key, receipt in zip(self._receipt_keys, receipts):
+            if key in assigned:
+                receipt["assigned"] = True
+                count += 1
+        return count
+
+    def restore_totals(self, names:list) -> dict:
+        """
+        Running totals of earlier runs, 0 for totals not recorded yet
+        """
+        totals = dict.fromkeys(names, 0)
+        for name, kind, value in self._db.execute("SELECT name, kind, value FROM totals"):
+            if name in totals:
+                totals[name] = Decimal(value) if kind == "decimal" else int(value)
+        return totals
+
+    def save(self, files:list, receipts:list, totals:dict) -> None:
+        """
+        Records a finished run in one transaction
+
+        :param files: (content hash, file name, number of rows, path, size, complete) of the settlement files processed
+        :param receipts: all receipts, the assigned ones are recorded
+        :param totals: running totals after the run
+        """
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(digest, name, rows, now, file_key(path) if path is not None else None, size, int(complete))
+                    for digest, name, rows, path, size, complete in files])
+            self._db.executemany("INSERT OR IGNORE INTO receipts VALUES (?)",
+                [(key,) for key, receipt in zip(self._receipt_keys, receipts) if receipt["assigned"]])
+            self._db.executemany("INSERT OR REPLACE INTO totals VALUES (?, ?, ?)",
+                [(name, "decimal" if isinstance(value, Decimal) else "int", str(value)) for name, value in totals.items()])
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def file_key(path:'Path') -> str:
+    """Path a settlement file is recorded under"""
+    return str(Path(path).resolve())
+
+
+def receipt_keys(receipts:list) -> list:
+    """
+    Stable keys of receipts: hash of the row contents plus the occurrence of identical rows
+    """
+    seen = {}
+    keys = []
+    for receipt in receipts:
+        content = "\x1f".join(str(value) for key, value in receipt.items() if key != "assigned")
+        digest = sha1(content.encode("utf-8")).hexdigest()
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        keys.append("{}:{}".format(digest, occurrence))
+    return keys
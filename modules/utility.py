@@ -1,76 +1,109 @@
 import csv
+from itertools import chain
 from pathlib import Path
 from functools import lru_cache
-from difflib import SequenceMatcher
+from hashlib import sha256
 
+from .writers import CsvWriter
 
-def readcsv(p:'Path', fieldset:list=None, skip_row=0) -> list:
+
+def readcsv(p:'Path', fieldset:list=None, skip_row=0, columns:list=None) -> list:
     """
     Load contents of a csv file
 
     :param p: Path to the csv file
     :param fieldset: 
+    :param skip_row: number of preamble lines to skip
+    :param columns: only keep these columns in the rows, all if None
     :returns: Contents of the csv file
     """
+    db = list(iter_csv(p, fieldset=fieldset, skip_row=skip_row, columns=columns))
+    if not db:
+        raise Exception("File {} is empty".format(p))
+    return db
+
+
+def iter_csv(p:'Path', fieldset:list=None, skip_row=0, columns:list=None) -> 'Iterator[dict]':
+    """
+    Lazily load contents of a csv file.
+    The file is opened once, when the rows are first asked for, and closed after the
+    last one, so iterators not used yet hold no file descriptor: the first skip_row
+    lines are skipped without being parsed, the delimiter is detected on the line
+    after them and the rows are read on iteration.
+
+    :param p: Path to the csv file
+    :param fieldset: 
+    :param skip_row: number of preamble lines to skip
+    :param columns: only keep these columns in the rows, all if None
+    :returns: Iterator over the rows of the csv file
+    """
     pp = p
     # Check if p is not instance of Path class
     if isinstance(p, str):
         pp = Path(p)
-    # Check if file exists. If not exit Python
-    if not pp.is_file():
-        raise Exception('File {} does not exist'.format(p))
     # Check if file is csv. If not exit Python
     suf = pp.suffix
     if suf != ".csv":
         raise Exception("Invalid file type {}. Supply a csv file".format(p))
-    db = []
-    # Read csv file 
-    line = ""
-    delim = ","
-    with open(pp, encoding="utf-8") as f:
-        line = f.readlines()[skip_row:skip_row + 1]
-    if line:
-        num1 = line[0].count(";")
-        num2 = line[0].count(",")
-        delim = ";" if num1 > num2 else ","
-    else:
-        raise Exception("File {} is empty".format(p))
+    return _iter_rows(pp, p, fieldset, skip_row, columns)
+
 
-    count = 0
-    with pp.open(encoding="utf-8") as csv_file:
-        csv_reader = csv.DictReader(csv_file, fieldnames=fieldset, delimiter=delim)
+def sniff_delimiter(line:str) -> str:
+    """
+    Detects the delimiter of a csv line: ";" if it has more semicolons than commas, else ","
+    """
+    return ";" if line.count(";") > line.count(",") else ","
+
+
+def _iter_rows(pp:'Path', p, fieldset:list, skip_row:int, columns:list) -> 'Iterator[dict]':
+    # Read csv file, a missing file is found on open instead of with an extra stat call
+    try:
+        csv_file = pp.open(encoding="utf-8")
+    except (FileNotFoundError, IsADirectoryError):
+        raise Exception('File {} does not exist'.format(p))
+    with csv_file:
+        for _ in range(skip_row):
+            csv_file.readline()
+        line = csv_file.readline()
+        if not line:
+            raise Exception("File {} is empty".format(p))
+        delim = sniff_delimiter(line)
+        csv_reader = csv.reader(chain((line,), csv_file), delimiter=delim)
         try:
+            fieldnames = fieldset if fieldset is not None else next(csv_reader, [])
+            width = len(fieldnames)
+            picks = None
+            if columns is not None:
+                picks = [(name, fieldnames.index(name)) for name in columns]
             for row in csv_reader:
-                if count < skip_row:
-                    count += 1
+                if not row:
+                    continue
+                # same rows as csv.DictReader would give
+                if picks is not None:
+                    size = len(row)
+                    yield {name: row[i] if i < size else None for name, i in picks}
                     continue
-                db.append(row)
+                data = dict(zip(fieldnames, row))
+                size = len(row)
+                if width < size:
+                    data[None] = row[width:]
+                elif width > size:
+                    for key in fieldnames[size:]:
+                        data[key] = None
+                yield data
         except csv.Error as e:
-            raise Exception('File {}, line {}: {}'.format(str(p), csv_reader.line_num, e))
-    if not db:
-        raise Exception("File {} is empty".format(p))
-    return db
+            raise Exception('File {}, line {}: {}'.format(str(p), csv_reader.line_num + skip_row, e))
 
 
-def save_csv(target:str, data:list, fieldnames:list) -> None:
+def save_csv(target:str, data:list, fieldnames:list, append:bool=False) -> None:
         """
         Write list into target.csv file
         :param target: Target file Path or string
+        :param append: append to an existing file instead of overwriting it
         :returns: None
         """
-        target_path = target
-        if isinstance(target, str):
-            target_path = Path(target)
-        # Write table into a file
-        print("Saving results into %s..." % target)
-        if not data:
-            print("[WARNING] Resulting file is empty")
-            data = []
-        with target_path.open('w', encoding='utf-8', newline='') as target_file:
-            writer = csv.DictWriter(target_file, fieldnames=fieldnames, extrasaction='ignore', 
-                delimiter=';', quoting=csv.QUOTE_MINIMAL)
-            writer.writeheader()
-            writer.writerows(data)
+        with CsvWriter(target, fieldnames, append=append) as writer:
+            writer.writerows(data or [])
 
 def create_directory(output_dir_path:Path, debug:bool):
     """
@@ -90,8 +123,31 @@ def create_directory(output_dir_path:Path, debug:bool):
         message = "Output directory %s is missing. Attempt to create one FAILED" % output_dir_path
         raise FileNotFoundError(message)
 
+def file_digest(p:'Path', chunk_size:int=1 << 20, size:int=None) -> str:
+    """
+    SHA-256 of the contents of a file
+
+    :param size: only hash the first size bytes
+    """
+    digest = sha256()
+    with open(p, "rb") as f:
+        if size is None:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        else:
+            while size > 0:
+                chunk = f.read(min(chunk_size, size))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size -= len(chunk)
+    return digest.hexdigest()
+
+
 @lru_cache()
 def find_similarity(a:str, b:str) -> int:
+    # only fuzzy matching needs difflib
+    from difflib import SequenceMatcher
     return int(SequenceMatcher(None, a, b).ratio() * 100)
 
 
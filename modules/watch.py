@@ -0,0 +1,151 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+
+# inotify event masks, from linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_ISDIR = 0x40000000
+
+watch_mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+_event = struct.Struct("iIII")
+
+
+def snapshot(source:'Path', ext:str) -> dict:
+    """
+    (size, modification time) of the files with extension ext in source, a file or a directory searched recursively
+    """
+    source = Path(source)
+    files = {}
+    if source.is_file():
+        stat = source.stat()
+        return {source: (stat.st_size, stat.st_mtime_ns)}
+    stack = [source]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(Path(entry.path))
+                elif entry.name.endswith(ext):
+                    stat = entry.stat()
+                    files[Path(entry.path)] = (stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                # removed while scanning
+                continue
+    return files
+
+
+class Watcher:
+    """
+    Waits for changes in directories: with inotify on Linux, by polling otherwise.
+
+    wait only tells that something may have changed, callers compare snapshots to
+    find out what. With polling, wait returns after every interval.
+    """
+
+    def __init__(self, directories:list, interval:float=2.0, use_inotify:bool=True, flat:list=()):
+        """
+        :param directories: directories watched recursively
+        :param interval: seconds between two polls without inotify
+        :param use_inotify: use inotify where available
+        :param flat: directories watched without their subdirectories
+        """
+        self.interval = interval
+        self._fd = None
+        self._watches = {}
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self._open_inotify()
+                for directory in directories:
+                    self._add_tree(Path(directory))
+                for directory in flat:
+                    self._add_watch(Path(directory), recursive=False)
+            except OSError as ex:
+                print("[WARNING] inotify not available ({}), polling every {} seconds".format(ex, interval))
+                self.close()
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._fd is not None
+
+    def _open_inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._libc = libc
+        self._fd = fd
+
+    def _add_watch(self, directory:'Path', recursive:bool=True) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(str(directory)), watch_mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "{}: {}".format(directory, os.strerror(errno)))
+        self._watches[wd] = (directory, recursive)
+
+    def _add_tree(self, directory:'Path') -> None:
+        self._add_watch(directory)
+        for root, dirs, _ in os.walk(directory):
+            for name in dirs:
+                self._add_watch(Path(root) / name)
+
+    def wait(self, timeout:float=None) -> bool:
+        """
+        Blocks until something changed in the watched directories or the timeout passed
+
+        :param timeout: seconds, None waits for the next change (inotify) or interval (polling)
+        :returns: True if inotify reported a change, always True when polling
+        """
+        if self._fd is None:
+            time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+            return True
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        self._read_events()
+        return True
+
+    def _read_events(self) -> None:
+        while True:
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                return
+            self._handle_events(data)
+
+    def _handle_events(self, data:bytes) -> None:
+        offset = 0
+        while offset + _event.size <= len(data):
+            wd, mask, _, length = _event.unpack_from(data, offset)
+            name = data[offset + _event.size:offset + _event.size + length].rstrip(b"\0")
+            offset += _event.size + length
+            directory, recursive = self._watches.get(wd, (None, False))
+            if recursive and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    # new subdirectory, files may already be in it
+                    self._add_tree(directory / os.fsdecode(name))
+                except OSError:
+                    pass
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._watches = {}
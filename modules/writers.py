@@ -0,0 +1,264 @@
+import csv
+import io
+import json
+from pathlib import Path
+
+
+# output formats of the result files
+formats = ("csv", "parquet", "arrow", "columns")
+# compressions of csv and columns output
+compressions = ("gzip", "zstd")
+
+suffixes = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow", "columns": ".columns.jsonl"}
+compression_suffixes = {"gzip": ".gz", "zstd": ".zst"}
+
+# rows buffered before they are written
+batch_size = 10000
+
+# file buffer of the text and binary streams
+buffer_size = 1 << 20
+
+_pyarrow = None
+
+
+def load_pyarrow():
+    """
+    pyarrow with its parquet and ipc modules, None if it isn't installed.
+    Imported on first use, it takes a while to import and most runs write csv only.
+    """
+    global _pyarrow
+    if _pyarrow is None:
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+            _pyarrow = pyarrow
+        except ImportError:
+            _pyarrow = False
+    return _pyarrow or None
+
+
+def output_format(requested:str) -> str:
+    """
+    Output format actually written: parquet and arrow fall back to the pure Python
+    "columns" format without pyarrow
+    """
+    requested = requested or "csv"
+    if requested not in formats:
+        raise Exception("Invalid output format {}. Supported formats - {}".format(requested, ", ".join(formats)))
+    if requested in ("parquet", "arrow") and load_pyarrow() is None:
+        print("[WARNING] pyarrow is not installed, writing {} output as columns".format(requested))
+        return "columns"
+    return requested
+
+
+def result_file_name(file:str, fmt:str="csv", compression:str=None) -> str:
+    """
+    Name of a result file in the given format, e.g. result-report.csv -> result-report.csv.gz
+    """
+    if compression is not None and compression not in compressions:
+        raise Exception("Invalid compression {}. Supported compressions - {}".format(compression, ", ".join(compressions)))
+    stem = file[:-len(".csv")] if file.endswith(".csv") else file
+    name = stem + suffixes[fmt]
+    if compression is not None and fmt in ("csv", "columns"):
+        name += compression_suffixes[compression]
+    return name
+
+
+def open_binary(path:'Path', compression:str=None, append:bool=False):
+    """
+    Binary stream writing into path, compressed with gzip or zstd.
+    Appending adds a new gzip member / zstd frame, which readers decompress as one stream.
+    """
+    mode = "ab" if append else "wb"
+    if compression is None:
+        return open(path, mode, buffering=buffer_size)
+    if compression == "gzip":
+        import gzip
+        # level 1: about half the time of the default level, a few percent larger on result files
+        return gzip.open(path, mode, compresslevel=1)
+    if compression == "zstd":
+        try:
+            # optional, only needed for zstd compressed output
+            import zstandard
+        except ImportError:
+            raise Exception("zstd compression needs the zstandard package")
+        return zstandard.ZstdCompressor().stream_writer(open(path, mode, buffering=buffer_size), closefd=True)
+    raise Exception("Invalid compression {}".format(compression))
+
+
+class ResultWriter:
+    """
+    Base of the result file writers: rows are taken one at a time and written in
+    batches of batch_size rows. Rows are dicts by column name, or tuples in the order
+    of fieldnames with tuples set (see modules.rendering).
+    """
+
+    def __init__(self, target, fieldnames:list, append:bool=False, batch:int=None, tuples:bool=False):
+        """
+        :param target: Target file Path or string
+        :param fieldnames: columns of the result file
+        :param append: append to an existing file instead of overwriting it
+        :param batch: rows buffered before they are written
+        :param tuples: rows are tuples instead of dicts
+        """
+        target_path = Path(target)
+        append = append and target_path.is_file() and target_path.stat().st_size > 0
+        if append:
+            print("Appending results to %s..." % target)
+        else:
+            print("Saving results into %s..." % target)
+        self.path = target_path
+        self.fieldnames = fieldnames
+        self.count = 0
+        self.append = append
+        self.batch = batch or batch_size
+        self.tuples = tuples
+        self._rows = []
+        self._closed = False
+
+    def writerow(self, row:dict) -> None:
+        self._rows.append(row)
+        self.count += 1
+        if len(self._rows) >= self.batch:
+            self.flush()
+
+    def writerows(self, rows) -> None:
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self) -> None:
+        if self._rows:
+            self._write_batch(self._rows)
+            self._rows = []
+
+    def _write_batch(self, rows:list) -> None:
+        raise NotImplementedError
+
+    def _finish(self) -> None:
+        pass
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.flush()
+        finally:
+            self._finish()
+        if not self.count and not self.append:
+            print("[WARNING] Resulting file is empty")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CsvWriter(ResultWriter):
+    """
+    Writes rows into a DATEV style csv file (";" separated), optionally gzip or zstd compressed
+    """
+
+    def __init__(self, target, fieldnames:list, append:bool=False, compression:str=None, batch:int=None,
+        tuples:bool=False):
+        super().__init__(target, fieldnames, append, batch, tuples)
+        binary = open_binary(self.path, compression, self.append)
+        self._file = io.TextIOWrapper(binary, encoding="utf-8", newline="")
+        if tuples:
+            # the same lines as DictWriter without looking up each column
+            self._writer = csv.writer(self._file, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+            if not self.append:
+                self._writer.writerow(fieldnames)
+            return
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames, extrasaction='ignore',
+            delimiter=';', quoting=csv.QUOTE_MINIMAL)
+        if not self.append:
+            self._writer.writeheader()
+
+    def _write_batch(self, rows:list) -> None:
+        self._writer.writerows(rows)
+
+    def sync(self) -> int:
+        """
+        Writes the buffered rows through to the disk
+
+        :returns: size of the file so far (uncompressed files only)
+        """
+        import os
+        self.flush()
+        self._file.flush()
+        binary = self._file.buffer
+        binary.flush()
+        os.fsync(binary.fileno())
+        return binary.tell()
+
+    def _finish(self) -> None:
+        self._file.close()
+
+
+class ColumnarWriter(ResultWriter):
+    """
+    Writes rows column by column: one Parquet row group or Arrow record batch per batch
+    (with pyarrow), or one JSON object of column lists per line ("columns" format).
+    Values are written as the strings of the csv files, empty values as null.
+    Columnar files can't be appended to.
+    """
+
+    def __init__(self, target, fieldnames:list, fmt:str="columns", append:bool=False, compression:str=None,
+        batch:int=None, tuples:bool=False):
+        super().__init__(target, fieldnames, append, batch, tuples)
+        if self.append:
+            raise Exception("Can't append to {}, {} files are written at once".format(self.path, fmt))
+        self.format = fmt
+        self._sink = None
+        if fmt == "columns":
+            self._sink = open_binary(self.path, compression)
+            return
+        pyarrow = load_pyarrow()
+        self._schema = pyarrow.schema([(name, pyarrow.string()) for name in fieldnames])
+        if fmt == "parquet":
+            self._sink = pyarrow.parquet.ParquetWriter(str(self.path), self._schema, compression=compression or "snappy")
+        elif fmt == "arrow":
+            if compression == "gzip":
+                raise Exception("Arrow files support zstd compression only")
+            options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+            self._sink = pyarrow.ipc.new_file(str(self.path), self._schema, options=options)
+        else:
+            raise Exception("Invalid columnar format {}".format(fmt))
+
+    def _columns(self, rows:list) -> dict:
+        columns = {}
+        if self.tuples:
+            values_of = dict(zip(self.fieldnames, zip(*rows)))
+        for name in self.fieldnames:
+            values = values_of[name] if self.tuples else [row.get(name) for row in rows]
+            columns[name] = [None if value is None or value == "" else str(value) for value in values]
+        return columns
+
+    def _write_batch(self, rows:list) -> None:
+        columns = self._columns(rows)
+        if self.format == "columns":
+            self._sink.write(json.dumps(columns, ensure_ascii=False).encode("utf-8"))
+            self._sink.write(b"\n")
+            return
+        pyarrow = load_pyarrow()
+        batch = pyarrow.record_batch([pyarrow.array(columns[name], pyarrow.string()) for name in self.fieldnames],
+            schema=self._schema)
+        self._sink.write_batch(batch)
+
+    def _finish(self) -> None:
+        if self._sink is not None:
+            self._sink.close()
+
+
+def open_writer(target, fieldnames:list, fmt:str="csv", compression:str=None, append:bool=False, batch:int=None,
+    tuples:bool=False):
+    """
+    Writer of a result file in the given format, see CsvWriter and ColumnarWriter
+    """
+    if fmt == "csv":
+        return CsvWriter(target, fieldnames, append=append, compression=compression, batch=batch, tuples=tuples)
+    return ColumnarWriter(target, fieldnames, fmt, append=append, compression=compression, batch=batch,
+        tuples=tuples)
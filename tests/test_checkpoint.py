@@ -0,0 +1,60 @@
+"""
+Resumed checkpointed runs write the same result files as uninterrupted runs.
+
+    python -m pytest tests
+"""
+import contextlib
+import io
+import shutil
+from pathlib import Path
+
+import pytest
+
+from modules.payments import PaymentDB
+from benchmarks.synthetic import generate
+
+
+result_files = ("result-payments-assigned.csv", "result-amazon-fees.csv", "result-receipts-left.csv", "result-report.csv")
+
+
+class Interrupted(BaseException):
+    pass
+
+
+def run(config:dict, interrupt_after:int=None) -> None:
+    with contextlib.redirect_stdout(io.StringIO()):
+        payment_db = PaymentDB(sorted(Path(config["payment_source"]).glob("*.csv")), dict(config))
+        if interrupt_after is not None:
+            reconcile = payment_db._reconcile
+            calls = [0]
+            def interrupting(*args, **kwargs):
+                calls[0] += 1
+                if calls[0] > interrupt_after:
+                    raise Interrupted()
+                return reconcile(*args, **kwargs)
+            payment_db._reconcile = interrupting
+        payment_db.load_payments()
+        payment_db.process()
+
+
+def outputs(config:dict) -> dict:
+    return {name: (Path(config["results"]) / name).read_bytes() for name in result_files}
+
+
+@pytest.mark.parametrize("jobs", [None, 2])
+def test_resume_after_failed_file(tmp_path, jobs):
+    config = generate(tmp_path, 1000, langs=["DE", "FR", "IT"])
+    config["jobs"] = jobs
+    # sorted first, fails to load
+    (Path(config["payment_source"]) / "settlement-empty-ES.csv").write_text("")
+    run(config)
+    expected = outputs(config)
+    shutil.rmtree(config["results"])
+
+    checkpointed = dict(config, checkpoint=True, checkpoint_rows=300)
+    with pytest.raises(Interrupted):
+        # in the second settlement file
+        run(checkpointed, interrupt_after=1500)
+    run(dict(checkpointed, resume=True))
+    assert outputs(config) == expected
+    assert not (Path(config["results"]) / "reconciliation-checkpoint.pickle").exists()
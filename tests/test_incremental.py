@@ -0,0 +1,66 @@
+"""
+Incremental runs add up the same rows and totals as one run over all settlement files.
+
+    python -m pytest tests
+"""
+import contextlib
+import io
+from pathlib import Path
+
+from modules.daemon import WatchDaemon
+from modules.payments import PaymentDB
+from benchmarks.synthetic import generate
+
+
+def result_lines(config:dict) -> int:
+    with open(Path(config["results"]) / "result-payments-assigned.csv", encoding="utf-8") as f:
+        return sum(1 for _ in f)
+
+
+def report(config:dict) -> str:
+    return (Path(config["results"]) / "result-report.csv").read_text(encoding="utf-8")
+
+
+def test_stream_file_failing_mid_read(tmp_path):
+    config = generate(tmp_path, 300, langs=["DE", "FR"])
+    config.update(incremental=True, stream=True)
+    broken = Path(config["payment_source"]) / "settlement-synthetic-FR.csv"
+    with open(broken, "a", encoding="utf-8") as f:
+        # larger than the field size limit of the csv module, fails after the rows before it
+        f.write("\"{}\"\n".format("x" * 200000))
+    source = sorted(Path(config["payment_source"]).glob("*.csv"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        payment_db = PaymentDB(source, dict(config))
+        payment_db.load_payments()
+        payment_db.process()
+    lines = result_lines(config)
+    expected = report(config)
+    assert lines == 1 + 2 * 300
+    for _ in range(2):
+        with contextlib.redirect_stdout(io.StringIO()):
+            payment_db.update(source)
+        # the rows written before the failure are neither written nor added up again
+        assert result_lines(config) == lines
+        assert report(config) == expected
+
+
+def test_watch_totals_only_report_is_cumulative(tmp_path):
+    config = generate(tmp_path, 300, langs=["DE", "FR", "IT"])
+    config.update(totals_only=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        payment_db = PaymentDB(sorted(Path(config["payment_source"]).glob("*.csv")), dict(config))
+        payment_db.load_payments()
+        payment_db.process()
+    expected = report(config)
+    (Path(config["results"]) / "result-report.csv").unlink()
+
+    later = Path(config["payment_source"]) / "settlement-synthetic-IT.csv"
+    held_back = tmp_path / later.name
+    later.rename(held_back)
+    daemon = WatchDaemon(dict(config), settle=0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        daemon.start()
+        assert daemon.poll()
+        held_back.rename(later)
+        assert daemon.poll()
+    assert report(config) == expected